@@ -1,18 +1,69 @@
-from flask import Flask, request, jsonify, session, send_from_directory
-from flask_session import Session
+from flask import Flask, Response, g, request, jsonify, session, send_from_directory, stream_with_context
+import json
 import os
+import time
 from dotenv import load_dotenv
-from services import booking_manager, chat_agent
 
+# Before the imports below: services read their settings when first imported
 load_dotenv()
 
+from data import bookings_store
+from services import availability_view, booking_manager, booking_service, change_feed, chat_agent, compact, deployment, intent_parser, llm_cache, metrics, prompt_context, session_store, tracing
+
+# Refuse several workers on per-process bookings/sessions (services/deployment.py)
+deployment.check_workers(deployment.served_workers())
+
 app = Flask(__name__, static_folder='static')
 
-# Session Config
+# Session Config (server-side store, see services/session_store.py)
 app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
 app.secret_key = "simulation_secret_key"
-Session(app)
+app.session_interface = session_store.create_session_interface()
+
+# Publish booking changes (this process's and, with SQLite, other workers') to /api/changes
+change_feed.start()
+CHANGES_KEEPALIVE = 15 # seconds between comments on an idle change stream
+
+# Materialised availability, patched from the change feed (services/availability_view.py)
+booking_manager.start_availability_view()
+
+# --- Response formats ---
+
+def _wants_compact() -> bool:
+    # Opt-in only: a plain */* keeps the verbose format
+    return compact.MEDIA_TYPE in request.headers.get('Accept', '')
+
+def _compact_reply(payload: dict) -> Response:
+    body = compact.dumps(payload)
+    response = Response(body, mimetype=compact.MEDIA_TYPE)
+    if len(body) >= compact.GZIP_MIN_BYTES and request.accept_encodings['gzip']:
+        response.set_data(compact.gzip_body(body))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
+
+def _verbose_reply(payload) -> Response:
+    # Negotiated endpoints: caches must key on Accept
+    response = jsonify(payload)
+    response.vary.add('Accept')
+    return response
+
+# --- Request timing and correlation ids ---
+
+app.wsgi_app = tracing.wsgi_middleware(app.wsgi_app)
+
+@app.before_request
+def start_request():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def finish_request(response):
+    # Streams are timed to their first byte; the body is produced after this hook
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    tracing.finish_request(request.method, route, response.status_code,
+                           time.perf_counter() - g.get('request_started', time.perf_counter()))
+    response.headers[tracing.REQUEST_ID_HEADER] = tracing.current_request_id() or ''
+    return response
 
 @app.route('/')
 def home():
@@ -31,6 +82,20 @@ def list_devices():
     devices = booking_manager.get_devices(campus_id, device_code)
     return jsonify(devices)
 
+@app.route('/api/devices/<int:device_id>', methods=['GET'])
+def get_device(device_id):
+    device = booking_manager.get_device(device_id)
+    if device is None:
+        return jsonify({"error": "Device not found"}), 404
+    return jsonify(device)
+
+@app.route('/api/devices/<int:device_id>/calendar', methods=['GET'])
+def get_device_calendar(device_id):
+    calendar = booking_manager.get_calendar(device_id)
+    if calendar is None:
+        return jsonify({"error": "Device not found"}), 404
+    return jsonify(calendar)
+
 @app.route('/api/booked_sessions', methods=['GET']) # Using GET mostly, but payload usually POST for list of IDs. Let's use POST for complex filter
 def list_booked_sessions():
     """
@@ -57,25 +122,166 @@ def get_booked_sessions_api():
         return jsonify({"error": "Missing parameters"}), 400
         
     sessions = booking_manager.get_booked_sessions(device_ids, start_date, end_date)
-    return jsonify(sessions)
+    if _wants_compact():
+        # Sessions the compact format can't represent exactly go out verbose
+        encoded = compact.encode_sessions(sessions)
+        if encoded is not None:
+            return _compact_reply(encoded)
+    return _verbose_reply(sessions)
 
 @app.route('/api/availability', methods=['GET'])
 def check_availability():
+    """
+    Slots for one device and day. Send "Accept: application/vnd.bookingbot.compact+json"
+    here, to /api/availability/batch or to /api/booked_sessions for the compact
+    columnar format (see services/compact.py).
+    """
     device_id = request.args.get('device_id', type=int)
     date = request.args.get('date') # YYYY-MM-DD or ISO
+    duration = request.args.get('duration', type=int) # minutes, device default if omitted
     
     if not device_id or not date:
         return jsonify({"error": "Missing params"}), 400
-        
-    slots = booking_manager.get_availability(device_id, date)
+    
+    try:
+        if _wants_compact():
+            return _compact_reply(booking_manager.get_availability_compact(device_id, date, duration))
+        slots = booking_manager.get_availability(device_id, date, duration)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return _verbose_reply(slots)
+
+@app.route('/api/availability/batch', methods=['POST'])
+def check_availability_batch():
+    """
+    Expects JSON:
+    {
+        "device_ids": [101, 102],   # or "campus_id": 1
+        "start_date": "YYYY-MM-DD",
+        "end_date": "YYYY-MM-DD",
+        "duration": 240             # optional, minutes
+    }
+    """
+    data = request.json or {}
+    device_ids = data.get('device_ids') or []
+    campus_id = data.get('campus_id')
+    start_date = data.get('start_date')
+    end_date = data.get('end_date') or start_date
+
+    if (not device_ids and not campus_id) or not start_date:
+        return jsonify({"error": "Missing parameters"}), 400
+    try:
+        if not isinstance(device_ids, list):
+            raise TypeError
+        device_ids = [int(d) for d in device_ids]
+    except (TypeError, ValueError):
+        return jsonify({"error": "device_ids must be a list of integer ids"}), 400
+    duration = data.get('duration')
+    try:
+        duration = int(duration) if duration is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "duration must be a number of minutes"}), 400
+
+    if _wants_compact():
+        encoded = booking_manager.get_availability_batch_compact(device_ids, start_date, end_date, campus_id=campus_id,
+                                                                 duration=duration)
+        if encoded is not None:
+            return _compact_reply(encoded)
+    results = booking_manager.get_availability_batch(device_ids, start_date, end_date, campus_id=campus_id,
+                                                     duration=duration)
+    return _verbose_reply(results)
+
+@app.route('/api/availability/earliest', methods=['GET'])
+def earliest_availability():
+    """
+    The earliest free slots across the fleet. Query params (all optional):
+    aircraft_type (e.g. 787), campus_id, device_ids (comma separated),
+    start_date / end_date (YYYY-MM-DD), earliest / latest (HH:MM, daily window),
+    duration (minutes), limit (default 5).
+    """
+    device_ids = [int(d) for d in request.args.get('device_ids', '').split(',') if d.strip().isdigit()]
+    try:
+        slots = booking_manager.find_earliest_slots(
+            aircraft_type=request.args.get('aircraft_type'),
+            campus_id=request.args.get('campus_id', type=int),
+            device_ids=device_ids,
+            start_date=request.args.get('start_date'),
+            end_date=request.args.get('end_date'),
+            earliest=request.args.get('earliest'),
+            latest=request.args.get('latest'),
+            duration=request.args.get('duration', type=int),
+            limit=request.args.get('limit', 5, type=int))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     return jsonify(slots)
 
+@app.route('/api/cart/validate', methods=['POST'])
+def validate_cart():
+    """
+    Expects JSON:
+    {
+        "cart": [{"DeviceId": 101, "SlotStart": "ISO", "SlotEnd": "ISO"}, ...],
+        "holder": "token"           # optional, its own holds count as free
+    }
+    """
+    data = request.json or {}
+    cart = data.get('cart') or []
+    if not cart:
+        return jsonify({"error": "Cart is empty"}), 400
+    return jsonify(booking_manager.validate_cart(cart, data.get('holder')))
+
+@app.route('/api/cart/hold', methods=['POST'])
+def hold_cart():
+    """
+    Validates the cart and holds its slots for the holder (see booking_manager.hold_cart).
+    Expects JSON: {"cart": [...], "holder": "token", "ttl": 600}; an empty cart releases the holds.
+    """
+    data = request.json or {}
+    holder = data.get('holder')
+    if not holder:
+        return jsonify({"error": "Missing holder"}), 400
+    ttl = data.get('ttl')
+    if ttl is not None:
+        try:
+            ttl = float(ttl)
+        except (TypeError, ValueError):
+            return jsonify({"error": "ttl must be a number of seconds"}), 400
+        if not ttl > 0:
+            return jsonify({"error": "ttl must be positive"}), 400
+
+    # Longer holds are cut to CART_HOLD_SECONDS
+    result = booking_manager.hold_cart(data.get('cart') or [], holder, ttl)
+    if result['status'] == 'error':
+        return jsonify(result), 409
+    return jsonify(result)
+
+@app.route('/api/cart/hold', methods=['DELETE'])
+def release_cart_hold():
+    holder = request.args.get('holder')
+    if not holder:
+        return jsonify({"error": "Missing holder"}), 400
+    booking_manager.release_holds(holder)
+    return jsonify({"status": "released", "holder": holder})
+
+def _idempotency_key(data: dict):
+    return request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+
+def _booking_reply(result: dict):
+    response = jsonify(result)
+    if result.get('replayed'):
+        response.headers['Idempotent-Replayed'] = 'true'
+    # 409: nothing was booked
+    return response, (409 if result['status'] == 'error' else 200)
+
 @app.route('/api/book', methods=['POST'])
 def book_session():
     # In a real app, cart would be passed or retrieved from session
-    # Here we expect the agent to pass the cart items to confirm
+    # Here we expect the agent to pass the cart items to confirm.
+    # Send an Idempotency-Key header to make retries safe.
     data = request.json
     cart = data.get('cart', [])
+    # Slots held by this holder (see /api/cart/hold) count as free
+    holder = data.get('holder') or session.get('hold_token')
     
     if not cart:
         # Fallback to session cart if implemented there
@@ -84,27 +290,118 @@ def book_session():
     if not cart:
          return jsonify({"error": "Cart is empty"}), 400
          
-    result = booking_manager.book_sessions(cart)
-    
-    # Clear session cart
-    session['cart'] = []
-    
-    return jsonify(result)
+    try:
+        result = booking_manager.book_sessions(cart, holder, _idempotency_key(data))
+    except bookings_store.IdempotencyKeyError as e:
+        return jsonify({"error": str(e)}), 422
+    if result['status'] == 'success':
+        # Clear session cart
+        session['cart'] = []
+    # Otherwise nothing was booked; keep the cart so the user can adjust it
+    return _booking_reply(result)
+
+@app.route('/api/book/bulk', methods=['POST'])
+def book_bulk():
+    """
+    Books a large cart in one batch. Expects JSON:
+    {
+        "items": [{"DeviceId": 101, "SlotStart": "ISO", "SlotEnd": "ISO",
+                   "CustomerCode": "ACME", "TrainingType": "Training"}, ...],
+        "all_or_nothing": false,    # default: book what is free, report the rest
+        "holder": "token"           # optional
+    }
+    with an Idempotency-Key header (or "idempotency_key"): a retry with the same
+    key gets the stored response back instead of booking again.
+    Returns per-item results; 200 if anything was booked, 409 if nothing was.
+    """
+    data = request.json or {}
+    items = data.get('items') or []
+    if not items:
+        return jsonify({"error": "No items"}), 400
+
+    try:
+        result = booking_manager.book_sessions(items, data.get('holder'), _idempotency_key(data),
+                                               partial=not data.get('all_or_nothing'))
+    except bookings_store.IdempotencyKeyError as e:
+        return jsonify({"error": str(e)}), 422
+    return _booking_reply(result)
+
+@app.route('/api/changes', methods=['GET'])
+def booking_changes():
+    """
+    Server-sent events for new bookings: one "change" event per device and commit,
+    {"type": "change", "id", "ts", "device_id", "dates", "booking_ids"}.
+    ?device_ids=101,102 limits the stream to those devices (default: all).
+    Reconnects send Last-Event-ID to get what they missed, or a "resync"
+    event when that is no longer possible. Under asgi.py the stream is served
+    by asgi.changes instead, which doesn't hold a thread per open stream.
+    """
+    device_ids = [int(d) for d in request.args.get('device_ids', '').split(',') if d.strip().isdigit()]
+    subscription = change_feed.subscribe(device_ids, request.headers.get('Last-Event-ID'))
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                event = subscription.get(timeout=CHANGES_KEEPALIVE)
+                # Comments keep proxies from closing an idle stream
+                yield change_feed.format_sse(event) if event else ": keep-alive\n\n"
+        finally:
+            change_feed.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# --- Diagnostics ---
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        "booking_cache": booking_service.cache_stats(),
+        "prompt": prompt_context.STATS.snapshot(),
+        "intent_fast_path": intent_parser.STATS.snapshot(),
+        "llm_cache": llm_cache.stats(),
+        "change_feed": change_feed.stats(),
+        "availability_view": availability_view.stats()
+    })
 
 # --- Chat API ---
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
+    """
+    Returns {"response": ..., "watch": [...]}, or a text/event-stream of agent
+    events when the body has "stream": true (see chat_agent.process_message_stream).
+    "watch" lists the devices/days to follow on /api/changes.
+    """
     user_message = request.json.get('message', '')
     
     # Initialize session cart if needed
     if 'cart' not in session:
         session['cart'] = []
     
+    if request.json.get('stream'):
+        return _stream_chat(user_message)
+    
     # Call the agent
     response_text = chat_agent.process_message(user_message, session)
     
-    return jsonify({"response": response_text})
+    return jsonify({"response": response_text, "watch": chat_agent.watch_list(session)})
+
+def _stream_chat(user_message: str):
+    def generate():
+        for event in chat_agent.process_message_stream(user_message, session):
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        # The session was already saved when the response headers went out;
+        # persist what the agent changed while streaming.
+        app.session_interface.save_session(app, session, app.response_class())
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    app.run(debug=os.getenv('FLASK_DEBUG', '0') not in ('0', 'false', 'no'), port=5000)
@@ -0,0 +1,205 @@
+"""
+ASGI entry point. Run with:
+
+    uvicorn asgi:application --workers 1
+
+POST /api/chat, streaming or not, is served natively async so concurrent
+chats share one event loop while they wait on the LLM, and so are the
+long-lived GET /api/changes streams. Every other route is
+the regular Flask app, called on the default thread pool (see wsgi()).
+"""
+import asyncio
+import json
+import time
+from typing import List, Tuple
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from werkzeug.test import EnvironBuilder
+
+from app import CHANGES_KEEPALIVE, app
+from services import change_feed, chat_agent, http_client, tracing
+
+async def _read_body(receive) -> bytes:
+    body = b""
+    while True:
+        event = await receive()
+        body += event.get("body", b"")
+        if not event.get("more_body"):
+            return body
+
+def _environ(scope, body: bytes) -> dict:
+    headers = [(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]]
+    server = scope.get("server") or ("localhost", 80)
+    return EnvironBuilder(
+        path=scope["path"],
+        method=scope["method"],
+        headers=headers,
+        query_string=scope.get("query_string", b"").decode("latin-1"),
+        data=body,
+        base_url=f"{scope.get('scheme', 'http')}://{server[0]}:{server[1]}{scope.get('root_path', '')}",
+    ).get_environ()
+
+def _start_message(response) -> dict:
+    return {
+        "type": "http.response.start",
+        "status": response.status_code,
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in response.headers.items()],
+    }
+
+async def _stream_chat(user_message: str, session, started: float, send):
+    # Headers (and a new session's cookie) go out before the first event;
+    # what the agent changes while streaming is saved after the last one.
+    head = app.response_class(mimetype="text/event-stream",
+                              headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    app.session_interface.save_session(app, session, head)
+    head.headers[tracing.REQUEST_ID_HEADER] = tracing.current_request_id()
+    # Timed to the first byte, like the Flask streaming routes
+    tracing.finish_request("POST", "/api/chat", head.status_code, time.perf_counter() - started)
+    await send(_start_message(head))
+    async for event in chat_agent.process_message_astream(user_message, session):
+        chunk = f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+    app.session_interface.save_session(app, session, app.response_class())
+    await send({"type": "http.response.body", "body": b""})
+
+async def chat(scope, receive, send):
+    body = await _read_body(receive)
+
+    # A Flask request context gives us the same session handling as the WSGI route.
+    # Contexts are contextvars, so each concurrent chat task sees its own.
+    # Flask's before/after_request hooks don't run here, so time the request directly.
+    started = time.perf_counter()
+    ctx = app.request_context(_environ(scope, body))
+    tracing.start_request(ctx.request.headers.get(tracing.REQUEST_ID_HEADER))
+    ctx.push()
+    try:
+        session = ctx.session
+        try:
+            data = json.loads(body or b"{}") or {}
+        except ValueError:
+            response = app.response_class(json.dumps({"error": "Invalid JSON"}), status=400, mimetype="application/json")
+        else:
+            # Initialize session cart if needed
+            if 'cart' not in session:
+                session['cart'] = []
+
+            user_message = data.get('message', '')
+            if data.get('stream'):
+                await _stream_chat(user_message, session, started, send)
+                return
+            response_text = await chat_agent.process_message_async(user_message, session)
+            reply = {"response": response_text, "watch": chat_agent.watch_list(session)}
+            response = app.response_class(json.dumps(reply), mimetype="application/json")
+        app.session_interface.save_session(app, session, response)
+    finally:
+        ctx.pop()
+    response.headers[tracing.REQUEST_ID_HEADER] = tracing.current_request_id()
+    tracing.finish_request("POST", "/api/chat", response.status_code, time.perf_counter() - started)
+
+    await send(_start_message(response))
+    await send({"type": "http.response.body", "body": response.get_data()})
+
+async def changes(scope, receive, send):
+    """
+    GET /api/changes, the same stream as the Flask route. An open stream
+    waits on the event loop, not in a thread, so idle browser tabs don't
+    use up the thread pool the other routes run on.
+    """
+    started = time.perf_counter()
+    headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    device_ids = [int(d) for d in ",".join(query.get("device_ids", [])).split(",") if d.strip().isdigit()]
+    tracing.start_request(headers.get(tracing.REQUEST_ID_HEADER.lower()))
+
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+    closed = asyncio.Event()
+    subscription = change_feed.subscribe(device_ids, headers.get("last-event-id"))
+    # Events are offered from booking threads
+    subscription.notify = lambda: loop.call_soon_threadsafe(wakeup.set)
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        closed.set()
+        wakeup.set()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        head = app.response_class(mimetype="text/event-stream",
+                                  headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no",
+                                           tracing.REQUEST_ID_HEADER: tracing.current_request_id()})
+        tracing.finish_request("GET", "/api/changes", head.status_code, time.perf_counter() - started)
+        await send(_start_message(head))
+        await send({"type": "http.response.body", "body": b"retry: 3000\n\n", "more_body": True})
+        while not closed.is_set():
+            wakeup.clear()
+            event = subscription.get(timeout=0)
+            if event is None:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), CHANGES_KEEPALIVE)
+                    continue
+                except asyncio.TimeoutError:
+                    # Comments keep proxies from closing an idle stream
+                    chunk = ": keep-alive\n\n"
+            else:
+                chunk = change_feed.format_sse(event)
+            await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+    finally:
+        watcher.cancel()
+        change_feed.unsubscribe(subscription)
+
+def _call_wsgi(environ: dict) -> Tuple[str, List[Tuple[str, str]], bytes]:
+    # (status, headers, body) of one WSGI call. The app's remaining routes
+    # answer with finite bodies (its streams are served natively above)
+    started, written = [], []
+
+    def start_response(status, headers, exc_info=None):
+        started.append((status, headers))
+        return written.append
+
+    result = app(environ, start_response)
+    try:
+        body = b"".join(written) + b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    status, headers = started[-1]
+    return status, headers, body
+
+async def wsgi(scope, receive, send):
+    """
+    Any other route: the Flask app in a thread of the default pool. Flask is
+    thread-safe, so these requests run in parallel.
+    """
+    environ = _environ(scope, await _read_body(receive))
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    status, headers, body = await sync_to_async(_call_wsgi, thread_sensitive=False)(environ)
+    await send({
+        "type": "http.response.start",
+        "status": int(status.split(" ", 1)[0]),
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def lifespan(scope, receive, send):
+    while True:
+        event = await receive()
+        if event["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif event["type"] == "lifespan.shutdown":
+            await http_client.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(scope, receive, send)
+    elif scope["type"] == "http" and scope["path"] == "/api/chat" and scope["method"] == "POST":
+        await chat(scope, receive, send)
+    elif scope["type"] == "http" and scope["path"] == "/api/changes" and scope["method"] == "GET":
+        await changes(scope, receive, send)
+    else:
+        await wsgi(scope, receive, send)
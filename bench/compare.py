@@ -0,0 +1,63 @@
+"""
+Compares two benchmark result files from bench/run.py and flags regressions.
+
+Usage:
+    python -m bench.compare bench/results/old.json bench/results/new.json --threshold 10
+Exits with 1 if any endpoint got slower (p50/p95/p99) or lost throughput by
+more than the threshold percentage.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, List
+
+METRICS = [("p50", False), ("p95", False), ("p99", False), ("rps", True)] # (name, higher is better)
+
+def _value(result: Dict, metric: str) -> float:
+    if metric == 'rps':
+        return result['throughput_rps']
+    return result['latency_ms'][metric]
+
+def print_comparison(old: Dict, new: Dict, threshold: float = 10.0) -> List[str]:
+    """
+    Prints per-endpoint deltas and returns the list of regressions.
+    """
+    regressions = []
+    print(f"Comparing {old['meta'].get('git')} ({old['meta'].get('timestamp')}) -> "
+          f"{new['meta'].get('git')} ({new['meta'].get('timestamp')})")
+    print(f"{'endpoint':<16}" + "".join(f"{m:>22}" for m, _ in METRICS))
+    for name, result in new['results'].items():
+        before = old['results'].get(name)
+        if before is None:
+            continue
+        cells = []
+        for metric, higher_is_better in METRICS:
+            a, b = _value(before, metric), _value(result, metric)
+            change = ((b - a) / a * 100) if a else 0.0
+            worse = -change if higher_is_better else change
+            flag = " !" if worse > threshold else "  "
+            if worse > threshold:
+                regressions.append(f"{name} {metric}: {a} -> {b} ({change:+.1f}%)")
+            cells.append(f"{a:>8}->{b:<8}{change:+5.0f}%{flag}")
+        print(f"{name:<16}" + "".join(f"{c:>22}" for c in cells))
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {threshold}%:")
+        for r in regressions:
+            print(f" - {r}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10.0, help="allowed slowdown in percent")
+    args = parser.parse_args()
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    sys.exit(1 if print_comparison(old, new, args.threshold) else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Local stand-in for the Azure OpenAI chat completions endpoint, backed by
+services.fake_llm. Lets load tests exercise the real HTTP path of llm_client
+(pooling, retries, SSE parsing) without a provider.
+
+Usage:
+    python -m bench.fake_llm_server --port 8099 --delay 0.5
+Then point the app at it:
+    OPENAI_API_BASE=http://127.0.0.1:8099/chat/completions OPENAI_API_KEY=bench
+"""
+import argparse
+import json
+import os
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services import fake_llm, llm_client
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            data = fake_llm.complete(payload)
+        except (ValueError, KeyError) as e:
+            self._send(400, "application/json", json.dumps({"error": str(e)}).encode())
+            return
+
+        if payload.get('stream'):
+            chunks = llm_client.message_chunks(data['choices'][0]['message'], fake_llm.FAKE_LLM_CHUNK)
+            body = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+            self._send(200, "text/event-stream", body.encode())
+        else:
+            self._send(200, "application/json", json.dumps(data).encode())
+
+    def _send(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Keep load test output readable
+
+def serve(port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--delay', type=float, default=None, help="seconds per response (FAKE_LLM_DELAY)")
+    args = parser.parse_args()
+    if args.delay is not None:
+        fake_llm.FAKE_LLM_DELAY = args.delay
+    print(f"Fake LLM listening on http://127.0.0.1:{args.port}/chat/completions")
+    serve(args.port).serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Generates a synthetic fleet for load testing:
+- <out>/devices.json with N devices spread over a set of campuses
+- <out>/bookings.db, a SQLite booking store (BOOKING_STORE=sqlite) with
+  random 4-hour bookings over the next DAYS days
+
+Usage:
+    python -m bench.gen_fleet --devices 10000 --days 90 --out bench/fleet
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The first three match data/devices.json so the chat agent's campus names still resolve
+CAMPUSES = [
+    (1, "Miami", "MIA"), (2, "Gatwick", "LGW"), (3, "Singapore", "SIN"),
+    (4, "Dallas", "DFW"), (5, "Frankfurt", "FRA"), (6, "Dubai", "DXB"),
+    (7, "Sydney", "SYD"), (8, "Denver", "DEN"),
+]
+AIRCRAFT = [
+    ("B737-8", "Boeing 737-800"), ("B737-9", "Boeing 737 MAX 9"), ("B787-9", "Boeing 787-9"),
+    ("B777-3", "Boeing 777-300ER"), ("A320-2", "Airbus A320-200"), ("A321-2", "Airbus A321neo"),
+    ("A350-9", "Airbus A350-900"), ("A380-8", "Airbus A380-800"),
+]
+FIRST_DEVICE_ID = 1001 # Stays clear of the ids seeded by init_mock_bookings
+
+def generate_devices(count: int, rng: random.Random):
+    devices = []
+    numbers = {}
+    for n in range(count):
+        campus_id, campus_name, campus_code = CAMPUSES[n % len(CAMPUSES)]
+        code, name = rng.choice(AIRCRAFT)
+        key = (code, campus_code)
+        numbers[key] = numbers.get(key, 0) + 1
+        devices.append({
+            "DeviceId": FIRST_DEVICE_ID + n,
+            "DeviceCode": f"{code}-{campus_code}-#{numbers[key]}",
+            "DeviceName": f"{name} #{numbers[key]}",
+            "CampusId": campus_id,
+            "CampusName": campus_name,
+        })
+    return devices
+
+def generate_bookings(device_id: int, days: int, per_day: float, rng: random.Random):
+    """
+    Non-overlapping 4-hour bookings on whole hours, about per_day per day.
+    """
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    bookings = []
+    for d in range(days):
+        day = today + timedelta(days=d)
+        free_from = 0
+        for n in range(rng.randint(0, int(per_day * 2))):
+            if free_from > 20:
+                break
+            start = rng.randint(free_from, 20)
+            free_from = start + 4
+            bookings.append({
+                "booking_id": f"BENCH-{device_id}-{day.date().isoformat()}-{n}",
+                "device_id": device_id,
+                "start_time": (day + timedelta(hours=start)).isoformat(),
+                "end_time": (day + timedelta(hours=start + 4)).isoformat(),
+                "customer_code": rng.choice(["AIRLINE-A", "AIRLINE-B", "AIRLINE-C"]),
+                "training_type": rng.choice(["Training", "Maintenance"]),
+            })
+    return bookings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--per-day', type=float, default=1.5, help="average bookings per device per day")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', default=os.path.join(ROOT, 'bench', 'fleet'))
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    os.makedirs(args.out, exist_ok=True)
+    devices = generate_devices(args.devices, rng)
+    with open(os.path.join(args.out, 'devices.json'), 'w') as f:
+        json.dump(devices, f)
+
+    db_path = os.path.join(args.out, 'bookings.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+    # The store picks its backend at import time
+    os.environ['BOOKING_STORE'] = 'sqlite'
+    os.environ['BOOKING_DB_PATH'] = db_path
+    sys.path.insert(0, ROOT)
+    from data import bookings_store
+
+    started = time.perf_counter()
+    total = 0
+    for device in devices:
+        bookings = generate_bookings(device['DeviceId'], args.days, args.per_day, rng)
+        bookings_store.add_bookings(bookings)
+        total += len(bookings)
+    print(f"Wrote {len(devices)} devices and {total} bookings to {args.out} in {time.perf_counter() - started:.1f}s")
+
+if __name__ == '__main__':
+    main()
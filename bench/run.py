@@ -0,0 +1,323 @@
+"""
+Load test for the booking API and chat agent.
+
+Starts the fake LLM server and the app (Flask or uvicorn) against a synthetic
+fleet from bench/gen_fleet.py, drives each endpoint with a fixed number of
+requests at the given concurrency, and reports p50/p95/p99 latency and
+throughput per endpoint. Results are written as JSON under bench/results/.
+
+Usage:
+    python -m bench.gen_fleet --devices 10000
+    python -m bench.run --concurrency 32 --requests 2000
+    python -m bench.run --url http://127.0.0.1:5000      # an already running app
+    python -m bench.run --baseline bench/results/<old>.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from bench import compare, fake_llm_server
+
+ENDPOINTS = ['devices', 'availability', 'booked_sessions', 'book', 'book_bulk', 'chat']
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _day(rng: random.Random, horizon: int = 89) -> str:
+    return (date.today() + timedelta(days=rng.randint(1, horizon))).isoformat()
+
+# --- Request factories: (rng, devices) -> (method, path, kwargs) ---
+
+def devices_request(rng, devices):
+    if rng.random() < 0.5:
+        return 'GET', '/api/devices', {"params": {"campus_id": rng.choice(devices)['CampusId']}}
+    return 'GET', '/api/devices', {"params": {"device_code": rng.choice(devices)['DeviceCode'][:6]}}
+
+def availability_request(rng, devices):
+    return 'GET', '/api/availability', {"params": {"device_id": rng.choice(devices)['DeviceId'], "date": _day(rng)}}
+
+def booked_sessions_request(rng, devices):
+    start = date.today() + timedelta(days=rng.randint(0, 60))
+    return 'POST', '/api/booked_sessions', {"json": {
+        "device_ids": [d['DeviceId'] for d in rng.sample(devices, min(10, len(devices)))],
+        "start_date": start.isoformat(),
+        "end_date": (start + timedelta(days=30)).isoformat(),
+    }}
+
+def availability_batch_request(rng, devices, compact: bool = False):
+    # A campus-wide week, the agent's largest availability payload
+    start = _day(rng, 80)
+    kwargs = {"json": {
+        "campus_id": rng.choice(devices)['CampusId'],
+        "start_date": start,
+        "end_date": (date.fromisoformat(start) + timedelta(days=6)).isoformat(),
+    }}
+    if compact:
+        kwargs["headers"] = {"Accept": "application/vnd.bookingbot.compact+json"}
+    return 'POST', '/api/availability/batch', kwargs
+
+def availability_batch_compact_request(rng, devices):
+    return availability_batch_request(rng, devices, compact=True)
+
+def book_request(rng, devices):
+    start = datetime.fromisoformat(_day(rng)) + timedelta(hours=rng.randint(0, 20))
+    return 'POST', '/api/book', {"json": {"cart": [{
+        "DeviceId": rng.choice(devices)['DeviceId'],
+        "SlotStart": start.isoformat(),
+        "SlotEnd": (start + timedelta(hours=4)).isoformat(),
+    }]}}
+
+def book_bulk_request(rng, devices, size: int = 50):
+    items = []
+    for _ in range(size):
+        start = datetime.fromisoformat(_day(rng)) + timedelta(hours=rng.randint(0, 20))
+        items.append({
+            "DeviceId": rng.choice(devices)['DeviceId'],
+            "SlotStart": start.isoformat(),
+            "SlotEnd": (start + timedelta(hours=4)).isoformat(),
+        })
+    return 'POST', '/api/book/bulk', {"json": {"items": items}, "headers": {"Idempotency-Key": uuid.UUID(int=rng.getrandbits(128)).hex}}
+
+def chat_request(rng, devices):
+    device = rng.choice(devices)
+    message = rng.choice([
+        f"Is {device['DeviceCode']} available on {_day(rng)}?",
+        f"What devices do you have in {device['CampusName']}?",
+        "Show my cart",
+        "Hello, I need a simulator session",
+    ])
+    return 'POST', '/api/chat', {"json": {"message": message}}
+
+FACTORIES: Dict[str, Callable] = {
+    'devices': devices_request,
+    'availability': availability_request,
+    'booked_sessions': booked_sessions_request,
+    # Not in the default run: --endpoints availability_batch,availability_batch_compact
+    'availability_batch': availability_batch_request,
+    'availability_batch_compact': availability_batch_compact_request,
+    'book': book_request,
+    'book_bulk': book_bulk_request,
+    'chat': chat_request,
+}
+
+# 409 on /api/book is a normal outcome (slot already taken), not an error
+OK_STATUSES = {'book': {200, 409}, 'book_bulk': {200, 409}}
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def summarize(name: str, samples: List[Tuple[float, int]], wall: float) -> Dict:
+    latencies = sorted(ms for ms, _ in samples)
+    statuses: Dict[str, int] = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = OK_STATUSES.get(name, {200})
+    errors = sum(1 for _, status in samples if status not in ok)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "statuses": statuses,
+        "throughput_rps": round(len(samples) / wall, 1) if wall else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+            "max": round(latencies[-1], 2) if latencies else 0.0,
+        },
+    }
+
+def run_endpoint(base_url: str, name: str, devices: List[Dict], count: int, concurrency: int, seed: int) -> Dict:
+    factory = FACTORIES[name]
+    local = threading.local()
+    lock = threading.Lock()
+    samples: List[Tuple[float, int]] = []
+
+    def one(i: int):
+        # One HTTP session (and so one chat session cookie) per worker thread
+        if not hasattr(local, 'http'):
+            local.http = requests.Session()
+        method, path, kwargs = factory(random.Random(seed * 1000003 + i), devices)
+        started = time.perf_counter()
+        try:
+            response = local.http.request(method, base_url + path, timeout=120, **kwargs)
+            response.content
+            status = response.status_code
+        except requests.RequestException:
+            status = 0
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            samples.append((elapsed, status))
+
+    # Short warm-up so imports, caches and pools don't skew the first percentiles
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(-min(concurrency, count), 0)))
+    samples.clear()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(count)))
+    return summarize(name, samples, time.perf_counter() - started)
+
+def wait_ready(base_url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"App exited with code {process.returncode} during startup")
+        try:
+            if requests.get(base_url + '/api/stats', timeout=2).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"App did not become ready within {timeout}s")
+
+def start_app(args, workdir: str, llm_port: int) -> Tuple[str, subprocess.Popen]:
+    port = _free_port()
+    db_path = os.path.join(workdir, 'bookings.db')
+    # Work on a copy so /api/book runs don't change the fleet between runs
+    shutil.copy(os.path.join(args.fleet, 'bookings.db'), db_path)
+    env = dict(os.environ,
+               DEVICES_FILE=os.path.join(args.fleet, 'devices.json'),
+               BOOKING_STORE='sqlite',
+               BOOKING_DB_PATH=db_path,
+               LLM_PROVIDER='azure',
+               OPENAI_API_BASE=f"http://127.0.0.1:{llm_port}/chat/completions",
+               OPENAI_API_KEY='bench',
+               LLM_CACHE=os.getenv('LLM_CACHE', 'off'))
+    env.pop('SIMULATOR_API_URL', None)
+    if args.workers > 1:
+        # Chat sessions must be shared between the workers too
+        env.update(SESSION_BACKEND='sqlite', SESSION_DB_PATH=os.path.join(workdir, 'sessions.db'))
+    if args.server == 'uvicorn':
+        cmd = [sys.executable, 'serve.py', '--port', str(port), '--workers', str(args.workers), '--log-level', 'warning']
+    else:
+        cmd = [sys.executable, '-c', f"from app import app; app.run(port={port}, threaded=True)"]
+    process = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_ready(base_url, process)
+    except Exception:
+        process.kill()
+        raise
+    return base_url, process
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def print_table(results: Dict):
+    print(f"{'endpoint':<16}{'req':>7}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, r in results.items():
+        lat = r['latency_ms']
+        print(f"{name:<16}{r['requests']:>7}{r['errors']:>6}{r['throughput_rps']:>9}"
+              f"{lat['p50']:>10}{lat['p95']:>10}{lat['p99']:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fleet', default=os.path.join(ROOT, 'bench', 'fleet'), help="output dir of bench.gen_fleet")
+    parser.add_argument('--url', help="benchmark an already running app instead of starting one")
+    parser.add_argument('--server', choices=['flask', 'uvicorn'], default='flask')
+    parser.add_argument('--workers', type=int, default=1, help="worker processes (uvicorn via serve.py)")
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    parser.add_argument('--requests', type=int, default=500, help="requests per endpoint")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--llm-delay', type=float, default=0.05, help="fake LLM seconds per response")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help="results file (default bench/results/<timestamp>.json)")
+    parser.add_argument('--baseline', help="compare against an earlier results file")
+    args = parser.parse_args()
+
+    if args.workers > 1 and args.server != 'uvicorn':
+        parser.error("--workers needs --server uvicorn")
+    endpoints = [e.strip() for e in args.endpoints.split(',') if e.strip()]
+    unknown = set(endpoints) - set(FACTORIES)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    llm_server = None
+    process = None
+    workdir = tempfile.mkdtemp(prefix='bookingbot-bench-')
+    try:
+        if args.url:
+            base_url = args.url.rstrip('/')
+            devices = requests.get(base_url + '/api/devices', timeout=30).json()
+        else:
+            with open(os.path.join(args.fleet, 'devices.json')) as f:
+                devices = json.load(f)
+            fake_llm_server.fake_llm.FAKE_LLM_DELAY = args.llm_delay
+            llm_port = _free_port()
+            llm_server = fake_llm_server.serve(llm_port)
+            threading.Thread(target=llm_server.serve_forever, daemon=True).start()
+            base_url, process = start_app(args, workdir, llm_port)
+
+        results = {}
+        for name in endpoints:
+            print(f"Running {name}: {args.requests} requests at concurrency {args.concurrency}...")
+            results[name] = run_endpoint(base_url, name, devices, args.requests, args.concurrency, args.seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+        if llm_server is not None:
+            llm_server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "server": 'external' if args.url else args.server,
+            "workers": None if args.url else args.workers,
+            "devices": len(devices),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "llm_delay": args.llm_delay,
+        },
+        "results": results,
+    }
+    print()
+    print_table(results)
+
+    out = args.out or os.path.join(ROOT, 'bench', 'results', time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved results to {out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        sys.exit(1 if compare.print_comparison(baseline, report) else 0)
+
+if __name__ == '__main__':
+    main()
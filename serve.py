@@ -0,0 +1,40 @@
+"""
+Production entry point: the ASGI app (asgi.py) on uvicorn with several
+worker processes. Run with:
+
+    python serve.py --host 0.0.0.0 --port 5000 --workers 4
+
+Workers default to WEB_CONCURRENCY, else one per CPU when bookings and
+sessions are in the shared SQLite stores and one otherwise. More than one
+worker on the in-memory stores is refused (see services/deployment.py).
+"""
+import argparse
+import os
+
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from services import deployment
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=os.getenv('HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '5000')))
+    parser.add_argument('--workers', type=int, default=deployment.default_workers())
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args()
+
+    try:
+        deployment.check_workers(args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Workers are fresh interpreters importing asgi.py; app.py trusts this count
+    os.environ[deployment.SERVE_WORKERS] = str(args.workers)
+    uvicorn.run('asgi:application', host=args.host, port=args.port, workers=args.workers,
+                log_level=args.log_level)
+
+if __name__ == '__main__':
+    main()
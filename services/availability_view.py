@@ -0,0 +1,204 @@
+import os
+import threading
+import time
+from array import array
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from services import change_feed, tracing
+
+# Materialised availability.
+# The free gaps between bookings and closed time (slot_engine.free_gaps) for
+# every device and day of the booking horizon, built in the background at
+# startup and then kept current instead of recomputed per request:
+# - booking change events (change_feed) recompute only the device/days touched
+# - a thread rolls the window forward just after midnight
+# Gaps don't depend on slot length, step or the current time, so reads only
+# expand them into slot starts (slot_engine.gap_slot_starts).
+#
+# Per device the gaps are one array of (start, end) minutes since each day's
+# midnight plus per-day offsets into it: a few KB per device for 90 days.
+# Until the first build finishes, and for days outside the window, gaps_for
+# returns None and callers compute from the store as before.
+
+AVAILABILITY_VIEW = os.getenv('AVAILABILITY_VIEW', '1') not in ('0', 'false', 'no')
+
+MINUTES_PER_DAY = 24 * 60
+
+log = tracing.get_logger('availability_view')
+
+# (device_id, first_day, day_count) -> free gaps per day, minutes since first_day midnight
+GapSource = Callable[[int, date, int], List[List[Tuple[int, int]]]]
+Packed = Tuple[array, array]
+
+def _pack(days: List[List[Tuple[int, int]]]) -> Packed:
+    gaps = array('H')
+    offsets = array('I', [0])
+    for day, day_gaps in enumerate(days):
+        base = day * MINUTES_PER_DAY
+        for start, end in day_gaps:
+            gaps.append(start - base)
+            gaps.append(end - base)
+        offsets.append(len(gaps))
+    return gaps, offsets
+
+def _unpack(packed: Packed, first: int, count: int) -> List[List[Tuple[int, int]]]:
+    # Days first..first+count-1, minutes since midnight of day `first`
+    gaps, offsets = packed
+    days = []
+    for day in range(first, first + count):
+        base = (day - first) * MINUTES_PER_DAY
+        lo, hi = offsets[day], offsets[day + 1]
+        days.append([(base + gaps[i], base + gaps[i + 1]) for i in range(lo, hi, 2)])
+    return days
+
+class AvailabilityView:
+    """
+    Free gaps per device and day for day_count days from first_day.
+    Reads take no lock: the window is swapped as a whole and each device's
+    arrays are replaced, never changed in place.
+    """
+    def __init__(self, source: GapSource, device_ids: Iterable[int], day_count: int):
+        self.source = source
+        self.device_ids = list(device_ids)
+        self.window: Tuple[date, int, Dict[int, Packed]] = (date.today(), day_count, {})
+        self.ready = False
+        self.lock = threading.Lock()
+        self.patches = 0
+        self.rolls = 0
+
+    def build(self):
+        """
+        Computes every device, one at a time so change events interleave.
+        """
+        started = time.perf_counter()
+        for device_id in self.device_ids:
+            with self.lock:
+                # Read under the lock: a booking committed meanwhile is either
+                # seen here or patched by its change event afterwards
+                first_day, day_count, devices = self.window
+                devices[device_id] = _pack(self.source(device_id, first_day, day_count))
+        self.ready = True
+        log.info("Availability view built", extra={"fields": {
+            "devices": len(self.device_ids), "seconds": round(time.perf_counter() - started, 2)}})
+
+    def gaps_for(self, device_id: int, first_day: date, day_count: int) -> Optional[List[List[Tuple[int, int]]]]:
+        """
+        Free gaps per day in minutes since first_day midnight, or None if the
+        view doesn't cover that device and range (yet).
+        """
+        if not self.ready:
+            return None
+        window_first, window_count, devices = self.window
+        packed = devices.get(device_id)
+        offset = (first_day - window_first).days
+        if packed is None or offset < 0 or offset + day_count > window_count:
+            return None
+        return _unpack(packed, offset, day_count)
+
+    def patch(self, device_id: int, dates: List[str]):
+        """
+        Recomputes the given days of one device from the source.
+        """
+        with self.lock:
+            first_day, day_count, devices = self.window
+            packed = devices.get(device_id)
+            if packed is None:
+                # Not built yet; the build reads the current bookings
+                return
+            days = None
+            for text in dates:
+                offset = (date.fromisoformat(text) - first_day).days
+                if 0 <= offset < day_count:
+                    if days is None:
+                        days = _unpack(packed, 0, day_count)
+                    fresh = self.source(device_id, first_day + timedelta(days=offset), 1)[0]
+                    shift = offset * MINUTES_PER_DAY
+                    days[offset] = [(start + shift, end + shift) for start, end in fresh]
+            if days is not None:
+                devices[device_id] = _pack(days)
+                self.patches += 1
+
+    def roll(self, today: date):
+        """
+        Moves the window to start at today, computing only the new days.
+        """
+        with self.lock:
+            first_day, day_count, devices = self.window
+            shift = (today - first_day).days
+            if shift <= 0:
+                return
+            kept = max(0, day_count - shift)
+            rolled = {}
+            for device_id, packed in devices.items():
+                days = _unpack(packed, day_count - kept, kept)
+                fresh = self.source(device_id, today + timedelta(days=kept), day_count - kept)
+                base = kept * MINUTES_PER_DAY
+                days += [[(start + base, end + base) for start, end in day] for day in fresh]
+                rolled[device_id] = _pack(days)
+            self.window = (today, day_count, rolled)
+            self.rolls += 1
+
+    def on_change(self, event: Dict):
+        if event.get('type') == 'change':
+            self.patch(event['device_id'], event['dates'])
+        elif event.get('type') == 'resync':
+            # Changes were missed: recompute everything in the background
+            threading.Thread(target=self.rebuild, name='availability-view-build', daemon=True).start()
+
+    def rebuild(self):
+        for device_id in self.device_ids:
+            with self.lock:
+                first_day, day_count, devices = self.window
+                devices[device_id] = _pack(self.source(device_id, first_day, day_count))
+
+    def stats(self) -> Dict:
+        first_day, day_count, devices = self.window
+        return {"ready": self.ready, "devices": len(devices), "first_date": first_day.isoformat(),
+                "days": day_count, "patches": self.patches, "rolls": self.rolls}
+
+VIEW: Optional[AvailabilityView] = None
+_pid = None
+_start_lock = threading.Lock()
+
+def _roll_at_midnight(view: AvailabilityView):
+    while True:
+        now = datetime.now()
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        # A second late, so date.today() is already the new day
+        time.sleep((midnight - now).total_seconds() + 1)
+        try:
+            view.roll(date.today())
+        except Exception:
+            log.exception("Availability view roll-forward failed")
+
+def _start_threads(view: AvailabilityView):
+    if not view.ready:
+        threading.Thread(target=view.build, name='availability-view-build', daemon=True).start()
+    threading.Thread(target=_roll_at_midnight, args=(view,), name='availability-view-roll', daemon=True).start()
+
+def start(source: GapSource, device_ids: Iterable[int], day_count: int):
+    """
+    Builds the view in the background and keeps it current. Idempotent; a
+    forked worker restarts the threads (the data comes along with the fork).
+    """
+    global VIEW, _pid
+    if not AVAILABILITY_VIEW or _pid == os.getpid():
+        return
+    with _start_lock:
+        if _pid == os.getpid():
+            return
+        if VIEW is None:
+            VIEW = AvailabilityView(source, device_ids, day_count)
+            change_feed.start()
+            change_feed.add_listener(VIEW.on_change)
+        _start_threads(VIEW)
+        _pid = os.getpid()
+
+def gaps_for(device_id: int, first_day: date, day_count: int) -> Optional[List[List[Tuple[int, int]]]]:
+    if VIEW is None:
+        return None
+    return VIEW.gaps_for(device_id, first_day, day_count)
+
+def stats() -> Dict:
+    return VIEW.stats() if VIEW is not None else {"ready": False}
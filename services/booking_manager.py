@@ -1,34 +1,53 @@
+import hashlib
+import heapq
 import json
 import os
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from datetime import date, datetime, timedelta
+from typing import List, Dict, Optional, Tuple
 import uuid
+from services import availability_view, calendars, compact, slot_engine, tracing
+from services.device_catalog import DeviceCatalog
 
 # Load data
-DEVICES_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'devices.json')
+# DEVICES_FILE overrides the fleet (e.g. a synthetic one from bench/gen_fleet.py)
+DEVICES_FILE = os.getenv('DEVICES_FILE') or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'devices.json')
 try:
     with open(DEVICES_FILE, 'r') as f:
         DEVICES_DATA = json.load(f)
 except FileNotFoundError:
     DEVICES_DATA = []
 
+CATALOG = DeviceCatalog(DEVICES_DATA)
+
 # Import mock booking store
-from data.bookings_store import BOOKED_SESSIONS
+from data import bookings_store
+
+# Bookings are only visible up to this many days ahead
+BOOKING_HORIZON_DAYS = 90
+
+# How long a validated cart keeps its slots reserved for the chat that holds them
+CART_HOLD_SECONDS = int(os.getenv('CART_HOLD_SECONDS', '600'))
+
+# Earliest-slot search looks at the next day first and doubles the window each
+# round, so it stops as soon as enough slots are found
+SEARCH_MAX_RESULTS = 50
+
+_CONFLICT_MESSAGES = {
+    "booked": "Overlaps an existing booking",
+    "held": "Held by another customer",
+}
 
 def get_devices(campus_id: Optional[int] = None, device_code: Optional[str] = None) -> List[Dict]:
     """
     Returns a list of devices, optionally filtered by campus_id or device_code (partial match).
     """
-    results = DEVICES_DATA
-    
-    if campus_id:
-        results = [d for d in results if d['CampusId'] == campus_id]
-    
-    if device_code:
-        # Simple case-insensitive partial match
-        results = [d for d in results if device_code.lower() in d['DeviceCode'].lower()]
-        
-    return results
+    return CATALOG.search(campus_id, device_code)
+
+def get_device(device_id: int) -> Optional[Dict]:
+    """
+    Returns a single device by id, or None.
+    """
+    return CATALOG.get(device_id)
 
 def get_booked_sessions(device_ids: List[int], start_date: str, end_date: str) -> List[Dict]:
     """
@@ -43,124 +62,552 @@ def get_booked_sessions(device_ids: List[int], start_date: str, end_date: str) -
         return []
 
     now = datetime.now()
-    max_future = now + timedelta(days=90) # 3 months approx
+    max_future = now + timedelta(days=BOOKING_HORIZON_DAYS) # 3 months approx
+
+    # Indexed lookup per requested device.
+    # Constraints: start not in the past, start within 3 months,
+    # and the session must fall within the requested range.
+    start_from = max(start_dt, now)
+    start_to = min(end_dt, max_future)
 
-    # Filter mock store
     relevant_sessions = []
-    for session in BOOKED_SESSIONS:
-        if session['device_id'] in device_ids:
-            sess_start = datetime.fromisoformat(session['start_time'])
-            
-            # Check constraints
-            if sess_start < now:
-                continue # Skip past sessions
-            if sess_start > max_future:
-                continue # Skip sessions beyond 3 months
-                
-            # Check range overlap
-            # Overlap if (StartA <= EndB) and (EndA >= StartB)
-            # Here we just check if it falls within the requested range broadly
-            sess_end = datetime.fromisoformat(session['end_time'])
-            
-            if sess_start >= start_dt and sess_end <= end_dt:
-                relevant_sessions.append(session)
+    if start_from > start_to:
+        return relevant_sessions
+
+    for device_id in dict.fromkeys(device_ids):
+        relevant_sessions.extend(bookings_store.find_sessions(device_id, start_from, start_to, end_dt))
                 
     return relevant_sessions
 
-def get_availability(device_id: int, date_str: str) -> List[Dict]:
+def _booked_minutes(device_id: int, range_start: datetime, range_end: datetime) -> slot_engine.Intervals:
     """
-    Returns available 4-hour slots for a specific device on a specific date.
+    Bookings starting in [range_start, range_end) as (starts, ends) minutes since
+    range_start, for slot_engine. Sessions that started before now are
+    included: a running session still blocks the rest of its slot.
+    """
+    return slot_engine.to_minutes(bookings_store.find_intervals(device_id, range_start, range_end, range_end), range_start)
+
+def _free_gaps(device_id: int, first_day: date, day_count: int) -> List[List[Tuple[int, int]]]:
+    """
+    Free gaps per day between all bookings and closed time, for the
+    materialised view. Bookings are read with _booked_minutes, like the
+    fallbacks that run while the view isn't ready, so both give the same slots.
+    """
+    range_start = datetime.combine(first_day, datetime.min.time())
+    range_end = range_start + timedelta(days=day_count)
+    calendar = calendars.calendar_for(get_device(device_id))
+    booked = _booked_minutes(device_id, range_start, range_end)
+    return slot_engine.free_gaps(*calendars.merge_closed(booked, calendar.closed_intervals(first_day, day_count)), day_count)
+
+def start_availability_view():
+    """
+    Materialises availability for the whole fleet and booking horizon in the
+    background, kept current from the change feed (see availability_view).
+    """
+    availability_view.start(_free_gaps, [d['DeviceId'] for d in DEVICES_DATA], BOOKING_HORIZON_DAYS + 1)
+
+def get_calendar(device_id: int) -> Optional[Dict]:
+    """
+    Operating hours, bookable durations (minutes) and step for a device, or None.
+    """
+    device = get_device(device_id)
+    if device is None:
+        return None
+    return calendars.calendar_for(device).describe()
+
+def resolve_duration(calendar: calendars.Calendar, duration: Optional[int]) -> int:
+    """
+    The requested duration in minutes, or the calendar's default.
+    Raises ValueError if the device can't be booked for that long.
+    """
+    if duration is None:
+        return calendar.default_duration
+    duration = int(duration)
+    if not calendar.allows(duration):
+        allowed = ", ".join(str(d) for d in calendar.durations)
+        raise ValueError(f"Sessions of {duration} minutes can't be booked on this device (allowed: {allowed})")
+    return duration
+
+@tracing.traced('slots.day')
+def get_availability(device_id: int, date_str: str, duration: Optional[int] = None) -> List[Dict]:
+    """
+    Returns available slots for a specific device on a specific date.
     Logic: Dynamic gap calculation.
-    1. Fetch all bookings for the day.
+    1. Fetch all bookings for the day, plus the calendar's closed time.
     2. Identify free time ranges.
-    3. Generate 4-hour slots within those free ranges.
+    3. Generate slots of `duration` minutes (calendar default: 4 hours) within those free ranges.
+    Raises ValueError if the duration isn't allowed for the device.
+    """
+    base_date, duration, starts = _day_slot_starts(device_id, date_str, duration)
+    return slot_engine.format_slots(starts, base_date, duration)
+
+@tracing.traced('slots.day')
+def get_availability_compact(device_id: int, date_str: str, duration: Optional[int] = None) -> Dict:
     """
+    get_availability in the compact format (see services/compact.py).
+    """
+    base_date, duration, starts = _day_slot_starts(device_id, date_str, duration)
+    return compact.encode_availability(base_date, 1, [(device_id, duration, [starts])])
+
+def _day_slot_starts(device_id: int, date_str: str, duration: Optional[int]) -> Tuple[date, int, List[int]]:
+    # (day, slot length, slot start minutes since its midnight)
     base_date = datetime.fromisoformat(date_str).date()
     # Define Day Boundaries (00:00 to 24:00)
     day_start = datetime.combine(base_date, datetime.min.time())
     day_end = day_start + timedelta(days=1)
+    now = datetime.now()
+    calendar = calendars.calendar_for(get_device(device_id))
+    duration = resolve_duration(calendar, duration)
+    now_minutes = slot_engine.minutes_since(day_start, now)
     
-    # Get bookings
-    booked = get_booked_sessions([device_id], day_start.isoformat(), day_end.isoformat())
-    
-    # Sort bookings by start time
-    booked_intervals = []
-    for b in booked:
-        start = datetime.fromisoformat(b['start_time'])
-        end = datetime.fromisoformat(b['end_time'])
-        # Clip to day boundaries logic if needed, but for now take as is
-        booked_intervals.append((start, end))
-    booked_intervals.sort(key=lambda x: x[0])
-    
-    # Find Gaps
-    free_gaps = []
-    current_pointer = day_start
+    gaps = availability_view.gaps_for(device_id, base_date, 1)
+    if gaps is not None:
+        return base_date, duration, slot_engine.gap_slot_starts(gaps[0], now_minutes, duration, calendar.step)
     
-    for b_start, b_end in booked_intervals:
-        if b_start > current_pointer:
-            free_gaps.append((current_pointer, b_start))
-        current_pointer = max(current_pointer, b_end)
-        
-    if current_pointer < day_end:
-        free_gaps.append((current_pointer, day_end))
-        
-    # Generate 4-hour slots from gaps
-    available_slots = []
+    busy = calendars.merge_closed(_booked_minutes(device_id, day_start, day_end),
+                                  calendar.closed_intervals(base_date, 1))
+    starts = slot_engine.slot_starts([busy], 1, now_minutes, duration, calendar.step)[0][0]
+    return base_date, duration, starts
+
+@tracing.traced('slots.batch')
+def get_availability_batch(device_ids: List[int], start_date: str, end_date: str, campus_id: Optional[int] = None,
+                           duration: Optional[int] = None) -> List[Dict]:
+    """
+    Returns available slots for several devices over a date range (inclusive).
+    If no device_ids are given, all devices of campus_id are used.
+    Bookings for each device are fetched once for the whole range and split per day,
+    so one call replaces len(device_ids) * days calls to get_availability.
+    Slots are `duration` minutes long (each device's calendar default if None);
+    devices that can't be booked for that long are left out.
+    The range is clipped to the booking horizon.
+    Result: [{"device_id": 101, "date": "YYYY-MM-DD", "slots": [...]}, ...]
+    """
+    batch = _batch_slot_starts(device_ids, start_date, end_date, campus_id, duration)
+    if batch is None:
+        return []
+    first_day, day_count, devices = batch
+
+    day_strs = [(first_day + timedelta(days=offset)).isoformat() for offset in range(day_count)]
+    results = []
+    for device_id, device_duration, device_days in devices:
+        for offset, day_starts in enumerate(device_days):
+            results.append({
+                "device_id": device_id,
+                "date": day_strs[offset],
+                # Strings are built per returned slot only
+                "slots": slot_engine.format_slots(day_starts, first_day, device_duration)
+            })
+    return results
+
+@tracing.traced('slots.batch')
+def get_availability_batch_compact(device_ids: List[int], start_date: str, end_date: str, campus_id: Optional[int] = None,
+                                   duration: Optional[int] = None) -> Optional[Dict]:
+    """
+    get_availability_batch in the compact format (see services/compact.py),
+    or None where it would return [] (bad or past range).
+    """
+    batch = _batch_slot_starts(device_ids, start_date, end_date, campus_id, duration)
+    return compact.encode_availability(*batch) if batch is not None else None
+
+def _batch_slot_starts(device_ids: List[int], start_date: str, end_date: str, campus_id: Optional[int],
+                       duration: Optional[int]) -> Optional[Tuple[date, int, List[Tuple[int, int, List[List[int]]]]]]:
+    # (first day, day count, [(device_id, slot length, slot starts per day)]), or None
+    if not device_ids and campus_id:
+        device_ids = [d['DeviceId'] for d in get_devices(campus_id=campus_id)]
+
+    try:
+        first_day = datetime.fromisoformat(start_date).date()
+        last_day = datetime.fromisoformat(end_date).date()
+    except ValueError:
+        return None
+
     now = datetime.now()
-    
-    for gap_start, gap_end in free_gaps:
-        # We try to fit 4h blocks. 
-        # Strategy: Greedy. Start at gap_start.
-        # Alternative: Rolling every hour?
-        # User req: "Each slot should be of duration of 4 hours".
-        # Let's offer slots at regular intervals (e.g. every hour) if they fit.
-        
-        # Check iteratively every hour within the gap
-        slot_start = gap_start
-        while slot_start + timedelta(hours=4) <= gap_end:
-            slot_end = slot_start + timedelta(hours=4)
-            
-            # Additional constraint: Must be in future
-            if slot_start > now:
-                available_slots.append({
-                    "start": slot_start.isoformat(),
-                    "end": slot_end.isoformat(),
-                    "label": f"{slot_start.strftime('%H:%M')} - {slot_end.strftime('%H:%M')}"
-                })
-            
-            # Step size: 1 hour (to give options) or 4 hours (non-overlapping)?
-            # Regular booking systems usually offer slots every 30min or 1h. 
-            # Prompt says "fill 3 slots per day", "leave remaining empty". 
-            # Let's provide non-overlapping if possible, OR overlapping options.
-            # "show the available duration". 
-            # Let's do overlapping options every 1 hour to maximize user choice within the gap.
-            slot_start += timedelta(hours=1)
-            
-    return available_slots
-
-def book_sessions(cart_items: List[Dict]) -> Dict:
-    """
-    Books the sessions in the cart.
-    Updates the mock store.
-    Returns confirmation details.
+    last_day = min(last_day, (now + timedelta(days=BOOKING_HORIZON_DAYS)).date())
+    if last_day < first_day:
+        return None
+
+    range_start = datetime.combine(first_day, datetime.min.time())
+    range_end = datetime.combine(last_day, datetime.min.time()) + timedelta(days=1)
+    day_count = (last_day - first_day).days + 1
+    now_minutes = slot_engine.minutes_since(range_start, now)
+
+    # Materialised devices only need their gaps expanded; the rest, grouped by
+    # slot length and step, go through the engine in one bulk pass
+    groups: Dict[tuple, List[int]] = {}
+    busy: Dict[int, slot_engine.Intervals] = {}
+    slots: Dict[int, Tuple[int, List[List[int]]]] = {}
+    ordered = []
+    for device_id in dict.fromkeys(device_ids):
+        calendar = calendars.calendar_for(get_device(device_id))
+        try:
+            device_duration = resolve_duration(calendar, duration)
+        except ValueError:
+            continue
+        ordered.append(device_id)
+        gaps = availability_view.gaps_for(device_id, first_day, day_count)
+        if gaps is not None:
+            slots[device_id] = (device_duration, [slot_engine.gap_slot_starts(day, now_minutes, device_duration, calendar.step)
+                                                  for day in gaps])
+            continue
+        busy[device_id] = calendars.merge_closed(_booked_minutes(device_id, range_start, range_end),
+                                                 calendar.closed_intervals(first_day, day_count))
+        groups.setdefault((device_duration, calendar.step), []).append(device_id)
+
+    for (group_duration, step), ids in groups.items():
+        starts = slot_engine.slot_starts([busy[d] for d in ids], day_count, now_minutes, group_duration, step)
+        for device_id, device_days in zip(ids, starts):
+            slots[device_id] = (group_duration, device_days)
+
+    return first_day, day_count, [(device_id,) + slots[device_id] for device_id in ordered]
+
+def _window_intervals(open_from: int, open_until: int, day_count: int) -> slot_engine.Intervals:
     """
-    confirmation_number = f"CONF-{uuid.uuid4().hex[:8].upper()}"
-    new_bookings = []
-    
-    for item in cart_items:
-        booking = {
-            "booking_id": f"{confirmation_number}-{item['DeviceId']}",
-            "device_id": item['DeviceId'],
-            "start_time": item['SlotStart'],
-            "end_time": item['SlotEnd'],
-            "customer_code": "USER_WEB", # Placeholder
-            "training_type": "Training"
+    Time outside a daily [open_from, open_until) window, in slot_engine's format.
+    """
+    closed = [(0, open_from), (open_until, slot_engine.MINUTES_PER_DAY)]
+    starts, ends = [], []
+    for day in range(day_count):
+        base = day * slot_engine.MINUTES_PER_DAY
+        for start, end in closed:
+            if end > start:
+                starts.append(base + start)
+                ends.append(base + end)
+    return starts, ends
+
+def _window_slots(plans: List[tuple], window_start: date, day_count: int, now: datetime,
+                  open_from: int, open_until: int):
+    """
+    Free slots of all planned devices over one window, merged lazily into start
+    order: yields (start minute since window_start, device_id, duration).
+    Materialised devices have their gaps (availability_view) cut to the
+    time-of-day window. For the rest, bookings, calendars and the window are
+    combined per device and each (duration, step) group goes through the
+    engine in one bulk pass.
+    """
+    range_start = datetime.combine(window_start, datetime.min.time())
+    range_end = range_start + timedelta(days=day_count)
+    now_minutes = slot_engine.minutes_since(range_start, now)
+    outside = _window_intervals(open_from, open_until, day_count)
+
+    streams = []
+    groups: Dict[tuple, List[tuple]] = {}
+    for device, calendar, duration in plans:
+        gaps = availability_view.gaps_for(device['DeviceId'], window_start, day_count)
+        if gaps is not None:
+            days = [slot_engine.gap_slot_starts(_clip_gaps(day_gaps, offset, open_from, open_until),
+                                                now_minutes, duration, calendar.step)
+                    for offset, day_gaps in enumerate(gaps)]
+            streams.append(_device_stream(days, device['DeviceId'], duration))
+            continue
+        busy = calendars.merge_closed(_booked_minutes(device['DeviceId'], range_start, range_end),
+                                      calendar.closed_intervals(window_start, day_count))
+        groups.setdefault((duration, calendar.step), []).append((device['DeviceId'], calendars.merge_closed(busy, outside)))
+
+    for (duration, step), members in groups.items():
+        starts = slot_engine.slot_starts([busy for _, busy in members], day_count, now_minutes, duration, step)
+        for (device_id, _), days in zip(members, starts):
+            streams.append(_device_stream(days, device_id, duration))
+    return heapq.merge(*streams)
+
+def _clip_gaps(gaps: List[Tuple[int, int]], day: int, open_from: int, open_until: int) -> List[Tuple[int, int]]:
+    # One day's gaps cut to its [open_from, open_until) window
+    lo = day * slot_engine.MINUTES_PER_DAY + open_from
+    hi = day * slot_engine.MINUTES_PER_DAY + open_until
+    return [(max(start, lo), min(end, hi)) for start, end in gaps if start < hi and end > lo]
+
+def _device_stream(days: List[List[int]], device_id: int, duration: int):
+    # A device's slots are already in start order
+    for day in days:
+        for start in day:
+            yield start, device_id, duration
+
+@tracing.traced('slots.earliest')
+def find_earliest_slots(aircraft_type: Optional[str] = None, campus_id: Optional[int] = None,
+                        device_ids: Optional[List[int]] = None, start_date: Optional[str] = None,
+                        end_date: Optional[str] = None, earliest: Optional[str] = None,
+                        latest: Optional[str] = None, duration: Optional[int] = None, limit: int = 5) -> List[Dict]:
+    """
+    The `limit` earliest free slots across the matching devices, in start order.
+    Devices: device_ids if given, otherwise those matching aircraft_type and/or campus_id.
+    Slots start no earlier than `earliest` and end by `latest` ("HH:MM") each day,
+    are `duration` minutes long (each device's default if None; devices that don't
+    offer it are skipped) and don't overlap other results on the same device.
+    The search runs over windows of 1, 2, 4, ... days from start_date (today by
+    default) up to end_date or the booking horizon, and stops once it has `limit` slots.
+    Raises ValueError for bad dates or times.
+    """
+    limit = max(1, min(int(limit or 5), SEARCH_MAX_RESULTS))
+    open_from = calendars.parse_hhmm(earliest) if earliest else 0
+    open_until = calendars.parse_hhmm(latest) if latest else slot_engine.MINUTES_PER_DAY
+    if open_until <= open_from:
+        raise ValueError("latest must be after earliest")
+
+    now = datetime.now()
+    horizon = (now + timedelta(days=BOOKING_HORIZON_DAYS)).date()
+    first_day = max(datetime.fromisoformat(start_date).date() if start_date else now.date(), now.date())
+    last_day = min(datetime.fromisoformat(end_date).date() if end_date else horizon, horizon)
+
+    if device_ids:
+        devices = [d for d in (get_device(int(i)) for i in dict.fromkeys(device_ids)) if d]
+    else:
+        devices = CATALOG.search(campus_id, aircraft_type=aircraft_type)
+
+    plans = []
+    for device in devices:
+        calendar = calendars.calendar_for(device)
+        try:
+            device_duration = resolve_duration(calendar, duration)
+        except ValueError:
+            continue
+        if device_duration <= open_until - open_from:
+            plans.append((device, calendar, device_duration))
+
+    results = []
+    taken_until: Dict[int, int] = {}
+    window_start, window_days = first_day, 1
+    while plans and len(results) < limit and window_start <= last_day:
+        day_count = min(window_days, (last_day - window_start).days + 1)
+        for start, device_id, slot_duration in _window_slots(plans, window_start, day_count, now, open_from, open_until):
+            if start < taken_until.get(device_id, -1):
+                # Overlaps a slot already returned for this device
+                continue
+            taken_until[device_id] = start + slot_duration
+            device = get_device(device_id)
+            slot = slot_engine.format_slots([start], window_start, slot_duration)[0]
+            results.append({
+                "device_id": device_id,
+                "device_code": device['DeviceCode'],
+                "device_name": device['DeviceName'],
+                "campus_id": device['CampusId'],
+                "campus_name": device['CampusName'],
+                "date": slot['start'][:10],
+                **slot
+            })
+            if len(results) == limit:
+                break
+        # Slots never cross midnight, so nothing carries over between windows
+        taken_until.clear()
+        window_start += timedelta(days=day_count)
+        window_days *= 2
+    return results
+
+def _local_time(value: str) -> datetime:
+    """
+    An ISO timestamp as naive local time, like the stored bookings; one with
+    an offset ("...+00:00", "...Z") is converted.
+    """
+    moment = datetime.fromisoformat(value)
+    return moment.astimezone().replace(tzinfo=None) if moment.tzinfo else moment
+
+def _cart_booking(item: Dict, booking_id: str) -> Dict:
+    return {
+        "booking_id": booking_id,
+        "device_id": int(item['DeviceId']),
+        "start_time": _local_time(item['SlotStart']).isoformat(timespec='seconds'),
+        "end_time": _local_time(item['SlotEnd']).isoformat(timespec='seconds'),
+        "customer_code": item.get('CustomerCode') or "USER_WEB", # Placeholder for chat carts
+        "training_type": item.get('TrainingType') or "Training"
+    }
+
+def _problem(reason: str, message: str, conflicts_with: Optional[str] = None) -> Dict:
+    problem = {"reason": reason, "message": message}
+    if conflicts_with:
+        problem["conflicts_with"] = conflicts_with
+    return problem
+
+def _calendar_problems(booking: Dict, now: datetime) -> List[Dict]:
+    """
+    Checks that don't need the store: the device exists, the slot is in the
+    bookable window, the device offers its length and it is within operating hours.
+    """
+    device = get_device(booking['device_id'])
+    if device is None:
+        return [_problem("unknown_device", f"Device {booking['device_id']} doesn't exist")]
+
+    start = datetime.fromisoformat(booking['start_time'])
+    end = datetime.fromisoformat(booking['end_time'])
+    if end <= start:
+        return [_problem("invalid", "Ends before it starts")]
+    # Availability is computed per day (slot_engine), so sessions end by midnight
+    if end > datetime.combine(start.date(), datetime.min.time()) + timedelta(days=1):
+        return [_problem("invalid", "Runs past midnight")]
+
+    problems = []
+    if start <= now:
+        problems.append(_problem("past", "Starts in the past"))
+    elif start > now + timedelta(days=BOOKING_HORIZON_DAYS):
+        problems.append(_problem("horizon", f"Starts more than {BOOKING_HORIZON_DAYS} days ahead"))
+
+    calendar = calendars.calendar_for(device)
+    duration = int((end - start).total_seconds() // 60)
+    if not calendar.allows(duration):
+        allowed = ", ".join(str(d) for d in calendar.durations)
+        problems.append(_problem("duration", f"Sessions of {duration} minutes can't be booked on this device (allowed: {allowed})"))
+
+    base = datetime.combine(start.date(), datetime.min.time())
+    lo, hi = slot_engine.to_minutes([(start, end)], base)
+    closed_starts, closed_ends = calendar.closed_intervals(start.date(), hi[0] // slot_engine.MINUTES_PER_DAY + 1)
+    if any(cs < hi[0] and ce > lo[0] for cs, ce in zip(closed_starts, closed_ends)):
+        problems.append(_problem("closed", "Outside the device's operating hours"))
+    return problems
+
+def _build_cart(cart_items: List[Dict], id_prefix: str) -> Tuple[List[Dict], List[Dict], Dict[str, int]]:
+    """
+    Turns cart items into bookings and checks each against its calendar.
+    Returns per-item results, the bookings that could be built and booking_id -> item index.
+    """
+    now = datetime.now()
+    items, bookings, index_of = [], [], {}
+    for n, item in enumerate(cart_items):
+        try:
+            booking = _cart_booking(item, f"{id_prefix}-{item['DeviceId']}-{n + 1}")
+        except (KeyError, TypeError, ValueError):
+            items.append({"index": n, "ok": False, "problems": [_problem("invalid", "Needs DeviceId, SlotStart and SlotEnd")]})
+            continue
+        problems = _calendar_problems(booking, now)
+        items.append({"index": n, "ok": not problems, "problems": problems})
+        bookings.append(booking)
+        index_of[booking['booking_id']] = n
+    return items, bookings, index_of
+
+def _check_cart(cart_items: List[Dict], id_prefix: str, holder: Optional[str]) -> Tuple[Dict, List[Dict], List[Dict]]:
+    """
+    Validates a whole cart in one pass: each item against its calendar, then all
+    of them against the indexed bookings, other holders' holds and each other.
+    Returns the validation result, the bookings that could be built and the store conflicts.
+    """
+    items, bookings, index_of = _build_cart(cart_items, id_prefix)
+    conflicts = bookings_store.find_conflicts(bookings, holder)
+    _add_conflicts(items, conflicts, index_of)
+    return {"valid": all(i['ok'] for i in items), "items": items}, bookings, conflicts
+
+def _add_conflicts(items: List[Dict], conflicts: List[Dict], index_of: Dict[str, int]):
+    for c in conflicts:
+        n = index_of[c['booking']['booking_id']]
+        if c['reason'] == 'batch':
+            problem = _problem("cart", f"Overlaps cart item {index_of[c['conflicts_with']] + 1}", c['conflicts_with'])
+        else:
+            problem = _problem(c['reason'], _CONFLICT_MESSAGES[c['reason']], c['conflicts_with'])
+        items[n]['problems'].append(problem)
+    for item in items:
+        item['ok'] = not item['problems']
+
+@tracing.traced('booking_manager.validate_cart')
+def validate_cart(cart_items: List[Dict], holder: Optional[str] = None) -> Dict:
+    """
+    Checks whether the cart could be booked right now, without booking or holding it.
+    Slots held by `holder` itself count as free.
+    Result: {"valid": bool, "items": [{"index": 0, "ok": bool, "problems": [{"reason", "message", ...}]}]}
+    """
+    return _check_cart(cart_items, "ITEM", holder)[0]
+
+@tracing.traced('booking_manager.hold_cart')
+def hold_cart(cart_items: List[Dict], holder: str, ttl: Optional[float] = None) -> Dict:
+    """
+    Validates the cart and, if it is bookable, holds its slots for `holder` for
+    ttl seconds (at most CART_HOLD_SECONDS), replacing the holder's previous holds.
+    An empty cart releases them. Other holders can't hold or book held slots.
+    """
+    if not cart_items:
+        release_holds(holder)
+        return {"status": "released", "holder": holder, "valid": True, "items": []}
+
+    result, bookings, _ = _check_cart(cart_items, "ITEM", holder)
+    if not result['valid']:
+        return {"status": "error", "message": "Some sessions can't be held.", **result}
+
+    ttl = min(float(ttl), CART_HOLD_SECONDS) if ttl and float(ttl) > 0 else CART_HOLD_SECONDS
+    try:
+        holds = bookings_store.hold_slots(bookings, holder, ttl)
+    except bookings_store.BookingConflictError as e:
+        # Lost a race since validation
+        _add_conflicts(result['items'], e.conflicts, {b['booking_id']: n for n, b in enumerate(bookings)})
+        return {"status": "error", "message": "Some sessions can't be held.", **result, "valid": False}
+
+    return {
+        "status": "held",
+        "holder": holder,
+        "hold_ids": [h['hold_id'] for h in holds],
+        "expires_at": datetime.fromtimestamp(holds[0]['expires_at']).isoformat(timespec='seconds'),
+        **result
+    }
+
+def release_holds(holder: str):
+    """
+    Drops all holds of `holder`.
+    """
+    bookings_store.release_holds(holder)
+
+def _fingerprint(cart_items: List[Dict], holder: Optional[str], partial: bool) -> str:
+    """
+    Identifies a booking request, so an idempotency key can't be reused for a different one.
+    """
+    request = [[item.get('DeviceId'), item.get('SlotStart'), item.get('SlotEnd'),
+                item.get('CustomerCode'), item.get('TrainingType')] for item in cart_items]
+    return hashlib.sha256(json.dumps([request, holder, partial], default=str).encode()).hexdigest()
+
+def _booking_response(confirmation_number: str, items: List[Dict], added: List[Dict], conflicts: List[Dict]) -> Dict:
+    booked = len(added)
+    if booked and booked == len(items):
+        return {
+            "status": "success",
+            "confirmation_number": confirmation_number,
+            "booked_count": booked,
+            "items": items
+        }
+    if booked:
+        return {
+            "status": "partial",
+            "message": f"{len(items) - booked} of {len(items)} sessions couldn't be booked.",
+            "confirmation_number": confirmation_number,
+            "booked_count": booked,
+            "conflicts": conflicts,
+            "items": items
         }
-        BOOKED_SESSIONS.append(booking)
-        new_bookings.append(booking)
-        
     return {
-        "status": "success",
-        "confirmation_number": confirmation_number,
-        "booked_count": len(new_bookings)
+        "status": "error",
+        "message": "Some sessions are no longer available.",
+        "booked_count": 0,
+        "conflicts": conflicts,
+        "items": items
     }
+
+@tracing.traced('booking_manager.book_sessions')
+def book_sessions(cart_items: List[Dict], holder: Optional[str] = None, idempotency_key: Optional[str] = None,
+                  partial: bool = False) -> Dict:
+    """
+    Books the sessions in the cart as one batch.
+    Items are checked against their calendars, then committed in one transaction:
+    - partial=False: all or nothing. If any item is invalid or overlaps an existing
+      booking, another holder's hold or another cart item, nothing is booked.
+    - partial=True: every valid item that is still free is booked; the rest are
+      reported. Earlier items win overlaps within the cart.
+    Each item's result is in "items" (with its booking_id once booked). Status is
+    "success", "partial" or "error". Holds of `holder` are released once it books.
+    With an idempotency_key, the response of the first request that reached the
+    store is returned again (with "replayed": True) for a retry with the same key.
+    Raises bookings_store.IdempotencyKeyError if the key was used for a different cart.
+    """
+    fingerprint = _fingerprint(cart_items, holder, partial) if idempotency_key else None
+    if idempotency_key:
+        stored = bookings_store.replay_response(idempotency_key, fingerprint)
+        if stored is not None:
+            return {**stored, "replayed": True}
+
+    confirmation_number = f"CONF-{uuid.uuid4().hex[:8].upper()}"
+    items, bookings, index_of = _build_cart(cart_items, confirmation_number)
+    if not partial and not all(i['ok'] for i in items):
+        # Nothing to commit; a retry is checked again
+        return _booking_response(confirmation_number, items, [], [])
+
+    def respond(added: List[Dict], conflicts: List[Dict]) -> Dict:
+        _add_conflicts(items, conflicts, index_of)
+        for b in added:
+            items[index_of[b['booking_id']]]['booking_id'] = b['booking_id']
+        return _booking_response(confirmation_number, items, added, conflicts)
+
+    valid = [b for b in bookings if items[index_of[b['booking_id']]]['ok']]
+    response, replayed = bookings_store.commit_bookings(valid, holder, partial, idempotency_key, fingerprint, respond)
+    if replayed:
+        return {**response, "replayed": True}
+    return response
@@ -1,71 +1,227 @@
-import requests
 import os
-from typing import List, Dict, Optional
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Set, Tuple
+from services import booking_transport, tracing
+from services.cache import TTLCache
+from services.device_catalog import DeviceCatalog
 
-# Default to local dev server if not set
-API_BASE_URL = os.getenv('SIMULATOR_API_URL', 'http://127.0.0.1:5000/api')
+# Client used by the chat agent. Calls go through a transport: in-process
+# booking_manager calls when colocated with the API, or HTTP otherwise
+# (see BOOKING_TRANSPORT in booking_transport).
+_transport = None
 
+# Device metadata rarely changes; availability only changes when a booking is made.
+# Availability entries are dropped by book_sessions for the devices/dates it
+# touches, and for bookings made elsewhere as their change events arrive (the
+# transport's watch_changes, see change_feed). A lookup that was running when
+# entries were dropped isn't stored, as it may predate the booking (see
+# TTLCache.get_or_set). Transports answer a failed call
+# with an empty result, so empty results are never cached: an outage must not
+# read as "fully booked" for the rest of the TTL.
+DEVICE_CACHE = TTLCache(
+    maxsize=int(os.getenv('BOOKING_CACHE_DEVICE_SIZE', '256')),
+    ttl=float(os.getenv('BOOKING_CACHE_DEVICE_TTL', '3600')))
+AVAILABILITY_CACHE = TTLCache(
+    maxsize=int(os.getenv('BOOKING_CACHE_AVAILABILITY_SIZE', '1024')),
+    ttl=float(os.getenv('BOOKING_CACHE_AVAILABILITY_TTL', '30')))
+
+def get_transport():
+    global _transport
+    if _transport is None:
+        _transport = booking_transport.create_transport()
+        _transport.watch_changes(_on_change)
+    return _transport
+
+def _on_change(event: Dict):
+    if event.get('type') == 'change':
+        invalidate_days({(event['device_id'], date) for date in event['dates']})
+    elif event.get('type') == 'resync':
+        # Events were missed: anything cached may be stale
+        AVAILABILITY_CACHE.clear()
+
+def clear_caches():
+    DEVICE_CACHE.clear()
+    AVAILABILITY_CACHE.clear()
+
+def cache_stats() -> Dict:
+    return {
+        "devices": DEVICE_CACHE.stats(),
+        "availability": AVAILABILITY_CACHE.stats()
+    }
+
+def invalidate_days(days: Set[Tuple[int, str]]):
+    """
+    Drops cached availability for these (device_id, date) pairs, including
+    batch results and searches covering them, in one pass over the cache.
+    """
+    if not days:
+        return
+    dates = sorted({date for _, date in days})
+
+    def stale(key) -> bool:
+        if key[0] == 'day':
+            # ('day', device_id, date, duration)
+            return (key[1], key[2]) in days
+        if key[0] == 'earliest':
+            # Searches can't tell which devices they looked at
+            return True
+        # ('batch', start_date, end_date, device_ids, campus_id, duration).
+        # Campus-wide batches don't list their devices, so drop any that cover a date.
+        covered = [d for d in dates if key[1] <= d <= key[2]]
+        return bool(covered) and (not key[3] or any((device_id, d) in days for d in covered for device_id in key[3]))
+
+    AVAILABILITY_CACHE.invalidate_where(stale)
+
+def _invalidate_items(items: List[Dict]):
+    days = set()
+    for item in items:
+        try:
+            days.update((int(item['DeviceId']), date) for date in _booked_dates(item))
+        except (KeyError, TypeError, ValueError):
+            continue
+    invalidate_days(days)
+
+def _booked_dates(item: Dict) -> List[str]:
+    start = datetime.fromisoformat(item['SlotStart'])
+    end = datetime.fromisoformat(item['SlotEnd'])
+    day = start.date()
+    dates = []
+    while day <= end.date():
+        dates.append(day.isoformat())
+        day += timedelta(days=1)
+    return dates
+
+@tracing.traced('booking_service.get_devices')
 def get_devices(campus_id: Optional[int] = None, device_code: Optional[str] = None) -> List[Dict]:
     """
     Fetches devices from the API.
     """
-    params = {}
-    if campus_id: params['campus_id'] = campus_id
-    if device_code: params['device_code'] = device_code
-    
-    try:
-        response = requests.get(f"{API_BASE_URL}/devices", params=params, timeout=10)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        print(f"API Error (get_devices): {e}")
-        return []
+    # Empty results are not cached: they may be a transport error fallback
+    return DEVICE_CACHE.get_or_set(
+        ('devices', campus_id, device_code),
+        lambda: get_transport().get_devices(campus_id, device_code),
+        should_cache=bool)
+
+def _catalog() -> DeviceCatalog:
+    # The whole fleet indexed, cached like the device list it is built from
+    return DEVICE_CACHE.get_or_set(
+        ('catalog',),
+        lambda: DeviceCatalog(get_transport().get_devices()),
+        should_cache=lambda catalog: bool(catalog.devices))
+
+def get_device_by_code(device_code: str) -> Optional[Dict]:
+    """
+    The device with exactly this code (case-insensitive), or None.
+    """
+    return _catalog().get_by_code(device_code)
+
+def get_campus_id(name: str) -> Optional[int]:
+    """
+    Id of the campus whose name appears in `name` (e.g. "miami campus" -> 1), or None.
+    """
+    return _catalog().campus_id_for_name(name)
+
+@tracing.traced('booking_service.get_device')
+def get_device(device_id: int) -> Optional[Dict]:
+    """
+    Fetches a single device by id. Returns None if it doesn't exist.
+    """
+    return DEVICE_CACHE.get_or_set(
+        ('device', int(device_id)),
+        lambda: get_transport().get_device(device_id),
+        should_cache=bool)
+
+@tracing.traced('booking_service.get_calendar')
+def get_calendar(device_id: int) -> Optional[Dict]:
+    """
+    Operating hours and bookable durations (minutes) for a device, or None.
+    """
+    return DEVICE_CACHE.get_or_set(
+        ('calendar', int(device_id)),
+        lambda: get_transport().get_calendar(device_id),
+        should_cache=bool)
 
+@tracing.traced('booking_service.get_booked_sessions')
 def get_booked_sessions(device_ids: List[int], start_date: str, end_date: str) -> List[Dict]:
     """
     Fetches booked sessions from the API.
     """
-    payload = {
-        "device_ids": device_ids,
-        "start_date": start_date,
-        "end_date": end_date
-    }
-    
-    try:
-        response = requests.post(f"{API_BASE_URL}/booked_sessions", json=payload, timeout=10)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        print(f"API Error (get_booked_sessions): {e}")
-        return []
-
-def get_availability(device_id: int, date: str) -> List[Dict]:
-    """
-    Fetches availability from the API.
-    """
-    params = {
-        "device_id": device_id,
-        "date": date
-    }
-    
-    try:
-        response = requests.get(f"{API_BASE_URL}/availability", params=params, timeout=10)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        print(f"API Error (get_availability): {e}")
-        return []
-
-def book_sessions(cart_items: List[Dict]) -> Dict:
-    """
-    Sends booking request to the API.
-    """
-    payload = {"cart": cart_items}
-    
-    try:
-        response = requests.post(f"{API_BASE_URL}/book", json=payload, timeout=10)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        print(f"API Error (book_sessions): {e}")
-        return {"status": "error", "message": str(e)}
+    return get_transport().get_booked_sessions(device_ids, start_date, end_date)
+
+@tracing.traced('booking_service.get_availability')
+def get_availability(device_id: int, date: str, duration: Optional[int] = None) -> List[Dict]:
+    """
+    Fetches availability from the API. duration is in minutes (device default if None).
+    """
+    return AVAILABILITY_CACHE.get_or_set(
+        ('day', int(device_id), date[:10], duration),
+        lambda: get_transport().get_availability(device_id, date, duration),
+        should_cache=bool)
+
+@tracing.traced('booking_service.get_availability_batch')
+def get_availability_batch(start_date: str, end_date: str, device_ids: Optional[List[int]] = None, campus_id: Optional[int] = None,
+                           duration: Optional[int] = None) -> List[Dict]:
+    """
+    Fetches availability for several devices (or a whole campus) over a date range in one call.
+    """
+    end_date = end_date or start_date
+    key = ('batch', start_date[:10], end_date[:10], tuple(int(d) for d in device_ids or []), campus_id, duration)
+    return AVAILABILITY_CACHE.get_or_set(
+        key,
+        lambda: get_transport().get_availability_batch(start_date, end_date, device_ids, campus_id, duration),
+        should_cache=bool)
+
+@tracing.traced('booking_service.find_earliest_slots')
+def find_earliest_slots(aircraft_type: Optional[str] = None, campus_id: Optional[int] = None,
+                        device_ids: Optional[List[int]] = None, start_date: Optional[str] = None,
+                        end_date: Optional[str] = None, earliest: Optional[str] = None,
+                        latest: Optional[str] = None, duration: Optional[int] = None, limit: int = 5) -> List[Dict]:
+    """
+    The earliest free slots across matching devices (see booking_manager.find_earliest_slots).
+    """
+    filters = dict(aircraft_type=aircraft_type, campus_id=campus_id, device_ids=device_ids, start_date=start_date,
+                   end_date=end_date, earliest=earliest, latest=latest, duration=duration, limit=limit)
+    key = ('earliest',) + tuple(tuple(v) if isinstance(v, list) else v for v in filters.values())
+    return AVAILABILITY_CACHE.get_or_set(key, lambda: get_transport().find_earliest_slots(**filters), should_cache=bool)
+
+@tracing.traced('booking_service.validate_cart')
+def validate_cart(cart_items: List[Dict], holder: Optional[str] = None) -> Dict:
+    """
+    Checks the cart against live bookings, holds and itself. Never cached.
+    """
+    return get_transport().validate_cart(cart_items, holder)
+
+@tracing.traced('booking_service.hold_cart')
+def hold_cart(cart_items: List[Dict], holder: str) -> Dict:
+    """
+    Validates the cart and holds its slots for `holder` (an empty cart releases them).
+    """
+    return get_transport().hold_cart(cart_items, holder)
+
+@tracing.traced('booking_service.release_holds')
+def release_holds(holder: str):
+    get_transport().release_holds(holder)
+
+@tracing.traced('booking_service.book_sessions')
+def book_sessions(cart_items: List[Dict], holder: Optional[str] = None, idempotency_key: Optional[str] = None) -> Dict:
+    """
+    Sends booking request to the API. Slots held by `holder` count as free.
+    Every call carries an idempotency key (a new one unless given), so the
+    transport can retry it without booking twice.
+    """
+    result = get_transport().book_sessions(cart_items, holder, idempotency_key or uuid.uuid4().hex)
+    # Invalidate even on failure: a conflict means our cached view was stale
+    _invalidate_items(cart_items)
+    return result
+
+@tracing.traced('booking_service.book_bulk')
+def book_bulk(items: List[Dict], holder: Optional[str] = None, idempotency_key: Optional[str] = None,
+              all_or_nothing: bool = False) -> Dict:
+    """
+    Books many sessions in one batch, by default booking what is free and
+    reporting the rest per item (see booking_manager.book_sessions).
+    """
+    result = get_transport().book_bulk(items, holder, idempotency_key or uuid.uuid4().hex, all_or_nothing)
+    _invalidate_items(items)
+    return result
@@ -0,0 +1,392 @@
+import json
+import os
+import threading
+from typing import Callable, Iterator, List, Dict, Optional
+from services import change_feed, compact, http_client, tracing
+
+# How booking_service reaches the booking API.
+# - "local": call booking_manager in-process (agent and API share a process).
+# - "http": call the REST API at SIMULATOR_API_URL (split deployments).
+# Defaults to "http" when SIMULATOR_API_URL is set, otherwise "local".
+API_BASE_URL = os.getenv('SIMULATOR_API_URL')
+BOOKING_TRANSPORT = os.getenv('BOOKING_TRANSPORT') or ('http' if os.getenv('SIMULATOR_API_URL') else 'local')
+# Ask the API for the compact availability/booked sessions format (services/compact.py)
+BOOKING_API_COMPACT = os.getenv('BOOKING_API_COMPACT', '1') not in ('0', 'false', 'no')
+
+log = tracing.get_logger('booking_transport')
+
+def _is_compact(response) -> bool:
+    return response.headers.get('Content-Type', '').startswith(compact.MEDIA_TYPE)
+
+class HttpTransport:
+    """
+    Talks to the booking REST API over the pooled HTTP client.
+    """
+    def __init__(self, base_url: str, compact_responses: bool = BOOKING_API_COMPACT):
+        self.base_url = base_url
+        # The API may still answer verbose (older server, unrepresentable data); both are handled
+        self.accept = {"Accept": f"{compact.MEDIA_TYPE}, application/json;q=0.9"} if compact_responses else {}
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def get_devices(self, campus_id: Optional[int] = None, device_code: Optional[str] = None) -> List[Dict]:
+        params = {}
+        if campus_id: params['campus_id'] = campus_id
+        if device_code: params['device_code'] = device_code
+        
+        try:
+            response = http_client.get(f"{self.base_url}/devices", "devices", params=params)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            log.error("Booking API call failed", extra={"fields": {"call": "get_devices", "error": str(e)}})
+            return []
+
+    def get_device(self, device_id: int) -> Optional[Dict]:
+        try:
+            response = http_client.get(f"{self.base_url}/devices/{int(device_id)}", "devices")
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            log.error("Booking API call failed", extra={"fields": {"call": "get_device", "error": str(e)}})
+            return None
+
+    def get_calendar(self, device_id: int) -> Optional[Dict]:
+        try:
+            response = http_client.get(f"{self.base_url}/devices/{int(device_id)}/calendar", "devices")
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            log.error("Booking API call failed", extra={"fields": {"call": "get_calendar", "error": str(e)}})
+            return None
+
+    def get_booked_sessions(self, device_ids: List[int], start_date: str, end_date: str) -> List[Dict]:
+        payload = {
+            "device_ids": device_ids,
+            "start_date": start_date,
+            "end_date": end_date
+        }
+        
+        try:
+            response = http_client.post(f"{self.base_url}/booked_sessions", "booked_sessions", json=payload,
+                                        headers=self.accept, retry=True)
+            response.raise_for_status()
+            if _is_compact(response):
+                return compact.decode_sessions(compact.loads(response.content))
+            return response.json()
+        except Exception as e:
+            log.error("Booking API call failed", extra={"fields": {"call": "get_booked_sessions", "error": str(e)}})
+            return []
+
+    def get_availability(self, device_id: int, date: str, duration: Optional[int] = None) -> List[Dict]:
+        params = {
+            "device_id": device_id,
+            "date": date
+        }
+        if duration: params['duration'] = duration
+        
+        try:
+            response = http_client.get(f"{self.base_url}/availability", "availability", params=params,
+                                       headers=self.accept)
+            if response.status_code == 400:
+                # Bad date or a duration the device doesn't offer
+                return []
+            response.raise_for_status()
+            if _is_compact(response):
+                return compact.decode_slots(compact.loads(response.content))
+            return response.json()
+        except Exception as e:
+            log.error("Booking API call failed", extra={"fields": {"call": "get_availability", "error": str(e)}})
+            return []
+
+    def get_availability_batch(self, start_date: str, end_date: str, device_ids: Optional[List[int]] = None, campus_id: Optional[int] = None,
+                               duration: Optional[int] = None) -> List[Dict]:
+        payload = {
+            "device_ids": device_ids or [],
+            "campus_id": campus_id,
+            "start_date": start_date,
+            "end_date": end_date,
+            "duration": duration
+        }
+        
+        try:
+            response = http_client.post(f"{self.base_url}/availability/batch", "availability_batch", json=payload,
+                                        headers=self.accept, retry=True)
+            response.raise_for_status()
+            if _is_compact(response):
+                return compact.decode_availability(compact.loads(response.content))
+            return response.json()
+        except Exception as e:
+            log.error("Booking API call failed", extra={"fields": {"call": "get_availability_batch", "error": str(e)}})
+            return []
+
+    def find_earliest_slots(self, **filters) -> List[Dict]:
+        params = {k: v for k, v in filters.items() if v not in (None, '', [])}
+        if params.get('device_ids'):
+            params['device_ids'] = ",".join(str(d) for d in params['device_ids'])
+        
+        try:
+            response = http_client.get(f"{self.base_url}/availability/earliest", "availability_batch", params=params)
+            if response.status_code == 400:
+                # Bad date or time window
+                return []
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            log.error("Booking API call failed", extra={"fields": {"call": "find_earliest_slots", "error": str(e)}})
+            return []
+
+    def validate_cart(self, cart_items: List[Dict], holder: Optional[str] = None) -> Dict:
+        payload = {"cart": cart_items, "holder": holder}
+        
+        try:
+            response = http_client.post(f"{self.base_url}/cart/validate", "cart", json=payload, retry=True)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            log.error("Booking API call failed", extra={"fields": {"call": "validate_cart", "error": str(e)}})
+            return {"valid": False, "items": [], "message": str(e)}
+
+    def hold_cart(self, cart_items: List[Dict], holder: str) -> Dict:
+        payload = {"cart": cart_items, "holder": holder}
+        
+        try:
+            # Holding replaces the holder's holds, so a retry is safe
+            response = http_client.post(f"{self.base_url}/cart/hold", "cart", json=payload, retry=True)
+            if response.status_code == 409:
+                # Problems are in the body
+                return response.json()
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            log.error("Booking API call failed", extra={"fields": {"call": "hold_cart", "error": str(e)}})
+            return {"status": "error", "message": str(e), "valid": False, "items": []}
+
+    def release_holds(self, holder: str):
+        try:
+            response = http_client.request("DELETE", f"{self.base_url}/cart/hold", "cart", params={"holder": holder})
+            response.raise_for_status()
+        except Exception as e:
+            # Holds expire on their own
+            log.error("Booking API call failed", extra={"fields": {"call": "release_holds", "error": str(e)}})
+
+    def _book(self, path: str, call: str, payload: Dict, idempotency_key: Optional[str]) -> Dict:
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else {}
+        
+        try:
+            # With a key the server replays its first response, so retries can't double-book
+            response = http_client.post(f"{self.base_url}/{path}", "book", json=payload, headers=headers,
+                                        retry=bool(idempotency_key))
+            if response.status_code in (409, 422):
+                # Conflict details (or the key error) are in the body
+                body = response.json()
+                return body if 'status' in body else {"status": "error", "message": body.get('error')}
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            log.error("Booking API call failed", extra={"fields": {"call": call, "error": str(e)}})
+            return {"status": "error", "message": str(e)}
+
+    def book_sessions(self, cart_items: List[Dict], holder: Optional[str] = None, idempotency_key: Optional[str] = None) -> Dict:
+        return self._book("book", "book_sessions", {"cart": cart_items, "holder": holder}, idempotency_key)
+
+    def book_bulk(self, items: List[Dict], holder: Optional[str] = None, idempotency_key: Optional[str] = None,
+                  all_or_nothing: bool = False) -> Dict:
+        payload = {"items": items, "holder": holder, "all_or_nothing": all_or_nothing}
+        return self._book("book/bulk", "book_bulk", payload, idempotency_key)
+
+    def watch_changes(self, listener: Callable[[Dict], None]):
+        """
+        Relays the API's change feed (GET /changes) into this process's
+        change_feed on a background thread, and calls listener for each event.
+        """
+        change_feed.add_listener(listener)
+        if self._watcher is None or not self._watcher.is_alive():
+            self._stop.clear()
+            self._watcher = threading.Thread(target=self._watch, name='change-feed-http', daemon=True)
+            self._watcher.start()
+
+    def stop_watching(self, listener: Callable[[Dict], None]):
+        change_feed.remove_listener(listener)
+        # The thread exits at the next event or keep-alive
+        self._stop.set()
+
+    def _watch(self):
+        last_id = None
+        failures = 0
+        while not self._stop.is_set():
+            try:
+                headers = {"Last-Event-ID": last_id} if last_id else {}
+                with http_client.request("GET", f"{self.base_url}/changes", "changes", retry=False,
+                                         headers=headers, stream=True) as response:
+                    response.raise_for_status()
+                    failures = 0
+                    for event in _sse_events(response):
+                        if self._stop.is_set():
+                            return
+                        last_id = event.pop('id', last_id)
+                        event.pop('ts', None)
+                        change_feed.publish_event(event)
+            except Exception as e:
+                failures += 1
+                log.warning("Change feed stream failed", extra={"fields": {"call": "watch_changes", "error": str(e)}})
+            # Reconnect; Last-Event-ID picks up what was missed (or gets a resync)
+            self._stop.wait(min(30, 2 ** failures))
+
+def _sse_events(response) -> Iterator[Dict]:
+    """
+    Yields the JSON data of each server-sent event, with its id.
+    """
+    data, event_id = [], None
+    for line in response.iter_lines(decode_unicode=True):
+        if line:
+            field, _, value = line.partition(':')
+            value = value[1:] if value.startswith(' ') else value
+            if field == 'data':
+                data.append(value)
+            elif field == 'id':
+                event_id = value
+            continue
+        if data:
+            event = json.loads("\n".join(data))
+            if event_id:
+                event['id'] = event_id
+            yield event
+        data, event_id = [], None
+
+class LocalTransport:
+    """
+    Calls booking_manager directly. Mirrors the REST endpoints' validation and
+    error fallbacks so results are identical to HttpTransport.
+    """
+    def __init__(self):
+        # Imported lazily so an HTTP-only client doesn't load the store
+        from services import booking_manager
+        self.manager = booking_manager
+
+    def get_devices(self, campus_id: Optional[int] = None, device_code: Optional[str] = None) -> List[Dict]:
+        try:
+            return [dict(d) for d in self.manager.get_devices(campus_id, device_code)]
+        except Exception:
+            log.exception("Local booking call failed", extra={"fields": {"call": "get_devices"}})
+            return []
+
+    def get_device(self, device_id: int) -> Optional[Dict]:
+        try:
+            device = self.manager.get_device(int(device_id))
+            return dict(device) if device else None
+        except Exception:
+            log.exception("Local booking call failed", extra={"fields": {"call": "get_device"}})
+            return None
+
+    def get_calendar(self, device_id: int) -> Optional[Dict]:
+        try:
+            return self.manager.get_calendar(int(device_id))
+        except Exception:
+            log.exception("Local booking call failed", extra={"fields": {"call": "get_calendar"}})
+            return None
+
+    def get_booked_sessions(self, device_ids: List[int], start_date: str, end_date: str) -> List[Dict]:
+        if not device_ids or not start_date or not end_date:
+            return []
+        try:
+            return [dict(s) for s in self.manager.get_booked_sessions(device_ids, start_date, end_date)]
+        except Exception:
+            log.exception("Local booking call failed", extra={"fields": {"call": "get_booked_sessions"}})
+            return []
+
+    def get_availability(self, device_id: int, date: str, duration: Optional[int] = None) -> List[Dict]:
+        if not device_id or not date:
+            return []
+        try:
+            return self.manager.get_availability(int(device_id), date, duration)
+        except ValueError:
+            # Bad date or a duration the device doesn't offer (400 from the endpoint)
+            return []
+        except Exception:
+            log.exception("Local booking call failed", extra={"fields": {"call": "get_availability"}})
+            return []
+
+    def get_availability_batch(self, start_date: str, end_date: str, device_ids: Optional[List[int]] = None, campus_id: Optional[int] = None,
+                               duration: Optional[int] = None) -> List[Dict]:
+        try:
+            return self.manager.get_availability_batch(device_ids or [], start_date, end_date or start_date,
+                                                       campus_id=campus_id, duration=duration)
+        except Exception:
+            log.exception("Local booking call failed", extra={"fields": {"call": "get_availability_batch"}})
+            return []
+
+    def find_earliest_slots(self, **filters) -> List[Dict]:
+        try:
+            return self.manager.find_earliest_slots(**filters)
+        except ValueError:
+            # Bad date or time window (400 from the endpoint)
+            return []
+        except Exception:
+            log.exception("Local booking call failed", extra={"fields": {"call": "find_earliest_slots"}})
+            return []
+
+    def validate_cart(self, cart_items: List[Dict], holder: Optional[str] = None) -> Dict:
+        if not cart_items:
+            return {"valid": False, "items": [], "message": "Cart is empty"}
+        try:
+            return self.manager.validate_cart(cart_items, holder)
+        except Exception as e:
+            log.exception("Local booking call failed", extra={"fields": {"call": "validate_cart"}})
+            return {"valid": False, "items": [], "message": str(e)}
+
+    def hold_cart(self, cart_items: List[Dict], holder: str) -> Dict:
+        try:
+            return self.manager.hold_cart(cart_items, holder)
+        except Exception as e:
+            log.exception("Local booking call failed", extra={"fields": {"call": "hold_cart"}})
+            return {"status": "error", "message": str(e), "valid": False, "items": []}
+
+    def release_holds(self, holder: str):
+        try:
+            self.manager.release_holds(holder)
+        except Exception:
+            log.exception("Local booking call failed", extra={"fields": {"call": "release_holds"}})
+
+    def _book(self, call: str, items: List[Dict], holder: Optional[str], idempotency_key: Optional[str], partial: bool) -> Dict:
+        try:
+            return self.manager.book_sessions(items, holder, idempotency_key, partial=partial)
+        except self.manager.bookings_store.IdempotencyKeyError as e:
+            return {"status": "error", "message": str(e)}
+        except Exception as e:
+            log.exception("Local booking call failed", extra={"fields": {"call": call}})
+            return {"status": "error", "message": str(e)}
+
+    def book_sessions(self, cart_items: List[Dict], holder: Optional[str] = None, idempotency_key: Optional[str] = None) -> Dict:
+        if not cart_items:
+            return {"status": "error", "message": "Cart is empty"}
+        return self._book("book_sessions", cart_items, holder, idempotency_key, False)
+
+    def book_bulk(self, items: List[Dict], holder: Optional[str] = None, idempotency_key: Optional[str] = None,
+                  all_or_nothing: bool = False) -> Dict:
+        if not items:
+            return {"status": "error", "message": "No items"}
+        return self._book("book_bulk", items, holder, idempotency_key, not all_or_nothing)
+
+    def watch_changes(self, listener: Callable[[Dict], None]):
+        """
+        Calls listener for every booking change event (see change_feed).
+        """
+        change_feed.start()
+        change_feed.add_listener(listener)
+
+    def stop_watching(self, listener: Callable[[Dict], None]):
+        change_feed.remove_listener(listener)
+
+def create_transport(kind: str = BOOKING_TRANSPORT):
+    if kind == 'local':
+        return LocalTransport()
+    if kind == 'http':
+        if not API_BASE_URL:
+            raise ValueError("BOOKING_TRANSPORT=http needs SIMULATOR_API_URL (e.g. http://booking-api:5000/api)")
+        return HttpTransport(API_BASE_URL)
+    raise ValueError(f"Unknown BOOKING_TRANSPORT '{kind}' (expected 'local' or 'http')")
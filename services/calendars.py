@@ -0,0 +1,189 @@
+import json
+import os
+import re
+import threading
+from datetime import date, datetime, timedelta
+from heapq import merge
+from typing import Dict, List, Optional, Tuple
+
+from services.slot_engine import MINUTES_PER_DAY, SLOT_MINUTES, STEP_MINUTES, Intervals
+
+# Operating calendars: when a device can be booked and for how long.
+# Loaded from CALENDARS_FILE (default data/calendars.json):
+# {
+#     "default":  {...},
+#     "campuses": {"2": {...}},
+#     "devices":  {"101": {...}}
+# }
+# Each entry may define:
+#     "hours":     {"mon-fri": ["06:00-22:00"], "sat": ["08:00-12:00", "13:00-18:00"], "sun": []}
+#                  (keys: mon..sun, ranges like "mon-fri", or "daily"; days not listed stay closed)
+#     "holidays":  ["2026-12-25"]                                   closed all day
+#     "blackouts": [{"start": "2026-11-03T08:00", "end": "2026-11-04T12:00", "reason": "..."}]
+#     "durations": [120, 240, 360]                                  bookable lengths in minutes
+#     "default_duration": 240                                        used when none is requested
+#     "step":      60                                               minutes between candidate starts
+# A device uses the most specific "hours", "durations", "default_duration" and
+# "step" defined for it (device, then campus, then default); holidays and
+# blackouts from all levels apply. Without a file every device is open
+# 00:00-24:00 with 4-hour slots every hour.
+#
+# Calendars are compiled once into closed intervals in minutes per weekday and
+# per date, which slot_engine treats like bookings.
+
+CALENDARS_FILE = os.getenv('CALENDARS_FILE') or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'calendars.json')
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+FIELDS = ("hours", "durations", "default_duration", "step")
+HHMM_RE = re.compile(r'^(\d{1,2}):([0-5]\d)$')
+
+def parse_hhmm(text: str) -> int:
+    """
+    Minutes since midnight for "HH:MM" (up to "24:00"). Raises ValueError otherwise.
+    """
+    m = HHMM_RE.match(text.strip())
+    value = int(m.group(1)) * 60 + int(m.group(2)) if m else -1
+    if not 0 <= value <= MINUTES_PER_DAY:
+        raise ValueError(f"Invalid time '{text}', expected HH:MM")
+    return value
+
+def _weekday_keys(key: str) -> List[int]:
+    key = key.strip().lower()
+    if key == 'daily':
+        return list(range(7))
+    if '-' in key:
+        first, last = (WEEKDAYS.index(k.strip()) for k in key.split('-'))
+        return list(range(first, last + 1)) if first <= last else list(range(first, 7)) + list(range(0, last + 1))
+    return [WEEKDAYS.index(key)]
+
+def _closed_for_windows(windows: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    Complement of the open windows within one day.
+    """
+    closed = []
+    pointer = 0
+    for start, end in sorted(windows):
+        if start > pointer:
+            closed.append((pointer, start))
+        pointer = max(pointer, end)
+    if pointer < MINUTES_PER_DAY:
+        closed.append((pointer, MINUTES_PER_DAY))
+    return closed
+
+class Calendar:
+    """
+    A compiled calendar: closed minutes per weekday and extra closed minutes per
+    date (holidays and blackouts, split at midnight).
+    """
+    __slots__ = ("weekly", "by_date", "durations", "default_duration", "step", "hours")
+
+    def __init__(self, spec: Dict, holidays: List[str], blackouts: List[Dict]):
+        self.hours = spec.get('hours')
+        self.durations = tuple(int(d) for d in spec.get('durations') or [SLOT_MINUTES])
+        self.default_duration = int(spec.get('default_duration') or
+                                    (SLOT_MINUTES if SLOT_MINUTES in self.durations else self.durations[0]))
+        self.step = int(spec.get('step') or STEP_MINUTES)
+        if self.step <= 0 or any(d <= 0 for d in self.durations):
+            raise ValueError("Calendar durations and step must be positive")
+
+        if self.hours is None:
+            self.weekly = [[] for _ in range(7)]
+        else:
+            windows: List[List[Tuple[int, int]]] = [[] for _ in range(7)]
+            for key, ranges in self.hours.items():
+                for day in _weekday_keys(key):
+                    for text in ranges:
+                        start, end = text.split('-')
+                        windows[day].append((parse_hhmm(start), parse_hhmm(end)))
+            self.weekly = [_closed_for_windows(w) for w in windows]
+
+        self.by_date: Dict[int, List[Tuple[int, int]]] = {}
+        for text in holidays:
+            self.by_date.setdefault(date.fromisoformat(text).toordinal(), []).append((0, MINUTES_PER_DAY))
+        for blackout in blackouts:
+            start = datetime.fromisoformat(blackout['start'])
+            end = datetime.fromisoformat(blackout['end'])
+            day = start.date()
+            while datetime.combine(day, datetime.min.time()) < end:
+                midnight = datetime.combine(day, datetime.min.time())
+                lo = max(0, int((start - midnight).total_seconds() // 60))
+                hi = min(MINUTES_PER_DAY, -int(-(end - midnight).total_seconds() // 60))
+                if hi > lo:
+                    self.by_date.setdefault(day.toordinal(), []).append((lo, hi))
+                day += timedelta(days=1)
+        for intervals in self.by_date.values():
+            intervals.sort()
+
+    def closed_intervals(self, first_day: date, day_count: int) -> Intervals:
+        """
+        Closed time over day_count days as sorted (starts, ends) minutes since
+        midnight of first_day, in slot_engine's format.
+        """
+        starts, ends = [], []
+        ordinal = first_day.toordinal()
+        weekday = first_day.weekday()
+        for offset in range(day_count):
+            base = offset * MINUTES_PER_DAY
+            weekly = self.weekly[(weekday + offset) % 7]
+            extra = self.by_date.get(ordinal + offset)
+            for start, end in (merge(weekly, extra) if extra else weekly):
+                starts.append(base + start)
+                ends.append(base + end)
+        return starts, ends
+
+    def allows(self, duration: int) -> bool:
+        return duration in self.durations
+
+    def describe(self) -> Dict:
+        return {
+            "hours": self.hours,
+            "durations": list(self.durations),
+            "default_duration": self.default_duration,
+            "step": self.step,
+        }
+
+def _load(path: str) -> Dict:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+CONFIG = _load(CALENDARS_FILE)
+_compiled: Dict[Tuple, Calendar] = {}
+_lock = threading.Lock()
+
+def calendar_for(device: Optional[Dict]) -> Calendar:
+    """
+    Compiled calendar for a device dict (DeviceId, CampusId); cached per device.
+    """
+    device_id = str(device['DeviceId']) if device else None
+    campus_id = str(device['CampusId']) if device else None
+    key = (device_id, campus_id)
+    calendar = _compiled.get(key)
+    if calendar is not None:
+        return calendar
+
+    levels = [CONFIG.get('default') or {},
+              (CONFIG.get('campuses') or {}).get(campus_id) or {},
+              (CONFIG.get('devices') or {}).get(device_id) or {}]
+    spec = {}
+    holidays, blackouts = [], []
+    for level in levels:
+        spec.update({k: level[k] for k in FIELDS if k in level})
+        holidays.extend(level.get('holidays') or [])
+        blackouts.extend(level.get('blackouts') or [])
+
+    calendar = Calendar(spec, holidays, blackouts)
+    with _lock:
+        _compiled[key] = calendar
+    return calendar
+
+def merge_closed(booked: Intervals, closed: Intervals) -> Intervals:
+    """
+    Bookings plus closed time as one start-sorted interval list.
+    """
+    if not closed[0]:
+        return booked
+    pairs = list(merge(zip(*booked), zip(*closed)))
+    return [p[0] for p in pairs], [p[1] for p in pairs]
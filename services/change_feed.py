@@ -0,0 +1,256 @@
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from services import tracing
+
+# Booking change feed.
+# Once start() is called (by the API process), every commit in the booking
+# store is turned into one event per device:
+# {"type": "change", "id": "3f9a1c20:17", "ts": 1760000000.0,
+#  "device_id": 101, "dates": ["2026-10-20"], "booking_ids": ["BK-..."]}
+# and fanned out to:
+# - listeners (add_listener), e.g. booking_service dropping cached availability
+# - subscriptions (subscribe), each with its own device filter, e.g. the
+#   /api/changes SSE stream the web UI listens to
+# Commits made by other processes sharing a SQLite store are picked up from
+# its change log by a poller thread; a chat process on the HTTP transport
+# feeds the events it streams from the API into publish_event.
+#
+# Event ids are "<stream>:<n>" with a random stream id per process, so a client
+# resuming with Last-Event-ID from another process (or before a restart) gets
+# a {"type": "resync"} event telling it to reload instead of a silent gap.
+# A subscriber that falls SUBSCRIBER_QUEUE events behind gets the same, and
+# everyone does when the booking store is cleared.
+
+FEED_BUFFER = int(os.getenv('CHANGE_FEED_BUFFER', '1000')) # recent events kept for resume
+POLL_INTERVAL = float(os.getenv('CHANGE_FEED_POLL_INTERVAL', '0.5')) # seconds, SQLite change log
+SUBSCRIBER_QUEUE = 256
+
+log = tracing.get_logger('change_feed')
+
+RESYNC = {"type": "resync"}
+
+class Subscription:
+    """
+    Events for a set of devices (all devices if device_ids is None), read with get().
+    """
+    def __init__(self, device_ids: Optional[Set[int]]):
+        self.device_ids = device_ids
+        self.queue: "queue.Queue[Dict]" = queue.Queue(maxsize=SUBSCRIBER_QUEUE)
+        # Called after each queued event, e.g. to wake an async reader
+        # (which then reads with get(timeout=0) instead of blocking a thread)
+        self.notify: Optional[Callable[[], None]] = None
+
+    def wants(self, event: Dict) -> bool:
+        if self.device_ids is None or event.get('type') != 'change':
+            return True
+        return event['device_id'] in self.device_ids
+
+    def offer(self, event: Dict):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Slow consumer: drop its backlog and have it reload instead
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            self.queue.put_nowait(RESYNC)
+        if self.notify is not None:
+            self.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Dict]:
+        """
+        The next event, or None if there was none within timeout seconds.
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+_lock = threading.Lock()
+_subscriptions: List[Subscription] = []
+_listeners: List[Callable[[Dict], None]] = []
+_recent: deque = deque(maxlen=FEED_BUFFER)
+_counter = 0
+_stream = None
+_pid = None
+_store_attached = False
+
+def _ensure_started():
+    # Per-process state, redone after a fork so pre-forked workers each get
+    # their own stream id and (threads don't survive a fork) change log poller
+    global _stream, _pid, _counter
+    if _pid == os.getpid():
+        return
+    with _lock:
+        if _pid == os.getpid():
+            return
+        _stream = uuid.uuid4().hex[:8]
+        _counter = 0
+        _recent.clear()
+        _subscriptions.clear()
+        if _store_attached:
+            _start_poller()
+        _pid = os.getpid()
+
+def start():
+    """
+    Feeds this process's booking store commits, and for a SQLite store other
+    processes' commits too, into the feed. Idempotent.
+    """
+    global _store_attached
+    # Imported here so HTTP-only clients don't load the store
+    from data import bookings_store
+    _ensure_started()
+    with _lock:
+        if _store_attached:
+            return
+        _store_attached = True
+        bookings_store.add_listener(_on_store_changes)
+        _start_poller()
+
+def _start_poller():
+    from data import bookings_store
+    if isinstance(bookings_store.STORE, bookings_store.SQLiteBookingStore) and POLL_INTERVAL > 0:
+        threading.Thread(target=_poll, args=(bookings_store.last_change_seq(),),
+                         name='change-feed-poller', daemon=True).start()
+
+def _booked_dates(start_time: str, end_time: str) -> List[str]:
+    day = datetime.fromisoformat(start_time).date()
+    last = datetime.fromisoformat(end_time).date()
+    dates = []
+    while day <= last:
+        dates.append(day.isoformat())
+        day += timedelta(days=1)
+    return dates
+
+def events_for(changes: List[Dict]) -> List[Dict]:
+    """
+    Groups store change records into one event per device.
+    """
+    by_device: Dict[int, Tuple[Set[str], List[str]]] = {}
+    for change in changes:
+        dates, booking_ids = by_device.setdefault(change['device_id'], (set(), []))
+        dates.update(_booked_dates(change['start_time'], change['end_time']))
+        booking_ids.append(change['booking_id'])
+    return [{"type": "change", "device_id": device_id, "dates": sorted(dates), "booking_ids": booking_ids}
+            for device_id, (dates, booking_ids) in by_device.items()]
+
+def _on_store_changes(changes: List[Dict]):
+    if not changes or any(change.get('reset') for change in changes):
+        # The store was cleared (here, or by another worker per the change
+        # log): listeners and clients reload, and clients resuming from an
+        # earlier event get the resync among what they missed
+        publish_event(RESYNC)
+        return
+    for event in events_for(changes):
+        publish_event(event)
+
+def _poll(cursor: int):
+    # Commits by other processes; ours were delivered by the store listener
+    from data import bookings_store
+    me = bookings_store.origin()
+    while True:
+        time.sleep(POLL_INTERVAL)
+        try:
+            changes = bookings_store.changes_since(cursor, me)
+            if changes:
+                cursor = changes[-1]['seq']
+                _on_store_changes(changes)
+        except Exception:
+            log.exception("Change log poll failed")
+
+def publish_event(event: Dict) -> Dict:
+    """
+    Numbers a change event and delivers it to listeners and matching subscriptions.
+    """
+    global _counter
+    _ensure_started()
+    with _lock:
+        _counter += 1
+        event = dict(event, id=f"{_stream}:{_counter}", ts=time.time())
+        _recent.append(event)
+        subscriptions = [s for s in _subscriptions if s.wants(event)]
+        listeners = list(_listeners)
+    for subscription in subscriptions:
+        subscription.offer(event)
+    for listener in listeners:
+        try:
+            listener(event)
+        except Exception:
+            log.exception("Change feed listener failed")
+    return event
+
+def add_listener(listener: Callable[[Dict], None]):
+    """
+    Calls listener(event) for every change event. Idempotent.
+    """
+    _ensure_started()
+    with _lock:
+        if listener not in _listeners:
+            _listeners.append(listener)
+
+def remove_listener(listener: Callable[[Dict], None]):
+    with _lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+def _missed(last_event_id: str) -> Optional[List[Dict]]:
+    # Events after last_event_id, or None if they are no longer (or never were) known here
+    stream, _, number = last_event_id.partition(':')
+    if stream != _stream or not number.isdigit() or int(number) > _counter:
+        return None
+    number = int(number)
+    if number < _counter - len(_recent):
+        return None
+    return [e for e in _recent if int(e['id'].partition(':')[2]) > number]
+
+def subscribe(device_ids: Optional[Iterable[int]] = None, last_event_id: Optional[str] = None) -> Subscription:
+    """
+    Subscribes to changes on device_ids (all devices if empty). With the id of
+    the last event a client saw, the events it missed are queued first.
+    """
+    _ensure_started()
+    subscription = Subscription({int(d) for d in device_ids} if device_ids else None)
+    with _lock:
+        if last_event_id:
+            missed = _missed(last_event_id)
+            if missed is None:
+                subscription.offer(RESYNC)
+            else:
+                for event in missed:
+                    if subscription.wants(event):
+                        subscription.offer(event)
+        _subscriptions.append(subscription)
+    return subscription
+
+def unsubscribe(subscription: Subscription):
+    with _lock:
+        if subscription in _subscriptions:
+            _subscriptions.remove(subscription)
+
+def changed_since(ts: float, days: Set[Tuple[int, str]]) -> List[Dict]:
+    """
+    Recent events after ts (time.time()) touching any of the (device_id, date) pairs.
+    """
+    with _lock:
+        recent = [e for e in _recent if e['ts'] > ts]
+    return [e for e in recent
+            if e.get('type') == 'change' and any((e['device_id'], d) in days for d in e['dates'])]
+
+def format_sse(event: Dict) -> str:
+    """
+    One server-sent event; change events carry their id for Last-Event-ID.
+    """
+    head = f"id: {event['id']}\n" if 'id' in event else ""
+    return f"{head}event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+def stats() -> Dict:
+    with _lock:
+        return {"subscriptions": len(_subscriptions), "listeners": len(_listeners), "published": _counter}
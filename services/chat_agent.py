@@ -1,160 +1,518 @@
-import os
+import asyncio
+import contextvars
 import json
-import requests
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from services import booking_service
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from services import booking_service, change_feed, intent_parser, llm_client, prompt_context, tracing
+
+# Max LLM calls per user message; each call may request several tools
+MAX_TOOL_STEPS = int(os.getenv('LLM_MAX_TOOL_STEPS', '5'))
 
+# Session length used when a device's calendar can't be fetched
+DEFAULT_DURATION_MINUTES = 240
+
+# Static preamble. Kept free of per-turn data so it forms a stable prompt prefix.
 SYSTEM_PROMPT = """
 You are a Flight Simulator Booking Assistant. 
 Your goal is to help users list simulators, check availability, and book sessions.
 
-You must maintain context from the "Conversation History". If a user says "the second one" or "that simulator", refer to the previous list or context to identify the specific device.
-
-You have access to the following TOOLS. You must strictly output JSON to call a tool or reply to the user.
-Do not output markdown code blocks. Just the JSON object.
-
-TOOLS:
-1. `list_devices`: Parameters: `campus_id` (optional int), `campus_name` (optional str), `device_code` (optional str)
-2. `check_availability`: Parameters: `device_id` (optional int), `device_code` (optional str), `date` (str, YYYY-MM-DD). Use today's date if relative.
-   - You MUST provide either `device_id` or `device_code`.
-3. `add_to_cart`: Parameters: `device_id` (optional int), `device_code` (optional str), `start_time` (str, HH:MM or ISO), `date` (optional str).
-   - USE THIS TOOL when the user says "book", "add", "reserve" or selects a time.
-   - You can infer missing `device_id` or `date` from the `Last Interaction Context`.
-   - `end_time` is auto-calculated (4 hours), so you don't need to provide it.
-4. `view_cart`: No parameters.
-5. `confirm_booking`: No parameters.
-6. `reply`: Parameters: `message` (str). Use this to ask clarifying questions or provide info.
-
-RESPONSE FORMAT:
-{{
-    "action": "one_of_the_tool_names_or_reply",
-    "params": {{ ... }}
-}}
+You must maintain context from the conversation. If a user says "the second one" or "that simulator", refer to the previous list or context to identify the specific device.
 
+Use the provided tools to look things up and act. You may call several tools at once when they are independent,
+and keep calling tools until the user's request is done (e.g. check availability, then add the first free slot to the cart).
+Reply to the user in plain text once you have what you need, or to ask a clarifying question.
 
+- Use today's date for relative dates.
+- `add_to_cart`: use when the user says "book", "add", "reserve" or selects a time. Missing device or date can come from the last interaction context. The end time is auto-calculated from duration_hours (the device's default length, usually 4 hours, if omitted). The slot is checked and held for the user; if it is taken, offer other free slots.
+- Pass `duration_hours` to availability checks and `add_to_cart` when the user asks for a specific session length.
+- Prefer `check_availability_range` over repeated `check_availability` calls when the user asks about several devices, a whole campus, or several days.
+- Use `find_earliest_slots` for "next free", "earliest" or "soonest" questions instead of checking day by day.
+- If the context has `availability_changed`, those devices/dates were booked by someone else since your last reply: check availability again before offering or adding slots on them.
+"""
 
-CONTEXT:
+CONTEXT_PROMPT = """
 Today is: {today}
 Current Session Cart: {cart}
 Last Interaction Context: {context}
+"""
 
-Conversation History:
-{chat_history}
+def _tool(name: str, description: str, properties: Dict = None, required: List[str] = None) -> Dict:
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": description,
+            "parameters": {"type": "object", "properties": properties or {}, "required": required or []}
+        }
+    }
 
-User Input: {user_input}
-"""
+# Session length; each device's calendar lists what it offers (2/4/6h products etc.)
+DURATION_PARAM = {"type": "number", "description": "Session length in hours; the device's default (usually 4) if omitted"}
 
-def process_message(message: str, session) -> str:
-    """
-    Process message using LLM via direct HTTP request if configured, otherwise fallback to mock logic.
-    """
+TOOLS = [
+    _tool("list_devices", "List simulators, optionally filtered by campus or partial device code.", {
+        "campus_id": {"type": "integer"},
+        "campus_name": {"type": "string"},
+        "device_code": {"type": "string"}
+    }),
+    _tool("check_availability", "Free slots for one device on one date. Provide device_id or device_code.", {
+        "device_id": {"type": "integer"},
+        "device_code": {"type": "string", "description": "e.g. B737-8-MIA-#1"},
+        "date": {"type": "string", "description": "YYYY-MM-DD"},
+        "duration_hours": DURATION_PARAM
+    }, ["date"]),
+    _tool("check_availability_range", "Free slots for several devices or a whole campus over a date range.", {
+        "device_ids": {"type": "array", "items": {"type": "integer"}},
+        "device_code": {"type": "string"},
+        "campus_id": {"type": "integer"},
+        "campus_name": {"type": "string"},
+        "start_date": {"type": "string", "description": "YYYY-MM-DD"},
+        "end_date": {"type": "string", "description": "YYYY-MM-DD, defaults to start_date"},
+        "duration_hours": DURATION_PARAM
+    }, ["start_date"]),
+    _tool("find_earliest_slots", "The earliest free slots across the fleet, optionally by aircraft type, campus and time of day.", {
+        "aircraft_type": {"type": "string", "description": "e.g. 787, B737-8, Boeing 777"},
+        "campus_id": {"type": "integer"},
+        "campus_name": {"type": "string"},
+        "device_code": {"type": "string"},
+        "start_date": {"type": "string", "description": "YYYY-MM-DD, search from this day (default today)"},
+        "end_date": {"type": "string", "description": "YYYY-MM-DD, search up to this day"},
+        "earliest_time": {"type": "string", "description": "HH:MM, slots start at or after this time of day"},
+        "latest_time": {"type": "string", "description": "HH:MM, slots end by this time of day"},
+        "duration_hours": DURATION_PARAM,
+        "limit": {"type": "integer", "description": "How many slots, default 5"}
+    }),
+    _tool("add_to_cart", "Add a session to the cart.", {
+        "device_id": {"type": "integer"},
+        "device_code": {"type": "string"},
+        "start_time": {"type": "string", "description": "HH:MM or ISO datetime"},
+        "date": {"type": "string", "description": "YYYY-MM-DD"},
+        "duration_hours": DURATION_PARAM
+    }, ["start_time"]),
+    _tool("view_cart", "Show the cart."),
+    _tool("confirm_booking", "Book everything in the cart.")
+]
+
+# Tools that only read, and so can run concurrently within one step
+READ_ONLY_TOOLS = {"list_devices", "check_availability", "check_availability_range", "find_earliest_slots", "view_cart"}
+# Known actions (span names); "reply" is the fast path / mock agent's plain answer
+TOOL_NAMES = {t['function']['name'] for t in TOOLS} | {"reply"}
+
+log = tracing.get_logger('chat_agent')
+
+def _start_turn(session):
     if 'llm_context' not in session:
         session['llm_context'] = {}
         
     if 'chat_history' not in session:
         session['chat_history'] = []
-        
-    api_key = os.getenv('OPENAI_API_KEY')
-    response_text = ""
-    
-    if api_key and api_key != 'YOUR_KEY_HERE':
-        response_text = run_llm_agent(message, session)
+    _note_changes(session)
+
+def _note_changes(session):
+    """
+    Flags the devices/days this chat is looking at (watch_list) that were
+    booked elsewhere since its last turn, so the model re-checks them instead
+    of offering slots it saw before.
+    """
+    now = time.time()
+    since = session.get('feed_ts') or now
+    session['feed_ts'] = now
+    days = {(w['device_id'], w['date']) for w in watch_list(session)}
+    changed = change_feed.changed_since(since, days) if days else []
+    context = session['llm_context']
+    if changed:
+        context['availability_changed'] = sorted({f"{e['device_id']} {d}" for e in changed for d in e['dates']
+                                                  if (e['device_id'], d) in days})
     else:
-        response_text = run_mock_agent(message, session)
-        
+        context.pop('availability_changed', None)
+
+def watch_list(session) -> List[Dict]:
+    """
+    Devices/days whose availability matters to this chat: cart items and the
+    last device/date looked at. [{"device_id", "date", "name"}]
+    """
+    context = session.get('llm_context', {})
+    candidates = [(item.get('DeviceId'), item.get('Date'), item.get('DeviceName')) for item in session.get('cart', [])]
+    candidates.append((context.get('last_device_id'), context.get('last_date'), context.get('last_device_code')))
+    watched = {}
+    for device_id, date, name in candidates:
+        try:
+            key = (int(device_id), str(date)[:10])
+        except (TypeError, ValueError):
+            continue
+        if date:
+            watched.setdefault(key, name or f"Device {key[0]}")
+    return [{"device_id": device_id, "date": date, "name": name} for (device_id, date), name in watched.items()]
+
+def _finish_turn(message: str, response_text: str, session):
     # Append to history
     session['chat_history'].append({"role": "user", "content": message})
     session['chat_history'].append({"role": "assistant", "content": response_text})
     
-    # Keep last 20 messages (10 rounds)
+    # Keep last 20 messages (10 rounds); older ones live on in the summary
     if len(session['chat_history']) > 20:
-        session['chat_history'] = session['chat_history'][-20:]
+        prompt_context.roll_into_summary(session, len(session['chat_history']) - 20)
         
     session.modified = True
+
+def process_message(message: str, session) -> str:
+    """
+    Process message using LLM via direct HTTP request if configured, otherwise fallback to mock logic.
+    Simple requests recognised by intent_parser skip the LLM entirely.
+    """
+    _start_turn(session)
     
+    intent = intent_parser.match(message, session)
+    if intent:
+        response_text = execute_tool(intent, session)
+    elif llm_client.is_configured():
+        response_text = run_llm_agent(message, session)
+    else:
+        response_text = run_mock_agent(message, session)
+        
+    _finish_turn(message, response_text, session)
     return response_text
 
-def run_llm_agent(message: str, session) -> str:
-    today = datetime.now().strftime("%Y-%m-%d")
-    cart_summary = json.dumps(session.get('cart', []))
-    context = session.get('llm_context', {})
+async def process_message_async(message: str, session) -> str:
+    """
+    Async process_message: the LLM call awaits on the event loop, and booking
+    lookups run concurrently in worker threads.
+    """
+    _start_turn(session)
     
-    # Format History
-    history_list = session.get('chat_history', [])
-    history_str = ""
-    for msg in history_list:
-        role = "User" if msg['role'] == "user" else "Assistant"
-        # Truncate long content in history to save tokens
-        content = msg['content']
-        if len(content) > 500: content = content[:500] + "..."
-        history_str += f"{role}: {content}\n"
+    intent = intent_parser.match(message, session)
+    if intent:
+        response_text = await execute_tool_async(intent, session)
+    elif llm_client.is_configured():
+        response_text = await run_llm_agent_async(message, session)
+    else:
+        response_text = await asyncio.to_thread(run_mock_agent, message, session)
+        
+    _finish_turn(message, response_text, session)
+    return response_text
+
+def process_message_stream(message: str, session) -> Iterator[Dict]:
+    """
+    Streaming process_message. Yields events as they happen:
+    - {"type": "token", "text": ...}: reply text as the model writes it
+    - {"type": "status", "text": ...}: tool progress
+    - {"type": "done", "response": ..., "watch": [...]}: the final response text
+      and the chat's watch_list, for the client's change feed subscription
+    """
+    _start_turn(session)
     
-    prompt = SYSTEM_PROMPT.format(
+    intent = intent_parser.match(message, session)
+    if intent:
+        status = _tool_status(intent)
+        if status:
+            yield {"type": "status", "text": status}
+        response_text = execute_tool(intent, session)
+    elif llm_client.is_configured():
+        response_text = yield from _run_llm_agent_stream(message, session)
+    else:
+        response_text = run_mock_agent(message, session)
+        
+    _finish_turn(message, response_text, session)
+    yield {"type": "done", "response": response_text, "watch": watch_list(session)}
+
+async def process_message_astream(message: str, session) -> AsyncIterator[Dict]:
+    """
+    Async process_message_stream, with the same events: the LLM stream and
+    tool lookups are awaited on the event loop.
+    """
+    _start_turn(session)
+    
+    intent = intent_parser.match(message, session)
+    if intent:
+        status = _tool_status(intent)
+        if status:
+            yield {"type": "status", "text": status}
+        response_text = await execute_tool_async(intent, session)
+    elif llm_client.is_configured():
+        async for event in _run_llm_agent_astream(message, session):
+            if event['type'] == 'done':
+                response_text = event['response']
+            else:
+                yield event
+    else:
+        response_text = await asyncio.to_thread(run_mock_agent, message, session)
+        
+    _finish_turn(message, response_text, session)
+    yield {"type": "done", "response": response_text, "watch": watch_list(session)}
+
+def _build_messages(message: str, session) -> List[Dict]:
+    """
+    Stable prefix first (system preamble, then tools in the payload) so providers
+    can cache it; summary and recent history are fitted into the token budget.
+    """
+    today = datetime.now().strftime("%Y-%m-%d")
+    context_prompt = CONTEXT_PROMPT.format(
         today=today,
-        cart=cart_summary,
-        context=json.dumps(context),
-        chat_history=history_str,
-        user_input=message
+        cart=json.dumps(session.get('cart', [])),
+        context=json.dumps(session.get('llm_context', {}))
     )
+    head = [{"role": "system", "content": SYSTEM_PROMPT}]
+    tail = [{"role": "system", "content": context_prompt}, {"role": "user", "content": message}]
     
-    # Load Env Vars
-    base_url = (os.getenv('OPENAI_API_BASE') or '').strip().strip('"').strip("'")
-    api_key = (os.getenv('OPENAI_API_KEY') or '').strip().strip('"').strip("'")
-    deployment = os.getenv('AZURE_DEPLOYMENT_NAME', 'gpt-4o')
-    api_version = os.getenv('OPENAI_API_VERSION', '2024-02-15-preview')
+    fixed_tokens = prompt_context.count_message_tokens(head + tail) + prompt_context.count_tools_tokens(TOOLS)
+    summary, history = prompt_context.fit_history(session, prompt_context.PROMPT_TOKEN_BUDGET - fixed_tokens)
     
-    # Construct URL for Azure
-    # https://{resource}.openai.azure.com/openai/deployments/{deployment}/chat/completions?api-version={version}
-    # Handle if user put full path or just base
-    if '/chat/completions' not in base_url:
-        url = f"{base_url}/openai/deployments/{deployment}/chat/completions?api-version={api_version}"
-    else:
-        url = base_url # Assume full URL provided if it looks like one
+    if summary:
+        head.append({"role": "system", "content": f"Summary of earlier conversation:\n{summary}"})
+    return head + history + tail
 
-    headers = {
-        "api-key": api_key,
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "messages": [
-            {"role": "system", "content": "You are a helpful assistant. Output JSON only."},
-            {"role": "user", "content": prompt}
-        ],
+def _build_llm_payload(messages: List[Dict]) -> Dict:
+    return {
+        "messages": messages,
+        "tools": TOOLS,
+        "tool_choice": "auto",
         "temperature": 0.0
     }
+
+def _agent_loop(message: str, session):
+    """
+    One user turn as a tool-calling loop, independent of how I/O is done.
+    Yields ("llm", payload) and expects the assistant message back, or
+    ("tools", tool_calls) and expects one result string per call.
+    Returns the final response text.
+    """
+    messages = _build_messages(message, session)
+    results = []
     
-    try:
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
-        response.raise_for_status()
-        
-        data = response.json()
-        content = data['choices'][0]['message']['content']
-        
-        # Naive JSON cleaning
-        if "```json" in content:
-            content = content.replace("```json", "").replace("```", "")
-        content = content.strip()
-        
-        tool_data = json.loads(content)
-        return execute_tool(tool_data, session)
+    for _ in range(MAX_TOOL_STEPS):
+        payload = _build_llm_payload(messages)
+        prompt_context.record_prompt(payload, session)
+        assistant = yield ("llm", payload)
+        tool_calls = assistant.get('tool_calls') or []
+        if not tool_calls:
+            return assistant.get('content') or "\n".join(results) or "I'm not sure."
         
+        messages.append({"role": "assistant", "content": assistant.get('content'), "tool_calls": tool_calls})
+        results = yield ("tools", tool_calls)
+        for call, result in zip(tool_calls, results):
+            messages.append({"role": "tool", "tool_call_id": call['id'], "content": result})
+    
+    # Step budget used up: show what the tools found
+    return "\n".join(results)
+
+def _tool_call_data(call: Dict) -> Dict:
+    """
+    Converts a provider tool call into execute_tool's {"action", "params"} form.
+    """
+    function = call.get('function', {})
+    arguments = function.get('arguments') or '{}'
+    return {"action": function.get('name'), "params": json.loads(arguments) if isinstance(arguments, str) else arguments}
+
+def _run_tool_call(call: Dict, session) -> str:
+    try:
+        return execute_tool(_tool_call_data(call), session)
     except Exception as e:
-        debug_info = f"Error: {str(e)[:200]} | URL={url}"
-        print(f"LLM Request Failed: {debug_info}")
-        return run_mock_agent(message, session, error=debug_info)
+        # Report to the model instead of failing the whole turn
+        return f"Tool error: {str(e)[:200]}"
+
+def _execute_tool_calls(tool_calls: List[Dict], session) -> List[str]:
+    # Unwrap Flask's session proxy: worker threads have no request context
+    session = getattr(session, '_get_current_object', lambda: session)()
+    if len(tool_calls) > 1 and all(_tool_call_data(c)['action'] in READ_ONLY_TOOLS for c in tool_calls):
+        with ThreadPoolExecutor(max_workers=len(tool_calls)) as pool:
+            # Copy the context so tool spans and logs keep the request id
+            futures = [pool.submit(contextvars.copy_context().run, _run_tool_call, c, session) for c in tool_calls]
+            return [f.result() for f in futures]
+    return [_run_tool_call(c, session) for c in tool_calls]
+
+async def _aexecute_tool_calls(tool_calls: List[Dict], session) -> List[str]:
+    async def run(call):
+        try:
+            return await execute_tool_async(_tool_call_data(call), session)
+        except Exception as e:
+            return f"Tool error: {str(e)[:200]}"
+    
+    if all(_tool_call_data(c)['action'] in READ_ONLY_TOOLS for c in tool_calls):
+        return list(await asyncio.gather(*(run(c) for c in tool_calls)))
+    return [await run(c) for c in tool_calls]
+
+def _llm_failure(message: str, session, e: Exception) -> str:
+    debug_info = f"Error: {str(e)[:200]} | URL={llm_client.get_endpoint()[0]}"
+    log.warning("LLM request failed", extra={"fields": {"error": str(e)[:200], "url": llm_client.get_endpoint()[0]}})
+    return run_mock_agent(message, session, error=debug_info)
+
+def run_llm_agent(message: str, session) -> str:
+    loop = _agent_loop(message, session)
+    
+    try:
+        kind, arg = next(loop)
+        while True:
+            if kind == "llm":
+                reply = llm_client.complete(arg)['choices'][0]['message']
+            else:
+                reply = _execute_tool_calls(arg, session)
+            kind, arg = loop.send(reply)
+    except StopIteration as done:
+        return done.value
+    except Exception as e:
+        return _llm_failure(message, session, e)
+
+async def run_llm_agent_async(message: str, session) -> str:
+    loop = _agent_loop(message, session)
+    
+    try:
+        kind, arg = next(loop)
+        while True:
+            if kind == "llm":
+                reply = (await llm_client.acomplete(arg))['choices'][0]['message']
+            else:
+                reply = await _aexecute_tool_calls(arg, session)
+            kind, arg = loop.send(reply)
+    except StopIteration as done:
+        return done.value
+    except Exception as e:
+        return await asyncio.to_thread(_llm_failure, message, session, e)
+
+def _stream_assistant(payload: Dict):
+    """
+    Streams one completion. Yields token events for reply text and returns the
+    assembled assistant message, including tool calls sent as deltas.
+    """
+    assembler = llm_client.StreamAssembler()
+    for chunk in llm_client.stream(payload):
+        text = assembler.add(chunk)
+        if text:
+            yield {"type": "token", "text": text}
+    return assembler.message()
+
+def _run_llm_agent_stream(message: str, session):
+    loop = _agent_loop(message, session)
+    
+    try:
+        kind, arg = next(loop)
+        while True:
+            if kind == "llm":
+                reply = yield from _stream_assistant(arg)
+            else:
+                for call in arg:
+                    status = _tool_status(_tool_call_data(call))
+                    if status:
+                        yield {"type": "status", "text": status}
+                reply = _execute_tool_calls(arg, session)
+            kind, arg = loop.send(reply)
+    except StopIteration as done:
+        return done.value
+    except Exception as e:
+        return _llm_failure(message, session, e)
+
+async def _run_llm_agent_astream(message: str, session) -> AsyncIterator[Dict]:
+    # Async generators can't return a value: the reply comes last as a "done" event
+    loop = _agent_loop(message, session)
+    
+    try:
+        kind, arg = next(loop)
+        while True:
+            if kind == "llm":
+                assembler = llm_client.StreamAssembler()
+                async for chunk in llm_client.astream(arg):
+                    text = assembler.add(chunk)
+                    if text:
+                        yield {"type": "token", "text": text}
+                reply = assembler.message()
+            else:
+                for call in arg:
+                    status = _tool_status(_tool_call_data(call))
+                    if status:
+                        yield {"type": "status", "text": status}
+                reply = await _aexecute_tool_calls(arg, session)
+            kind, arg = loop.send(reply)
+    except StopIteration as done:
+        response_text = done.value
+    except Exception as e:
+        response_text = await asyncio.to_thread(_llm_failure, message, session, e)
+    yield {"type": "done", "response": response_text}
+
+def _tool_status(data: dict) -> Optional[str]:
+    """
+    Progress line shown to the user while a tool runs.
+    """
+    action = data.get('action')
+    params = data.get('params', {})
+    device = params.get('device_code') or (f"device {params['device_id']}" if params.get('device_id') else "the device")
+    
+    if action == 'list_devices':
+        return "Looking up simulators..."
+    if action == 'check_availability':
+        return f"Checking availability for {device} on {params.get('date', 'that date')}..."
+    if action == 'check_availability_range':
+        start_date = params.get('start_date') or params.get('date')
+        return f"Checking availability from {start_date} to {params.get('end_date') or start_date}..."
+    if action == 'find_earliest_slots':
+        return "Searching for the earliest free slots..."
+    if action == 'add_to_cart':
+        return "Adding the session to your cart..."
+    if action == 'confirm_booking':
+        return "Confirming your booking..."
+    return None
+
+async def _prefetch(data: dict, session):
+    """
+    Warms the booking_service cache with the independent lookups an action will make,
+    running them concurrently, so execute_tool then reads from the cache.
+    """
+    action = data.get('action')
+    params = data.get('params', {})
+    context = session.get('llm_context', {})
+    lookups = []
+    
+    if action == 'check_availability':
+        d_id = params.get('device_id')
+        d_code = params.get('device_code')
+        date = params.get('date')
+        if d_id:
+            lookups.append(asyncio.to_thread(booking_service.get_device, d_id))
+            if date:
+                lookups.append(asyncio.to_thread(booking_service.get_availability, d_id, date, _duration_minutes(params)))
+        elif d_code:
+            lookups.append(asyncio.to_thread(booking_service.get_devices, None, d_code))
+    
+    elif action == 'check_availability_range':
+        start_date = params.get('start_date') or params.get('date')
+        d_ids = params.get('device_ids')
+        c_id = await asyncio.to_thread(_resolve_campus_id, params)
+        if start_date and (d_ids or c_id):
+            lookups.append(asyncio.to_thread(
+                booking_service.get_availability_batch, start_date, params.get('end_date') or start_date, d_ids, c_id,
+                _duration_minutes(params)))
+            lookups.append(asyncio.to_thread(booking_service.get_devices, c_id if not d_ids else None))
+    
+    elif action == 'add_to_cart':
+        d_id = params.get('device_id')
+        if not d_id and params.get('device_code'):
+            d_id = await asyncio.to_thread(_resolve_device_id, params['device_code'])
+        d_id = d_id or context.get('last_device_id')
+        if d_id:
+            lookups.append(asyncio.to_thread(booking_service.get_device, d_id))
+            lookups.append(asyncio.to_thread(booking_service.get_calendar, d_id))
+    
+    if lookups:
+        # Failures surface (or are handled) when execute_tool repeats the call
+        await asyncio.gather(*lookups, return_exceptions=True)
+
+async def execute_tool_async(data: dict, session) -> str:
+    await _prefetch(data, session)
+    return await asyncio.to_thread(execute_tool, data, session)
 
 def execute_tool(data: dict, session) -> str:
+    action = data.get('action')
+    with tracing.span(f"tool.{action if action in TOOL_NAMES else 'unknown'}"):
+        return _execute_tool(data, session)
+
+def _execute_tool(data: dict, session) -> str:
     action = data.get('action')
     params = data.get('params', {})
     
     if action == 'list_devices':
-        c_name = params.get('campus_name', '').lower()
-        c_id = params.get('campus_id')
-        if not c_id and c_name:
-            if 'miami' in c_name: c_id = 1
-            elif 'gatwick' in c_name: c_id = 2
-            elif 'singapore' in c_name: c_id = 3
+        c_id = _resolve_campus_id(params)
         
         devices = booking_service.get_devices(campus_id=c_id, device_code=params.get('device_code'))
         resp = "Found devices:\n"
@@ -172,31 +530,26 @@ def execute_tool(data: dict, session) -> str:
             
         # Resolve ID if only code provided
         if not d_id and d_code:
-            devs = booking_service.get_devices(device_code=d_code)
-            if not devs:
+            d_id = _resolve_device_id(d_code)
+            if not d_id:
                 return f"I couldn't find a device with code '{d_code}'."
-            # Pick the first one (assume exact or best match)
-            d_id = devs[0]['DeviceId']
-            # Optional: Notify user if multiple found? For now assume specific.
         
         if not date:
             return "I need a Date to check availability."
+        
+        duration = _duration_minutes(params)
+        if duration:
+            _, problem = _check_duration(d_id, duration)
+            if problem:
+                return problem
             
-        slots = booking_service.get_availability(d_id, date)
+        slots = booking_service.get_availability(d_id, date, duration)
         if not slots:
             # Resolve name for better error message
             dev_name = f"Device {d_id}"
-            devs = booking_service.get_devices(campus_id=None) # Get all to find match, or optimized lookup
-            # Since get_devices filters, let's just get by ID if we could, but our service currently filters by campus/code.
-            # Let's simple iterate or filter.
-            # Actually booking_service.get_devices implementation:
-            # def get_devices(campus_id=None, device_code=None)
-            # It doesn't support by ID directly in signature shown before? 
-            # Wait, I can just filter the full list or add id support to service.
-            # Let's rely on what we have:
-            found = [d for d in booking_service.get_devices() if d['DeviceId'] == int(d_id)]
-            if found:
-                dev_name = f"{found[0]['DeviceName']} ({found[0]['DeviceCode']})"
+            device = booking_service.get_device(d_id)
+            if device:
+                dev_name = f"{device['DeviceName']} ({device['DeviceCode']})"
             
             return f"No availability on {date} for {dev_name}."
         
@@ -204,28 +557,88 @@ def execute_tool(data: dict, session) -> str:
         session['llm_context']['last_device_id'] = d_id
         session['llm_context']['last_device_code'] = d_code
         session['llm_context']['last_date'] = date
+        session['llm_context']['last_duration'] = duration
         session.modified = True
         
-        resp = f"Available slots on {date}:\n"
+        resp = f"Available {_format_hours(duration)} slots on {date}:\n" if duration else f"Available slots on {date}:\n"
         for s in slots:
             resp += f"- {s['label']}\n"
         return resp
 
+    elif action == 'check_availability_range':
+        start_date = params.get('start_date') or params.get('date')
+        end_date = params.get('end_date') or start_date
+        d_ids = params.get('device_ids') or ([params['device_id']] if params.get('device_id') else [])
+        c_id = _resolve_campus_id(params)
+        
+        if not start_date:
+            return "I need a start date to check availability."
+        
+        if not d_ids and params.get('device_code'):
+            d_ids = [d['DeviceId'] for d in booking_service.get_devices(device_code=params['device_code'])]
+            if not d_ids:
+                return f"I couldn't find a device with code '{params['device_code']}'."
+        
+        if not d_ids and not c_id:
+            return "I need a campus or device(s) to check availability."
+        
+        results = booking_service.get_availability_batch(start_date, end_date, device_ids=d_ids, campus_id=c_id,
+                                                         duration=_duration_minutes(params))
+        if not results:
+            return f"No availability between {start_date} and {end_date}."
+        
+        names = {d['DeviceId']: d['DeviceCode'] for d in booking_service.get_devices(campus_id=c_id if not d_ids else None)}
+        resp = f"Availability from {start_date} to {end_date}:\n"
+        for r in results:
+            labels = [s['label'] for s in r['slots']]
+            dev_name = names.get(r['device_id'], f"Device {r['device_id']}")
+            resp += f"- {dev_name} on {r['date']}: {', '.join(labels) if labels else 'fully booked'}\n"
+        return resp
+
+    elif action == 'find_earliest_slots':
+        d_ids = None
+        if params.get('device_code'):
+            d_ids = [d['DeviceId'] for d in booking_service.get_devices(device_code=params['device_code'])]
+            if not d_ids:
+                return f"I couldn't find a device with code '{params['device_code']}'."
+        
+        duration = _duration_minutes(params)
+        slots = booking_service.find_earliest_slots(
+            aircraft_type=params.get('aircraft_type'), campus_id=_resolve_campus_id(params), device_ids=d_ids,
+            start_date=params.get('start_date'), end_date=params.get('end_date'),
+            earliest=params.get('earliest_time'), latest=params.get('latest_time'),
+            duration=duration, limit=params.get('limit') or 5)
+        if not slots:
+            return "No matching free slots in the next 3 months."
+        
+        # The first hit becomes the context for "book it"
+        first = slots[0]
+        session['llm_context']['last_device_id'] = first['device_id']
+        session['llm_context']['last_device_code'] = first['device_code']
+        session['llm_context']['last_date'] = first['date']
+        session['llm_context']['last_duration'] = duration
+        session.modified = True
+        
+        resp = "Earliest free slots:\n"
+        for s in slots:
+            resp += f"- {s['device_code']} ({s['campus_name']}) on {s['date']}: {s['label']}\n"
+        return resp
+
     elif action == 'add_to_cart':
         # Resolve Params from Context if missing
         context = session.get('llm_context', {})
-        d_id = params.get('device_id') or context.get('last_device_id')
+        d_id = params.get('device_id')
         d_code = params.get('device_code') or params.get('device_name') # sometimes LLM puts code in name
         date = params.get('date') or context.get('last_date')
         start_time = params.get('start_time')
         
-        # Resolve Device ID from Code if needed
+        # A device named in this request wins over the last one checked
         if not d_id and d_code:
-            # Try to resolve code 
-            # Note: Context might have code but we prefer ID. 
-            # If we only have code from param:
-            devs = booking_service.get_devices(device_code=d_code)
-            if devs: d_id = devs[0]['DeviceId']
+            d_id = _resolve_device_id(d_code)
+            if not d_id and params.get('device_code'):
+                return f"I couldn't find a device with code '{d_code}'."
+        if not d_id:
+            d_id = context.get('last_device_id')
             
         if not d_id:
              return "I need to know which device you want to book. Please specify or check availability first."
@@ -254,8 +667,11 @@ def execute_tool(data: dict, session) -> str:
              except:
                  return f"Could not understand time format: {start_time}"
 
-        # Auto-calc end time (4 hours)
-        end_dt = start_dt + timedelta(hours=4) # Fixed 4h duration
+        # Auto-calc end time from the requested (or last checked, or device default) length
+        duration, problem = _check_duration(d_id, _duration_minutes(params) or context.get('last_duration'))
+        if problem:
+            return problem
+        end_dt = start_dt + timedelta(minutes=duration)
         
         # Helper to get name
         dev_name_for_cart = params.get('device_name')
@@ -263,9 +679,9 @@ def execute_tool(data: dict, session) -> str:
             # Try context
             dev_name_for_cart = context.get('last_device_code')
             # If still not good or we want full name, lookup
-            found = [d for d in booking_service.get_devices() if d['DeviceId'] == int(d_id)]
-            if found:
-                dev_name_for_cart = f"{found[0]['DeviceName']} ({found[0]['DeviceCode']})"
+            device = booking_service.get_device(d_id)
+            if device:
+                dev_name_for_cart = f"{device['DeviceName']} ({device['DeviceCode']})"
             else:
                 dev_name_for_cart = f"Device {d_id}"
 
@@ -277,8 +693,31 @@ def execute_tool(data: dict, session) -> str:
             "Label": f"{start_dt.strftime('%H:%M')} - {end_dt.strftime('%H:%M')}",
             "Date": date
         }
-        session['cart'].append(cart_item)
-        return f"Added slot {cart_item['Label']} for {dev_name_for_cart} to cart!"
+        
+        # Check the whole cart against live bookings, other chats' holds and itself,
+        # and hold it so a racing chat can't take the slots before confirmation
+        token = _hold_token(session)
+        cart = session.get('cart', []) + [cart_item]
+        held = booking_service.hold_cart(cart, token)
+        removed = []
+        if held.get('status') != 'held':
+            problems = _item_problems(held, len(cart) - 1)
+            if problems or not held.get('items'):
+                return f"Can't add {cart_item['Label']} on {date} for {dev_name_for_cart}: {problems or held.get('message', 'unknown error')}"
+            # The new slot is free but earlier cart items aren't any more: drop those
+            removed = [cart[i['index']] for i in held['items'] if not i['ok']]
+            cart = [c for c in cart if c not in removed]
+            held = booking_service.hold_cart(cart, token)
+            if held.get('status') != 'held':
+                return f"Can't add {cart_item['Label']} on {date} for {dev_name_for_cart}: {held.get('message', 'unknown error')}"
+        
+        session['cart'] = cart
+        # A changed cart is a new booking request
+        session.pop('booking_key', None)
+        resp = f"Added slot {cart_item['Label']} for {dev_name_for_cart} to cart! Held for you until {held['expires_at'][11:16]}."
+        if removed:
+            resp += "\nNo longer available, removed from cart: " + ", ".join(f"{c['DeviceName']} at {c['Label']}" for c in removed)
+        return resp
 
     elif action == 'view_cart':
         cart = session.get('cart', [])
@@ -288,7 +727,23 @@ def execute_tool(data: dict, session) -> str:
     elif action == 'confirm_booking':
         cart = session.get('cart', [])
         if not cart: return "Cart is empty."
-        res = booking_service.book_sessions(cart)
+        # Same key until the API answers, so confirming again after a timeout can't book twice
+        key = session.get('booking_key') or uuid.uuid4().hex
+        session['booking_key'] = key
+        res = booking_service.book_sessions(cart, _hold_token(session), key)
+        if 'items' in res:
+            session.pop('booking_key', None)
+        if res.get('status') != 'success':
+            resp = f"Booking failed: {res.get('message', 'unknown error')}"
+            for item in res.get('items', []):
+                if not item['ok'] and item['index'] < len(cart):
+                    c = cart[item['index']]
+                    resp += f"\n- {c['DeviceName']} at {c['Label']} on {c['Date']}: {_item_problems(res, item['index'])}"
+            if not res.get('items'):
+                for c in res.get('conflicts', []):
+                    b = c['booking']
+                    resp += f"\n- Device {b['device_id']} {b['start_time']} - {b['end_time']} is taken"
+            return resp
         session['cart'] = []
         return f"Booked! Conf: {res['confirmation_number']}"
 
@@ -298,6 +753,75 @@ def execute_tool(data: dict, session) -> str:
     else:
         return "I didn't understand that action."
 
+def _resolve_device_id(device_code: str):
+    """
+    Resolves a device code to an id, preferring an exact code match over partial ones.
+    """
+    device = booking_service.get_device_by_code(device_code)
+    if device:
+        return device['DeviceId']
+    devs = booking_service.get_devices(device_code=device_code)
+    return devs[0]['DeviceId'] if devs else None
+
+def _resolve_campus_id(params: dict):
+    """
+    Returns campus_id from params, falling back to a known campus_name.
+    """
+    c_name = params.get('campus_name')
+    c_id = params.get('campus_id')
+    if not c_id and c_name:
+        c_id = booking_service.get_campus_id(c_name)
+    return c_id
+
+def _duration_minutes(params: dict) -> Optional[int]:
+    """
+    duration_hours from tool params, in minutes; None if not given.
+    """
+    hours = params.get('duration_hours')
+    if hours in (None, ''):
+        return None
+    try:
+        return int(round(float(hours) * 60))
+    except (TypeError, ValueError):
+        return None
+
+def _hold_token(session) -> str:
+    """
+    Identifies this chat's slot holds to the booking API. Separate from the
+    session id, which is a credential.
+    """
+    token = session.get('hold_token')
+    if not token:
+        token = session['hold_token'] = uuid.uuid4().hex
+    return token
+
+def _item_problems(result: Dict, index: int) -> str:
+    """
+    Problems reported for one cart item by validate/hold/book, as one line.
+    """
+    for item in result.get('items', []):
+        if item['index'] == index:
+            return "; ".join(dict.fromkeys(p['message'] for p in item['problems']))
+    return ""
+
+def _format_hours(minutes: int) -> str:
+    return f"{minutes / 60:g}-hour"
+
+def _check_duration(d_id, duration: Optional[int]) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Resolves a session length against the device's calendar.
+    Returns (minutes, None), or (None, message for the user) if the device doesn't offer it.
+    """
+    calendar = booking_service.get_calendar(d_id)
+    if not calendar:
+        return duration or DEFAULT_DURATION_MINUTES, None
+    if duration is None:
+        return calendar['default_duration'], None
+    if duration not in calendar['durations']:
+        options = ", ".join(f"{d / 60:g}" for d in calendar['durations'])
+        return None, f"{_format_hours(duration)} sessions aren't offered on that device. Available lengths (hours): {options}."
+    return duration, None
+
 def run_mock_agent(message: str, session, error: str = None) -> str:
     """
     Fallback regex agent.
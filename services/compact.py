@@ -0,0 +1,155 @@
+import gzip
+import json
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from services import slot_engine
+
+try:
+    import orjson
+except ImportError:
+    # Optional dependency
+    orjson = None
+
+# Compact wire format for availability and booked sessions.
+# Opt-in per request with "Accept: application/vnd.bookingbot.compact+json";
+# without it the API answers with the usual lists of dicts.
+# Times are epoch minutes: whole minutes since 1970-01-01T00:00 on the same
+# naive clock as the ISO strings they replace, so decoding gives back exactly
+# the strings the verbose format would have had.
+#
+# Availability (GET /api/availability, POST /api/availability/batch):
+# {"format": "availability", "first_date": "2026-10-20", "days": 7,
+#  "device_ids": [101, 102], "durations": [240, 120],
+#  "starts": [[29358420, 29358480, ...], [...]]}
+# one row per device, its slot starts across all days; each slot is
+# `duration` minutes long and belongs to the day it starts on. Labels and
+# ISO strings are rebuilt on the client (decode_availability).
+#
+# Booked sessions (POST /api/booked_sessions):
+# {"format": "sessions", "unit": 60, "columns": {"booking_id": [...],
+#  "device_id": [...], "start_time": [...], "end_time": [...], ...}}
+# unit is 60 when all times are whole minutes (epoch minutes), 1 otherwise
+# (epoch seconds). Sessions the format can't represent exactly (differing
+# fields, time zones) make encode_sessions return None: the caller sends the
+# verbose format instead.
+#
+# Bodies are encoded with orjson when installed, and gzipped when the client
+# accepts it and they are large enough to benefit.
+
+MEDIA_TYPE = 'application/vnd.bookingbot.compact+json'
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 5
+
+TIME_FIELDS = ("start_time", "end_time")
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+def loads(body: bytes):
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+def gzip_body(body: bytes) -> bytes:
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+def day_minutes(day: date) -> int:
+    """
+    Epoch minutes of midnight on day.
+    """
+    return (day.toordinal() - _EPOCH_ORDINAL) * slot_engine.MINUTES_PER_DAY
+
+# --- Availability ---
+
+def encode_availability(first_day: date, day_count: int,
+                        devices: Sequence[Tuple[int, int, List[List[int]]]]) -> Dict:
+    """
+    Builds the availability payload from slot_engine output:
+    devices is [(device_id, duration, starts per day)], starts in minutes since
+    midnight of first_day.
+    """
+    base = day_minutes(first_day)
+    return {
+        "format": "availability",
+        "first_date": first_day.isoformat(),
+        "days": day_count,
+        "device_ids": [device_id for device_id, _, _ in devices],
+        "durations": [duration for _, duration, _ in devices],
+        "starts": [[base + start for day in device_days for start in day] for _, _, device_days in devices],
+    }
+
+def decode_availability(payload: Dict) -> List[Dict]:
+    """
+    The batch result: [{"device_id", "date", "slots": [{"start", "end", "label"}]}]
+    for every device and day, as get_availability_batch returns it.
+    """
+    first_day = date.fromisoformat(payload['first_date'])
+    day_count = payload['days']
+    base = day_minutes(first_day)
+    dates = [(first_day + timedelta(days=offset)).isoformat() for offset in range(day_count)]
+    midnights = [base + offset * slot_engine.MINUTES_PER_DAY for offset in range(day_count + 1)]
+    results = []
+    for device_id, duration, starts in zip(payload['device_ids'], payload['durations'], payload['starts']):
+        # Epoch minutes are minutes since midnight of the epoch date; starts are sorted
+        slots = slot_engine.format_slots(starts, _EPOCH.date(), duration)
+        cuts = [bisect_left(starts, midnight) for midnight in midnights]
+        for offset in range(day_count):
+            results.append({
+                "device_id": device_id,
+                "date": dates[offset],
+                "slots": slots[cuts[offset]:cuts[offset + 1]]
+            })
+    return results
+
+def decode_slots(payload: Dict) -> List[Dict]:
+    """
+    The slots of a single device/day payload (GET /api/availability).
+    """
+    results = decode_availability(payload)
+    return results[0]['slots'] if results else []
+
+# --- Booked sessions ---
+
+def _epoch_seconds(text: str) -> Optional[int]:
+    moment = datetime.fromisoformat(text)
+    if moment.tzinfo is not None or moment.microsecond or moment.isoformat(timespec='seconds') != text:
+        return None
+    return (moment - _EPOCH) // timedelta(seconds=1)
+
+def encode_sessions(sessions: List[Dict]) -> Optional[Dict]:
+    """
+    Columnar booked sessions, or None if they can't round-trip exactly.
+    """
+    fields = list(sessions[0]) if sessions else list(TIME_FIELDS)
+    if any(list(s) != fields for s in sessions):
+        return None
+    columns = {field: [s[field] for s in sessions] for field in fields}
+    for field in TIME_FIELDS:
+        if field not in columns:
+            continue
+        seconds = [_epoch_seconds(text) if isinstance(text, str) else None for text in columns[field]]
+        if None in seconds:
+            return None
+        columns[field] = seconds
+    unit = 60 if all(v % 60 == 0 for field in TIME_FIELDS if field in columns for v in columns[field]) else 1
+    if unit != 1:
+        for field in TIME_FIELDS:
+            if field in columns:
+                columns[field] = [v // unit for v in columns[field]]
+    return {"format": "sessions", "unit": unit, "columns": columns}
+
+def decode_sessions(payload: Dict) -> List[Dict]:
+    columns = dict(payload['columns'])
+    unit = payload['unit']
+    for field in TIME_FIELDS:
+        if field in columns:
+            columns[field] = [(_EPOCH + timedelta(seconds=v * unit)).isoformat(timespec='seconds')
+                              for v in columns[field]]
+    fields = list(columns)
+    return [dict(zip(fields, row)) for row in zip(*columns.values())]
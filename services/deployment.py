@@ -0,0 +1,76 @@
+import multiprocessing
+import os
+import sys
+from typing import List, Optional
+
+# Multi-worker deployments.
+# Each worker process has its own copy of module state, so more than one
+# worker is only safe when bookings and chat sessions live in the shared
+# SQLite stores (BOOKING_STORE=sqlite, SESSION_BACKEND=sqlite). Workers on a
+# host then see each other's bookings through the store, and its change log
+# (change_feed) keeps every worker's caches and availability view current.
+# What stays per worker is only cached or counted: LLM_CACHE=memory, and the
+# numbers on /metrics and /api/stats (those of the worker that answered).
+#
+# serve.py checks its worker count before starting and passes it to the
+# workers in SERVE_WORKERS. A worker some other process manager started
+# (uvicorn --workers, gunicorn) can't see how many siblings it has: -w, a
+# config file, GUNICORN_CMD_ARGS and WEB_CONCURRENCY all set it. So the
+# app fails closed there and refuses per-process state, whatever the count.
+
+# Settings whose "memory" value keeps state inside one process
+SHARED_STATE_SETTINGS = ('BOOKING_STORE', 'SESSION_BACKEND')
+
+# Set by serve.py for its workers: the worker count it checked
+SERVE_WORKERS = 'BOOKINGBOT_SERVE_WORKERS'
+
+def configured_workers() -> Optional[int]:
+    value = os.getenv('WEB_CONCURRENCY')
+    return int(value) if value else None
+
+def served_workers() -> Optional[int]:
+    """
+    Worker processes serving the app: the count serve.py started, 1 when this
+    process serves on its own (python app.py, flask run, uvicorn without
+    --workers), or None under a process manager that doesn't say.
+    """
+    value = os.getenv(SERVE_WORKERS)
+    if value:
+        return int(value)
+    # uvicorn spawns its workers (and its --reload child); gunicorn forks them,
+    # or imports the app in the arbiter with --preload
+    if multiprocessing.parent_process() is not None or 'gunicorn' in sys.modules:
+        return None
+    return 1
+
+def per_process_state() -> List[str]:
+    """
+    The settings that keep bookings or sessions in one process, e.g. ["BOOKING_STORE=memory"].
+    """
+    return [f"{name}=memory" for name in SHARED_STATE_SETTINGS
+            if os.getenv(name, 'memory').lower() == 'memory']
+
+def default_workers() -> int:
+    """
+    WEB_CONCURRENCY, else one worker per CPU when state is shared and one otherwise.
+    """
+    workers = configured_workers()
+    if workers is not None:
+        return workers
+    return 1 if per_process_state() else (os.cpu_count() or 1)
+
+def check_workers(workers: Optional[int]):
+    """
+    Refuses to run several workers, or an unknown number (None), on
+    per-process state: each would accept bookings and hold sessions the
+    others never see.
+    """
+    settings = per_process_state()
+    if workers is None and settings:
+        raise ValueError(f"{' and '.join(settings)} is per process, and the number of workers this "
+                         f"server runs is unknown: set BOOKING_STORE=sqlite and SESSION_BACKEND=sqlite, "
+                         f"or start it with serve.py --workers 1")
+    if workers is not None and workers > 1 and settings:
+        raise ValueError(f"{workers} workers need shared state, but {' and '.join(settings)} "
+                         f"is per process: set BOOKING_STORE=sqlite and SESSION_BACKEND=sqlite, "
+                         f"or run a single worker")
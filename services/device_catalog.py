@@ -0,0 +1,92 @@
+from typing import List, Dict, Optional, Set
+
+def aircraft_type(device: Dict) -> str:
+    """
+    Aircraft type label for a device: its name without the unit number plus the
+    type part of its code, e.g. "Boeing 787-900 B787-9".
+    """
+    name = device['DeviceName'].split(' #')[0]
+    code = '-'.join(device['DeviceCode'].split('-')[:2])
+    return f"{name} {code}"
+
+class DeviceCatalog:
+    """
+    Device list indexed once at load: by DeviceId, exact DeviceCode, CampusId and
+    aircraft type, plus a trigram index over lowercased codes for partial code search.
+    Search results keep the order of the source list.
+    """
+    def __init__(self, devices: List[Dict]):
+        self.devices = devices
+        self.by_id: Dict[int, Dict] = {}
+        self.by_code: Dict[str, Dict] = {}
+        self.campus_positions: Dict[int, List[int]] = {}
+        self.campus_names: Dict[str, int] = {}
+        self.type_positions: Dict[str, List[int]] = {}
+        self._codes_lower: List[str] = []
+        self._trigrams: Dict[str, Set[int]] = {}
+
+        for pos, d in enumerate(devices):
+            code = d['DeviceCode'].lower()
+            self.by_id[d['DeviceId']] = d
+            self.by_code[code] = d
+            self.campus_positions.setdefault(d['CampusId'], []).append(pos)
+            self.campus_names[d['CampusName'].lower()] = d['CampusId']
+            self.type_positions.setdefault(aircraft_type(d).lower(), []).append(pos)
+            self._codes_lower.append(code)
+            for i in range(len(code) - 2):
+                self._trigrams.setdefault(code[i:i + 3], set()).add(pos)
+
+    def get(self, device_id: int) -> Optional[Dict]:
+        return self.by_id.get(device_id)
+
+    def get_by_code(self, device_code: str) -> Optional[Dict]:
+        """
+        Exact, case-insensitive code lookup.
+        """
+        return self.by_code.get(device_code.lower())
+
+    def campus_id_for_name(self, name: str) -> Optional[int]:
+        """
+        Campus id whose name appears in `name` (e.g. "miami campus" -> 1).
+        """
+        name = name.lower()
+        for campus_name, campus_id in self.campus_names.items():
+            if campus_name in name:
+                return campus_id
+        return None
+
+    def _code_matches(self, query: str) -> List[int]:
+        query = query.lower()
+        if len(query) < 3:
+            return [pos for pos, code in enumerate(self._codes_lower) if query in code]
+        # Every trigram of the query must appear in the code; verify the full substring after
+        postings = sorted((self._trigrams.get(query[i:i + 3], set()) for i in range(len(query) - 2)), key=len)
+        candidates = set.intersection(*postings)
+        return sorted(pos for pos in candidates if query in self._codes_lower[pos])
+
+    def _type_matches(self, query: str) -> List[int]:
+        # Few distinct types, so matching their labels is cheap
+        query = query.lower()
+        return sorted(pos for label, positions in self.type_positions.items() if query in label for pos in positions)
+
+    def search(self, campus_id: Optional[int] = None, device_code: Optional[str] = None,
+               aircraft_type: Optional[str] = None) -> List[Dict]:
+        """
+        Devices filtered by campus_id, partial device_code and/or partial aircraft
+        type (e.g. "787", "B737-8"), case-insensitive.
+        """
+        if not campus_id and not device_code and not aircraft_type:
+            return list(self.devices)
+
+        positions = None
+        if campus_id:
+            positions = self.campus_positions.get(campus_id, [])
+        for query, match in ((device_code, self._code_matches), (aircraft_type, self._type_matches)):
+            if not query:
+                continue
+            matches = match(query)
+            if positions is not None:
+                allowed = set(positions)
+                matches = [pos for pos in matches if pos in allowed]
+            positions = matches
+        return [self.devices[pos] for pos in positions]
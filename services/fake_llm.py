@@ -0,0 +1,69 @@
+import json
+import os
+import re
+import time
+from typing import Dict
+
+# Deterministic stand-in for the LLM provider (LLM_PROVIDER=fake), for tests,
+# demos and load tests. It picks tool calls with a few keyword rules, answers
+# with the tool results once they come back, and returns provider-shaped responses.
+
+FAKE_LLM_DELAY = float(os.getenv('FAKE_LLM_DELAY', '0')) # seconds per response
+FAKE_LLM_CHUNK = 8 # characters per streamed chunk (see llm_client.message_chunks)
+
+DEVICE_CODE_RE = re.compile(r'\b[A-Z]\d{3}-\d+-[A-Z]{3}-#\d+', re.IGNORECASE)
+DATE_RE = re.compile(r'\b\d{4}-\d{2}-\d{2}\b')
+EARLIEST_RE = re.compile(r'\b(?:next|earliest|soonest|first)\b.*\b(?:free|available|slot)')
+AIRCRAFT_RE = re.compile(r'\b([AB]?\d{3})\b', re.IGNORECASE)
+
+def decide(payload: Dict) -> Dict:
+    """
+    Returns the assistant message for the conversation in payload.
+    """
+    messages = payload['messages']
+    last = messages[-1]
+
+    # Tool results are back: answer with them
+    if last['role'] == 'tool':
+        results = []
+        for msg in reversed(messages):
+            if msg['role'] != 'tool':
+                break
+            results.append(msg['content'])
+        return {"role": "assistant", "content": "\n".join(reversed(results))}
+
+    text = last['content']
+    lower = text.lower()
+    code = DEVICE_CODE_RE.search(text)
+    date = DATE_RE.search(text)
+
+    call = None
+    if 'confirm' in lower:
+        call = ("confirm_booking", {})
+    elif 'cart' in lower:
+        call = ("view_cart", {})
+    elif EARLIEST_RE.search(lower):
+        aircraft = AIRCRAFT_RE.search(text)
+        call = ("find_earliest_slots", {"aircraft_type": aircraft.group(1)} if aircraft else {})
+    elif code and ('avail' in lower or 'free' in lower) and date:
+        call = ("check_availability", {"device_code": code.group(0).upper(), "date": date.group(0)})
+    else:
+        for campus in ("miami", "gatwick", "singapore"):
+            if campus in lower:
+                call = ("list_devices", {"campus_name": campus})
+                break
+
+    if call is None:
+        return {"role": "assistant", "content": f"(fake model) You said: {text}"}
+    return {"role": "assistant", "content": None, "tool_calls": [{
+        "id": f"call_{len(messages)}",
+        "type": "function",
+        "function": {"name": call[0], "arguments": json.dumps(call[1])}
+    }]}
+
+def complete(payload: Dict) -> Dict:
+    if FAKE_LLM_DELAY:
+        time.sleep(FAKE_LLM_DELAY)
+    message = decide(payload)
+    finish_reason = "tool_calls" if message.get('tool_calls') else "stop"
+    return {"choices": [{"index": 0, "message": message, "finish_reason": finish_reason}]}
@@ -0,0 +1,166 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services import tracing
+
+# Shared, pooled HTTP client for outbound calls (booking API and LLM provider).
+# One requests.Session per process keeps TCP/TLS connections alive between calls.
+
+POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '10'))
+MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '2'))
+BACKOFF_BASE = float(os.getenv('HTTP_BACKOFF_BASE', '0.2')) # seconds
+BACKOFF_MAX = float(os.getenv('HTTP_BACKOFF_MAX', '2.0')) # seconds
+
+# Per-endpoint timeouts in seconds. Override with HTTP_TIMEOUT_<ENDPOINT>, e.g. HTTP_TIMEOUT_LLM=60
+DEFAULT_TIMEOUT = float(os.getenv('HTTP_TIMEOUT_DEFAULT', '10'))
+TIMEOUTS = {
+    "devices": 5,
+    "availability": 10,
+    "availability_batch": 30,
+    "booked_sessions": 10,
+    "book": 10,
+    "cart": 10,
+    "changes": 60, # read timeout on the change feed stream; the server sends keep-alives every 15s
+    "llm": 30,
+}
+
+# Responses worth retrying; anything else is returned to the caller as is
+RETRY_STATUSES = {429, 502, 503, 504}
+# Methods that are safe to retry without the caller saying so
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+# Async client (httpx) for the ASGI entry point; bound to the event loop that created it
+_async_client = None
+_async_client_loop = None
+
+def get_session() -> requests.Session:
+    """
+    Returns the process-wide pooled session, creating it on first use.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                # Retries are handled in request() so they can use jitter and per-call policy
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=0)
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                _session = s
+    return _session
+
+def get_timeout(endpoint: str) -> float:
+    override = os.getenv(f"HTTP_TIMEOUT_{endpoint.upper()}")
+    if override:
+        return float(override)
+    return TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+
+def _backoff(attempt: int) -> float:
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+def _with_request_id(kwargs: dict) -> dict:
+    # Forward the correlation id so the callee logs under the same request
+    request_id = tracing.current_request_id()
+    if request_id:
+        headers = dict(kwargs.get('headers') or {})
+        headers.setdefault(tracing.REQUEST_ID_HEADER, request_id)
+        kwargs['headers'] = headers
+    return kwargs
+
+def request(method: str, url: str, endpoint: str, retry: Optional[bool] = None, **kwargs) -> requests.Response:
+    """
+    Sends a request through the pooled session.
+    `endpoint` names the call for timeout lookup. `retry` defaults to True for
+    idempotent methods only; pass retry=True for read-only POSTs.
+    Connection errors, timeouts and RETRY_STATUSES are retried up to MAX_RETRIES times.
+    """
+    method = method.upper()
+    kwargs.setdefault('timeout', get_timeout(endpoint))
+    _with_request_id(kwargs)
+    if retry is None:
+        retry = method in IDEMPOTENT_METHODS
+    attempts = 1 + (MAX_RETRIES if retry else 0)
+
+    session = get_session()
+    for attempt in range(attempts):
+        last = attempt == attempts - 1
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if last:
+                raise
+        else:
+            if last or response.status_code not in RETRY_STATUSES:
+                return response
+            response.close()
+        time.sleep(_backoff(attempt))
+
+def get(url: str, endpoint: str, **kwargs) -> requests.Response:
+    return request("GET", url, endpoint, **kwargs)
+
+def post(url: str, endpoint: str, **kwargs) -> requests.Response:
+    return request("POST", url, endpoint, **kwargs)
+
+def get_async_client():
+    """
+    Returns the pooled httpx.AsyncClient for the running event loop.
+    """
+    global _async_client, _async_client_loop
+    # Imported lazily: only the async (ASGI) path needs httpx
+    import httpx
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE))
+        _async_client_loop = loop
+    return _async_client
+
+async def aclose():
+    global _async_client, _async_client_loop
+    if _async_client is not None:
+        await _async_client.aclose()
+    _async_client = None
+    _async_client_loop = None
+
+async def arequest(method: str, url: str, endpoint: str, retry: Optional[bool] = None, **kwargs):
+    """
+    Async counterpart of request(), with the same timeout and retry policy.
+    Returns an httpx.Response; with stream=True its body is read as it arrives
+    (aiter_lines) and the caller must aclose() it.
+    """
+    import httpx
+    stream = kwargs.pop('stream', False)
+    method = method.upper()
+    kwargs.setdefault('timeout', get_timeout(endpoint))
+    _with_request_id(kwargs)
+    if retry is None:
+        retry = method in IDEMPOTENT_METHODS
+    attempts = 1 + (MAX_RETRIES if retry else 0)
+
+    client = get_async_client()
+    for attempt in range(attempts):
+        last = attempt == attempts - 1
+        try:
+            response = await client.send(client.build_request(method, url, **kwargs), stream=stream)
+        except httpx.TransportError:
+            if last:
+                raise
+        else:
+            if last or response.status_code not in RETRY_STATUSES:
+                return response
+            await response.aclose()
+        await asyncio.sleep(_backoff(attempt))
+
+async def apost(url: str, endpoint: str, **kwargs):
+    return await arequest("POST", url, endpoint, **kwargs)
@@ -0,0 +1,221 @@
+import os
+import re
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional
+
+from services import booking_service, tracing
+
+# Rule-based parser for common, unambiguous requests ("show my cart",
+# "availability for B737-8-MIA-#1 on 2026-10-20", ...). A confident match is
+# dispatched straight to execute_tool; anything else goes to the LLM.
+
+INTENT_FAST_PATH = os.getenv('INTENT_FAST_PATH', '1') not in ('0', 'false', 'no')
+
+log = tracing.get_logger('intent_parser')
+
+DEVICE_CODE_RE = re.compile(r'\b[A-Z]\d{3}-\d+-[A-Z]{3}-#\d+', re.IGNORECASE)
+ISO_DATE_RE = re.compile(r'\b(\d{4}-\d{2}-\d{2})\b')
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+MONTHS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+_MONTH = r'(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*'
+DAY_MONTH_RE = re.compile(r'\b(\d{1,2})(?:st|nd|rd|th)?\s+(?:of\s+)?' + _MONTH + r'\b')
+MONTH_DAY_RE = re.compile(r'\b' + _MONTH + r'\s+(\d{1,2})(?:st|nd|rd|th)?\b')
+DURATION_RE = re.compile(r'\b(\d+(?:\.\d+)?)\s*-?\s*(hours?|hrs?|h|minutes?|mins?)\b')
+# Any mention of a session length; one DURATION_RE can't read goes to the LLM
+DURATION_WORD_RE = re.compile(r'\b(?:hours?|hrs?|minutes?|mins?)\b')
+AT_TIME_RE = re.compile(r'\bat\s+(\d{1,2})(?::(\d{2}))?\s*(am|pm)?\b|\b(\d{1,2}):(\d{2})\b|\b(\d{1,2})\s*(am|pm)\b')
+
+CART_RE = re.compile(r"^(?:(?:show|view|see|check|open)\s+)?(?:me\s+)?(?:my\s+|the\s+)?cart[?.!]*$|^what'?s in (?:my|the) cart[?.!]*$")
+CONFIRM_RE = re.compile(r"^(?:yes[,!.]?\s*)?(?:please\s+)?(?:confirm(?:\s+(?:it|the booking|my booking|booking|the cart|my cart))?|checkout|check out)(?:\s+please)?[?.!]*$")
+LIST_RE = re.compile(r'\b(?:list|show|which|what)\b.*\b(?:simulators?|sims?|devices?)\b|\b(?:simulators?|sims?|devices?)\s+(?:in|at)\b|\b\w+\s+(?:simulators?|sims?|devices?)$')
+AVAILABILITY_RE = re.compile(r'\b(?:availab\w*|free|open|slots?)\b')
+BOOK_RE = re.compile(r'\b(?:book|add|reserve)\b')
+# Requests that chain several steps are left to the LLM
+MULTI_STEP_RE = re.compile(r'\b(?:and|then|also|after that)\b')
+# Words a device listing may contain besides the campus name. Anything else
+# ("737", "full flight", "new") is a filter the fast path can't map.
+LIST_WORDS = {"list", "show", "which", "what", "whats", "what's", "are", "is", "there", "me", "the", "all", "any",
+              "do", "you", "we", "have", "got", "please", "can", "could", "i", "see", "of", "your", "our",
+              "in", "at", "simulator", "simulators", "sim", "sims", "device", "devices"}
+
+def parse_date(text: str, today: date) -> Optional[str]:
+    """
+    Finds a date in text: ISO, today/tomorrow, a weekday name, or "20 Oct" / "Oct 20".
+    Returns YYYY-MM-DD or None.
+    """
+    m = ISO_DATE_RE.search(text)
+    if m:
+        try:
+            return date.fromisoformat(m.group(1)).isoformat()
+        except ValueError:
+            return None
+    if 'day after tomorrow' in text:
+        return (today + timedelta(days=2)).isoformat()
+    if 'tomorrow' in text:
+        return (today + timedelta(days=1)).isoformat()
+    if 'today' in text or 'tonight' in text:
+        return today.isoformat()
+    for i, name in enumerate(WEEKDAYS):
+        if re.search(r'\b' + name + r'\b', text):
+            # Next occurrence, never today ("monday" on a Monday means next week)
+            days = (i - today.weekday()) % 7 or 7
+            return (today + timedelta(days=days)).isoformat()
+
+    m = DAY_MONTH_RE.search(text)
+    day, month = (int(m.group(1)), m.group(2)) if m else (None, None)
+    if not m:
+        m = MONTH_DAY_RE.search(text)
+        if m:
+            day, month = int(m.group(2)), m.group(1)
+    if m:
+        try:
+            candidate = date(today.year, MONTHS.index(month[:3]) + 1, day)
+        except ValueError:
+            return None
+        if candidate < today:
+            candidate = candidate.replace(year=today.year + 1)
+        return candidate.isoformat()
+    return None
+
+def parse_time(text: str) -> Optional[str]:
+    """
+    Finds a start time ("at 9", "09:00", "2pm", "at 14:30"). Returns HH:MM or None.
+    """
+    m = AT_TIME_RE.search(text)
+    if not m:
+        return None
+    if m.group(1) is not None:
+        hour, minute, meridiem = m.group(1), m.group(2), m.group(3)
+    elif m.group(4) is not None:
+        hour, minute, meridiem = m.group(4), m.group(5), None
+    else:
+        hour, minute, meridiem = m.group(6), None, m.group(7)
+    hour, minute = int(hour), int(minute or 0)
+    if meridiem == 'pm' and hour < 12:
+        hour += 12
+    elif meridiem == 'am' and hour == 12:
+        hour = 0
+    if hour > 23 or minute > 59:
+        return None
+    return f"{hour:02d}:{minute:02d}"
+
+def parse_duration(text: str) -> Optional[float]:
+    """
+    Finds a session length ("for 2 hours", "6 hour sessions", "90 min"). Returns hours or None.
+    """
+    m = DURATION_RE.search(text)
+    if not m:
+        return None
+    hours = float(m.group(1)) / (60 if m.group(2).startswith('m') else 1)
+    return int(hours) if hours.is_integer() else hours
+
+def _campus_name(text: str) -> Optional[str]:
+    for name in {d['CampusName'].lower() for d in booking_service.get_devices()}:
+        if re.search(r'\b' + re.escape(name) + r'\b', text):
+            return name
+    return None
+
+def parse(message: str, session) -> Optional[Dict]:
+    """
+    Returns {"action", "params"} for execute_tool when the message is a confident
+    match for a single simple request, otherwise None.
+    """
+    text = " ".join(message.lower().split())
+    if not text:
+        return None
+
+    if CART_RE.match(text):
+        return {"action": "view_cart", "params": {}}
+    if CONFIRM_RE.match(text):
+        return {"action": "confirm_booking", "params": {}}
+
+    if MULTI_STEP_RE.search(text):
+        return None
+
+    code_match = DEVICE_CODE_RE.search(message)
+    code = code_match.group(0).upper() if code_match else None
+    # Strip the code so its digits aren't read as a date or time
+    rest = DEVICE_CODE_RE.sub(" ", text)
+    duration = parse_duration(rest)
+    if duration is None and DURATION_WORD_RE.search(rest):
+        return None
+    # Likewise the length, so "for 2 hours" isn't read as a start time
+    rest = DURATION_RE.sub(" ", rest)
+    today = datetime.now().date()
+    day = parse_date(rest, today)
+    context = session.get('llm_context', {})
+
+    if BOOK_RE.search(rest):
+        start_time = parse_time(ISO_DATE_RE.sub(" ", rest))
+        has_device = code or context.get('last_device_id')
+        has_date = day or context.get('last_date')
+        if not (start_time and has_device and has_date):
+            return None
+        params = {"start_time": start_time}
+        if code: params['device_code'] = code
+        if day: params['date'] = day
+        if duration: params['duration_hours'] = duration
+        return {"action": "add_to_cart", "params": params}
+
+    if code and day and AVAILABILITY_RE.search(rest):
+        params = {"device_code": code, "date": day}
+        if duration: params['duration_hours'] = duration
+        return {"action": "check_availability", "params": params}
+
+    if not code and LIST_RE.search(rest) and not AVAILABILITY_RE.search(rest):
+        campus = _campus_name(rest)
+        words = re.findall(r"[\w'-]+", rest.replace(campus, " ") if campus else rest)
+        if any(w not in LIST_WORDS for w in words):
+            return None
+        if campus:
+            return {"action": "list_devices", "params": {"campus_name": campus}}
+        if re.search(r'\ball\b', rest) or re.fullmatch(r'(?:list|show)(?: me)?(?: the)? (?:simulators?|sims?|devices?)', rest):
+            return {"action": "list_devices", "params": {}}
+
+    return None
+
+class IntentStats:
+    """
+    Fast path hit/miss counters, reported on /api/stats.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.by_action: Dict[str, int] = {}
+
+    def record(self, data: Optional[Dict]):
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.by_action[data['action']] = self.by_action.get(data['action'], 0) + 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": INTENT_FAST_PATH,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "by_action": dict(self.by_action)
+            }
+
+STATS = IntentStats()
+
+def match(message: str, session) -> Optional[Dict]:
+    """
+    parse() with stats; None when the fast path is disabled.
+    """
+    if not INTENT_FAST_PATH:
+        return None
+    try:
+        data = parse(message, session)
+    except Exception:
+        log.exception("Intent parser error")
+        data = None
+    STATS.record(data)
+    return data
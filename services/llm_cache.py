@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from services import tracing
+from services.cache import TTLCache
+
+# Response cache for deterministic (temperature 0) LLM calls, keyed on a hash of
+# the normalised request payload plus the model/deployment. Tools still run
+# against live data: tool results are part of the next request's payload.
+#
+# Backends (LLM_CACHE env var): "memory" (default), "disk" (SQLite file at
+# LLM_CACHE_PATH, shared between processes), or "off".
+
+LLM_CACHE = os.getenv('LLM_CACHE', 'memory').lower()
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', '3600'))
+LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', '1000'))
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'llm_cache.db'))
+
+log = tracing.get_logger('llm_cache')
+
+_SPACES_RE = re.compile(r'[ \t]+')
+
+def _normalize_text(text: str) -> str:
+    text = text.replace("\r\n", "\n")
+    return "\n".join(_SPACES_RE.sub(" ", line).strip() for line in text.strip().split("\n"))
+
+def cache_key(payload: Dict, model: str) -> str:
+    """
+    sha256 over the model and the payload with whitespace-normalised message text.
+    """
+    messages = []
+    for msg in payload.get('messages', []):
+        msg = dict(msg)
+        if isinstance(msg.get('content'), str):
+            msg['content'] = _normalize_text(msg['content'])
+        messages.append(msg)
+    normalized = {k: v for k, v in payload.items() if k not in ('messages', 'stream')}
+    normalized['messages'] = messages
+    blob = json.dumps({"model": model, "payload": normalized}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+def is_cacheable(payload: Dict) -> bool:
+    return payload.get('temperature', 1.0) == 0.0
+
+class MemoryBackend:
+    def __init__(self, maxsize: int, ttl: float):
+        self.cache = TTLCache(maxsize, ttl)
+
+    def get(self, key: str) -> Optional[Dict]:
+        return self.cache.get(key)
+
+    def set(self, key: str, value: Dict):
+        self.cache.set(key, value)
+
+class DiskBackend:
+    """
+    SQLite-backed cache with TTL expiry and least-recently-used eviction.
+    """
+    def __init__(self, path: str, maxsize: int, ttl: float):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Dict]:
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < now:
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Dict):
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT OR REPLACE INTO llm_cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                         (key, json.dumps(value), now + self.ttl, now))
+            conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,))
+            conn.execute("""
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )""", (self.maxsize,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+class LLMCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: Dict):
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            # A cache write failure must not fail the chat turn
+            log.warning("LLM cache write failed", extra={"fields": {"error": str(e)}})
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "backend": LLM_CACHE,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+def create_cache() -> Optional[LLMCache]:
+    if LLM_CACHE == 'off':
+        return None
+    if LLM_CACHE == 'disk':
+        return LLMCache(DiskBackend(LLM_CACHE_PATH, LLM_CACHE_SIZE, LLM_CACHE_TTL))
+    if LLM_CACHE != 'memory':
+        raise ValueError(f"Unknown LLM_CACHE '{LLM_CACHE}' (expected 'memory', 'disk' or 'off')")
+    return LLMCache(MemoryBackend(LLM_CACHE_SIZE, LLM_CACHE_TTL))
+
+CACHE = create_cache()
+
+def stats() -> Dict:
+    return CACHE.stats() if CACHE else {"backend": "off"}
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import os
+import time
+from typing import AsyncIterator, Dict, Iterator, Optional, Tuple
+from services import fake_llm, http_client, llm_cache, metrics, prompt_context
+
+# Chat completion calls to the (Azure) OpenAI provider, sync, async and streaming (both).
+# LLM_PROVIDER=fake swaps in services.fake_llm (no network, deterministic).
+# Deterministic requests are served from llm_cache when possible.
+LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'azure').lower()
+
+def _env(name: str, default: str = '') -> str:
+    return (os.getenv(name) or default).strip().strip('"').strip("'")
+
+def is_configured() -> bool:
+    if LLM_PROVIDER == 'fake':
+        return True
+    api_key = os.getenv('OPENAI_API_KEY')
+    return bool(api_key) and api_key != 'YOUR_KEY_HERE'
+
+def get_endpoint() -> Tuple[str, Dict]:
+    """
+    Returns (url, headers) for the chat completions endpoint.
+    """
+    base_url = _env('OPENAI_API_BASE')
+    api_key = _env('OPENAI_API_KEY')
+    deployment = os.getenv('AZURE_DEPLOYMENT_NAME', 'gpt-4o')
+    api_version = os.getenv('OPENAI_API_VERSION', '2024-02-15-preview')
+    
+    # Construct URL for Azure
+    # https://{resource}.openai.azure.com/openai/deployments/{deployment}/chat/completions?api-version={version}
+    # Handle if user put full path or just base
+    if '/chat/completions' not in base_url:
+        url = f"{base_url}/openai/deployments/{deployment}/chat/completions?api-version={api_version}"
+    else:
+        url = base_url # Assume full URL provided if it looks like one
+
+    headers = {
+        "api-key": api_key,
+        "Content-Type": "application/json"
+    }
+    return url, headers
+
+def _model_id() -> str:
+    """
+    Identifies provider + model for cache keys.
+    """
+    if LLM_PROVIDER == 'fake':
+        return 'fake'
+    return f"{LLM_PROVIDER}:{get_endpoint()[0]}"
+
+def _cache_key(payload: Dict) -> Optional[str]:
+    if llm_cache.CACHE is None or not llm_cache.is_cacheable(payload):
+        return None
+    return llm_cache.cache_key(payload, _model_id())
+
+def _cached(key: Optional[str]) -> Optional[Dict]:
+    return llm_cache.CACHE.get(key) if key else None
+
+def _store(key: Optional[str], data: Dict):
+    if key:
+        llm_cache.CACHE.set(key, data)
+
+def _record_usage(payload: Dict, data: Dict):
+    """
+    Counts provider tokens, estimating them when the response carries no usage.
+    """
+    usage = data.get('usage') or {}
+    prompt = usage.get('prompt_tokens')
+    completion = usage.get('completion_tokens')
+    if prompt is None:
+        prompt = prompt_context.count_message_tokens(payload.get('messages') or [])
+    if completion is None:
+        completion = prompt_context.count_message_tokens([data['choices'][0]['message']])
+    metrics.LLM_TOKENS.inc(prompt, kind='prompt')
+    metrics.LLM_TOKENS.inc(completion, kind='completion')
+
+def _complete_uncached(payload: Dict) -> Dict:
+    if LLM_PROVIDER == 'fake':
+        return fake_llm.complete(payload)
+    url, headers = get_endpoint()
+    response = http_client.post(url, "llm", headers=headers, json=payload, retry=True)
+    response.raise_for_status()
+    return response.json()
+
+def complete(payload: Dict) -> Dict:
+    """
+    Sends a chat completion request and returns the decoded response body.
+    """
+    started = time.perf_counter()
+    key = _cache_key(payload)
+    data = _cached(key)
+    cached = data is not None
+    if not cached:
+        data = _complete_uncached(payload)
+        _record_usage(payload, data)
+        _store(key, data)
+    metrics.LLM_REQUESTS.observe(time.perf_counter() - started, mode='complete', cached=cached)
+    return data
+
+async def acomplete(payload: Dict) -> Dict:
+    """
+    Async complete(): waits on the event loop instead of holding a worker thread.
+    """
+    started = time.perf_counter()
+    key = _cache_key(payload)
+    data = await asyncio.to_thread(_cached, key) if key else None
+    if data is not None:
+        metrics.LLM_REQUESTS.observe(time.perf_counter() - started, mode='async', cached=True)
+        return data
+    
+    if LLM_PROVIDER == 'fake':
+        data = await asyncio.to_thread(fake_llm.complete, payload)
+    else:
+        url, headers = get_endpoint()
+        response = await http_client.apost(url, "llm", headers=headers, json=payload, retry=True)
+        response.raise_for_status()
+        data = response.json()
+    _record_usage(payload, data)
+    if key:
+        await asyncio.to_thread(_store, key, data)
+    metrics.LLM_REQUESTS.observe(time.perf_counter() - started, mode='async', cached=False)
+    return data
+
+class StreamAssembler:
+    """
+    Rebuilds the assistant message from streamed chunks, including tool calls
+    that arrive as partial deltas.
+    """
+    def __init__(self):
+        self.content = ""
+        self.calls: Dict[int, Dict] = {}
+
+    def add(self, chunk: Dict) -> str:
+        """
+        Folds one chunk in and returns its new reply text (may be empty).
+        """
+        choices = chunk.get('choices') or []
+        if not choices:
+            return ""
+        delta = choices[0].get('delta') or {}
+        
+        for part in delta.get('tool_calls') or []:
+            call = self.calls.setdefault(part.get('index', 0), {"id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+            if part.get('id'):
+                call['id'] = part['id']
+            function = part.get('function') or {}
+            call['function']['name'] += function.get('name') or ''
+            call['function']['arguments'] += function.get('arguments') or ''
+        
+        text = delta.get('content') or ""
+        self.content += text
+        return text
+
+    def message(self) -> Dict:
+        message = {"role": "assistant", "content": self.content or None}
+        if self.calls:
+            message['tool_calls'] = [self.calls[i] for i in sorted(self.calls)]
+        return message
+
+def message_chunks(message: Dict, chunk_size: int = 8) -> Iterator[Dict]:
+    """
+    Replays a complete assistant message as provider-shaped streaming chunks.
+    """
+    def chunk(delta, finish_reason=None):
+        return {"choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+    
+    content = message.get('content') or ''
+    for i in range(0, len(content), chunk_size):
+        yield chunk({"content": content[i:i + chunk_size]})
+    
+    for index, call in enumerate(message.get('tool_calls') or []):
+        arguments = call['function']['arguments']
+        yield chunk({"tool_calls": [{"index": index, "id": call['id'], "type": "function",
+                                     "function": {"name": call['function']['name'], "arguments": ""}}]})
+        for i in range(0, len(arguments), chunk_size):
+            yield chunk({"tool_calls": [{"index": index, "function": {"arguments": arguments[i:i + chunk_size]}}]})
+    
+    yield chunk({}, "tool_calls" if message.get('tool_calls') else "stop")
+
+def _stream_uncached(payload: Dict) -> Iterator[Dict]:
+    if LLM_PROVIDER == 'fake':
+        yield from message_chunks(fake_llm.complete(payload)['choices'][0]['message'], fake_llm.FAKE_LLM_CHUNK)
+        return
+
+    url, headers = get_endpoint()
+    response = http_client.post(url, "llm", headers=headers, json=dict(payload, stream=True), retry=True, stream=True)
+    try:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            yield json.loads(data)
+    finally:
+        response.close()
+
+def stream(payload: Dict) -> Iterator[Dict]:
+    """
+    Streams a chat completion, yielding each decoded server-sent chunk
+    ({"choices": [{"delta": {...}}]}) as it arrives. Cache hits are replayed as chunks.
+    """
+    started = time.perf_counter()
+    key = _cache_key(payload)
+    data = _cached(key)
+    if data is not None:
+        yield from message_chunks(data['choices'][0]['message'])
+        metrics.LLM_REQUESTS.observe(time.perf_counter() - started, mode='stream', cached=True)
+        return
+    
+    assembler = StreamAssembler()
+    for chunk in _stream_uncached(payload):
+        assembler.add(chunk)
+        yield chunk
+    # Store in the same shape as a non-streamed response so both paths share entries
+    data = {"choices": [{"index": 0, "message": assembler.message()}]}
+    _record_usage(payload, data)
+    _store(key, data)
+    metrics.LLM_REQUESTS.observe(time.perf_counter() - started, mode='stream', cached=False)
+
+async def _astream_uncached(payload: Dict) -> AsyncIterator[Dict]:
+    if LLM_PROVIDER == 'fake':
+        message = (await asyncio.to_thread(fake_llm.complete, payload))['choices'][0]['message']
+        for chunk in message_chunks(message, fake_llm.FAKE_LLM_CHUNK):
+            yield chunk
+        return
+
+    url, headers = get_endpoint()
+    response = await http_client.apost(url, "llm", headers=headers, json=dict(payload, stream=True), retry=True, stream=True)
+    try:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            yield json.loads(data)
+    finally:
+        await response.aclose()
+
+async def astream(payload: Dict) -> AsyncIterator[Dict]:
+    """
+    Async stream(): chunks arrive on the event loop instead of a worker thread.
+    """
+    started = time.perf_counter()
+    key = _cache_key(payload)
+    data = await asyncio.to_thread(_cached, key) if key else None
+    if data is not None:
+        for chunk in message_chunks(data['choices'][0]['message']):
+            yield chunk
+        metrics.LLM_REQUESTS.observe(time.perf_counter() - started, mode='astream', cached=True)
+        return
+    
+    assembler = StreamAssembler()
+    async for chunk in _astream_uncached(payload):
+        assembler.add(chunk)
+        yield chunk
+    data = {"choices": [{"index": 0, "message": assembler.message()}]}
+    _record_usage(payload, data)
+    if key:
+        await asyncio.to_thread(_store, key, data)
+    metrics.LLM_REQUESTS.observe(time.perf_counter() - started, mode='astream', cached=False)
@@ -0,0 +1,135 @@
+import json
+import os
+import threading
+from typing import Dict, List, Tuple
+
+# Token accounting for the agent's prompts.
+# The prompt is laid out as: static system preamble + tools (stable, cacheable
+# prefix), running summary of older turns, recent history, per-turn context,
+# user input. When history doesn't fit PROMPT_TOKEN_BUDGET, the oldest turns
+# are rolled into session['chat_summary'] instead of being dropped.
+
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '4000'))
+SUMMARY_MAX_CHARS = int(os.getenv('PROMPT_SUMMARY_MAX_CHARS', '1500'))
+SUMMARY_LINE_CHARS = 160 # per rolled-up message
+MESSAGE_OVERHEAD_TOKENS = 4 # role/formatting tokens per chat message
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    # Optional dependency; fall back to ~4 characters per token
+    _encoding = None
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+def count_message_tokens(messages: List[Dict]) -> int:
+    total = 0
+    for msg in messages:
+        total += MESSAGE_OVERHEAD_TOKENS + count_tokens(msg.get('content') or '')
+        for call in msg.get('tool_calls') or []:
+            function = call.get('function', {})
+            total += count_tokens(function.get('name', '')) + count_tokens(function.get('arguments', ''))
+    return total
+
+_tools_tokens_cache: Dict[int, int] = {}
+
+def count_tools_tokens(tools: List[Dict]) -> int:
+    key = id(tools)
+    if key not in _tools_tokens_cache:
+        _tools_tokens_cache[key] = count_tokens(json.dumps(tools))
+    return _tools_tokens_cache[key]
+
+def _summary_line(msg: Dict) -> str:
+    role = "User" if msg['role'] == "user" else "Assistant"
+    content = " ".join(msg['content'].split())
+    if len(content) > SUMMARY_LINE_CHARS:
+        content = content[:SUMMARY_LINE_CHARS] + "..."
+    return f"{role}: {content}"
+
+def roll_into_summary(session, count: int):
+    """
+    Moves the oldest `count` history messages into the running summary,
+    keeping the summary within SUMMARY_MAX_CHARS (oldest lines go first).
+    """
+    history = session.get('chat_history', [])
+    if count <= 0 or not history:
+        return
+    rolled, session['chat_history'] = history[:count], history[count:]
+
+    lines = [l for l in (session.get('chat_summary') or '').split("\n") if l]
+    lines.extend(_summary_line(m) for m in rolled)
+    while lines and len("\n".join(lines)) > SUMMARY_MAX_CHARS:
+        lines.pop(0)
+    session['chat_summary'] = "\n".join(lines)
+    session.modified = True
+
+def fit_history(session, history_budget: int, message_chars: int = 500) -> Tuple[str, List[Dict]]:
+    """
+    Returns (summary, history) fitting in history_budget tokens. History content is
+    truncated to message_chars; older turns are rolled into the summary until the
+    rest fits, and if the summary alone is too long its oldest lines are left out.
+    """
+    while True:
+        history = []
+        for msg in session.get('chat_history', []):
+            content = msg['content']
+            if len(content) > message_chars: content = content[:message_chars] + "..."
+            history.append({"role": msg['role'], "content": content})
+
+        summary = session.get('chat_summary') or ''
+        if not history or count_tokens(summary) + count_message_tokens(history) <= history_budget:
+            break
+        # Roll a whole round (user + assistant) at a time
+        roll_into_summary(session, 2)
+
+    lines = summary.split("\n") if summary else []
+    while lines and count_tokens("\n".join(lines)) + count_message_tokens(history) > history_budget:
+        lines.pop(0)
+    return "\n".join(lines), history
+
+class PromptStats:
+    """
+    Process-wide prompt size counters, reported on /api/stats.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.total_tokens = 0
+        self.max_tokens = 0
+        self.last_tokens = 0
+
+    def record(self, tokens: int):
+        with self._lock:
+            self.calls += 1
+            self.total_tokens += tokens
+            self.max_tokens = max(self.max_tokens, tokens)
+            self.last_tokens = tokens
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "budget": PROMPT_TOKEN_BUDGET,
+                "calls": self.calls,
+                "last_tokens": self.last_tokens,
+                "max_tokens": self.max_tokens,
+                "avg_tokens": round(self.total_tokens / self.calls, 1) if self.calls else 0.0,
+                "tokenizer": "tiktoken" if _encoding is not None else "estimate"
+            }
+
+STATS = PromptStats()
+
+def record_prompt(payload: Dict, session=None) -> int:
+    """
+    Counts a request payload's prompt tokens and records them.
+    """
+    tokens = count_message_tokens(payload['messages']) + count_tools_tokens(payload.get('tools') or [])
+    STATS.record(tokens)
+    if session is not None:
+        session['last_prompt_tokens'] = tokens
+    return tokens
@@ -0,0 +1,160 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Optional, Tuple
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from services import tracing
+
+# Server-side sessions for the chat (history, cart, llm_context).
+# The cookie only carries a random session id; data lives in a backend chosen
+# by SESSION_BACKEND:
+# - "memory" (default): per-process dict with expiry. Single worker only.
+# - "sqlite": file at SESSION_DB_PATH in WAL mode, shared by all workers on the host.
+# Data is stored as compact JSON (zlib-compressed when large) and only
+# written when the session was modified.
+
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory').lower()
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'sessions.db'))
+SESSION_LIFETIME = int(os.getenv('SESSION_LIFETIME', str(24 * 3600))) # seconds since last write
+COMPRESS_MIN_BYTES = 1024
+
+def dumps(data: Dict) -> bytes:
+    raw = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    if len(raw) >= COMPRESS_MIN_BYTES:
+        return b'z' + zlib.compress(raw)
+    return b'j' + raw
+
+def loads(blob: bytes) -> Dict:
+    kind, body = blob[:1], blob[1:]
+    if kind == b'z':
+        body = zlib.decompress(body)
+    return json.loads(body.decode('utf-8'))
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid: str = None, new: bool = False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+class MemorySessionBackend:
+    def __init__(self):
+        self._data: Dict[str, Tuple[float, bytes]] = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def load(self, sid: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._data[sid]
+                return None
+            return entry[1]
+
+    def store(self, sid: str, blob: bytes, lifetime: int):
+        now = time.time()
+        with self._lock:
+            self._data[sid] = (now + lifetime, blob)
+            self._writes += 1
+            # Sweep expired sessions now and then
+            if self._writes % 1000 == 0:
+                for key in [k for k, (exp, _) in self._data.items() if exp < now]:
+                    del self._data[key]
+
+    def delete(self, sid: str):
+        with self._lock:
+            self._data.pop(sid, None)
+
+class SQLiteSessionBackend:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, sid: str) -> Optional[bytes]:
+        row = self._conn().execute("SELECT data FROM sessions WHERE sid = ? AND expires_at >= ?", (sid, time.time())).fetchone()
+        return bytes(row[0]) if row else None
+
+    def store(self, sid: str, blob: bytes, lifetime: int):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("INSERT OR REPLACE INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)", (sid, blob, now + lifetime))
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            conn.execute("DELETE FROM sessions WHERE expires_at < ?", (now,))
+
+    def delete(self, sid: str):
+        self._conn().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, backend, lifetime: int = SESSION_LIFETIME):
+        self.backend = backend
+        self.lifetime = lifetime
+
+    def open_session(self, app, request) -> ServerSession:
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            with tracing.span('session.load'):
+                blob = self.backend.load(sid)
+            if blob is not None:
+                try:
+                    return ServerSession(loads(blob), sid=sid)
+                except ValueError:
+                    pass # Corrupt entry: start over
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session: ServerSession, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and not session.new:
+                self.backend.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not session.modified:
+            return
+
+        with tracing.span('session.store'):
+            self.backend.store(session.sid, dumps(dict(session)), self.lifetime)
+        session.modified = False
+        response.set_cookie(
+            name, session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app))
+
+def create_session_interface() -> ServerSessionInterface:
+    if SESSION_BACKEND == 'sqlite':
+        return ServerSessionInterface(SQLiteSessionBackend(SESSION_DB_PATH))
+    if SESSION_BACKEND != 'memory':
+        raise ValueError(f"Unknown SESSION_BACKEND '{SESSION_BACKEND}' (expected 'memory' or 'sqlite')")
+    return ServerSessionInterface(MemorySessionBackend())
@@ -0,0 +1,170 @@
+from datetime import date, datetime, timedelta
+from itertools import chain
+from typing import Dict, List, Sequence, Tuple
+
+# Slot generation on integer minutes.
+# Times are minutes since midnight of the first day of the range, so gaps and
+# candidate slots for many devices and days are plain integer arithmetic.
+# With NumPy installed the whole fleet/range is computed in one vectorised
+# pass; without it a pure-Python loop over the same integers is used.
+# Strings are only built for the slots that are returned (format_slots).
+#
+# Rules (unchanged from the datetime version):
+# - a day runs 00:00-24:00; bookings count towards the day they start in and
+#   are ignored if they run past midnight
+# - free gaps lie between bookings; candidates start at each gap start and
+#   then every STEP_MINUTES while a SLOT_MINUTES slot still fits the gap
+# - only candidates starting after `now` are offered
+
+try:
+    import numpy as np
+except ImportError:
+    # Optional dependency
+    np = None
+
+MINUTES_PER_DAY = 24 * 60
+SLOT_MINUTES = 4 * 60
+STEP_MINUTES = 60
+
+_HHMM = [f"{m // 60:02d}:{m % 60:02d}" for m in range(MINUTES_PER_DAY)]
+
+Intervals = Tuple[List[int], List[int]] # (starts, ends) in minutes, sorted by start
+
+def to_minutes(intervals: Sequence[Tuple[datetime, datetime]], base: datetime) -> Intervals:
+    """
+    Converts sorted (start, end) datetimes to minutes since base.
+    Starts round down and ends round up, so a booking never shrinks.
+    """
+    starts, ends = [], []
+    for start, end in intervals:
+        starts.append(int((start - base).total_seconds() // 60))
+        ends.append(-int(-(end - base).total_seconds() // 60))
+    return starts, ends
+
+def minutes_since(base: datetime, moment: datetime) -> float:
+    return (moment - base).total_seconds() / 60
+
+def slot_starts(devices: List[Intervals], day_count: int, now: float,
+                duration: int = SLOT_MINUTES, step: int = STEP_MINUTES) -> List[List[List[int]]]:
+    """
+    Slot start minutes for each device and day: result[device][day] is a sorted
+    list of starts, relative to the range start like the input.
+    """
+    if np is not None:
+        return _slot_starts_numpy(devices, day_count, now, duration, step)
+    return [_device_slot_starts(starts, ends, day_count, now, duration, step) for starts, ends in devices]
+
+def _device_slot_starts(starts: List[int], ends: List[int], day_count: int, now: float,
+                        duration: int, step: int) -> List[List[int]]:
+    return [gap_slot_starts(gaps, now, duration, step) for gaps in free_gaps(starts, ends, day_count)]
+
+def free_gaps(starts: List[int], ends: List[int], day_count: int) -> List[List[Tuple[int, int]]]:
+    """
+    Free (start, end) minutes per day between the intervals, by the rules above;
+    relative to the range start like the input.
+    """
+    days: List[List[Tuple[int, int]]] = [[] for _ in range(day_count)]
+    pointers = [d * MINUTES_PER_DAY for d in range(day_count)]
+
+    for start, end in zip(starts, ends):
+        day = start // MINUTES_PER_DAY
+        if day < 0 or day >= day_count or end > (day + 1) * MINUTES_PER_DAY:
+            continue
+        if start > pointers[day]:
+            days[day].append((pointers[day], start))
+        pointers[day] = max(pointers[day], end)
+
+    for day in range(day_count):
+        if pointers[day] < (day + 1) * MINUTES_PER_DAY:
+            days[day].append((pointers[day], (day + 1) * MINUTES_PER_DAY))
+    return days
+
+def gap_slot_starts(gaps: Sequence[Tuple[int, int]], now: float, duration: int, step: int) -> List[int]:
+    """
+    Candidate starts within free gaps: each gap start, then every step while a
+    slot still fits, skipping those at or before now.
+    """
+    found: List[int] = []
+    for gap_start, gap_end in gaps:
+        first = gap_start
+        if first <= now:
+            # Skip candidates that have already started
+            first += (int(now - gap_start) // step + 1) * step
+        found.extend(range(first, gap_end - duration + 1, step))
+    return found
+
+def _slot_starts_numpy(devices: List[Intervals], day_count: int, now: float,
+                       duration: int, step: int) -> List[List[List[int]]]:
+    # Lay devices end to end on one time axis so the fleet is a single pass.
+    # Global day index = device * day_count + day.
+    span = day_count * MINUTES_PER_DAY
+    total_days = len(devices) * day_count
+    counts = [len(starts) for starts, _ in devices]
+    total = sum(counts)
+    s = np.fromiter(chain.from_iterable(starts for starts, _ in devices), dtype=np.int64, count=total)
+    e = np.fromiter(chain.from_iterable(ends for _, ends in devices), dtype=np.int64, count=total)
+    # Drop bookings outside the range or running past midnight, then shift onto the shared axis
+    keep = (s >= 0) & (s < span) & (e <= (s // MINUTES_PER_DAY + 1) * MINUTES_PER_DAY)
+    offset = np.repeat(np.arange(len(devices), dtype=np.int64) * span, counts)[keep]
+    s = s[keep] + offset
+    e = e[keep] + offset
+    day = s // MINUTES_PER_DAY
+
+    boundaries = np.arange(total_days + 1, dtype=np.int64) * MINUTES_PER_DAY
+
+    # Gap before each booking: from the furthest end so far (or midnight) to its start.
+    # Ends from earlier days never pass this day's midnight, so a running max is safe.
+    prev_end = np.empty_like(e)
+    if len(e):
+        prev_end[0] = 0
+        prev_end[1:] = np.maximum.accumulate(e)[:-1]
+    before_start = np.maximum(prev_end, day * MINUTES_PER_DAY)
+
+    # Gap after each day's last booking, up to midnight
+    last_end = boundaries[:-1].copy()
+    np.maximum.at(last_end, day, e)
+
+    gap_start = np.concatenate([before_start, last_end])
+    gap_end = np.concatenate([s, boundaries[1:]])
+    order = np.argsort(gap_start, kind='stable')
+    gap_start, gap_end = gap_start[order], gap_end[order]
+
+    # Expand every gap into its candidate starts
+    length = gap_end - gap_start
+    counts = np.where(length >= duration, (length - duration) // step + 1, 0)
+    first = np.cumsum(counts) - counts
+    owner = np.repeat(np.arange(len(counts)), counts)
+    candidates = gap_start[owner] + (np.arange(int(counts.sum())) - first[owner]) * step
+    candidates = candidates[candidates - (candidates // span) * span > now]
+
+    # Shift back to each device's own axis, then split per device/day.
+    # Slicing plain lists is much cheaper than many small array slices.
+    cuts = np.searchsorted(candidates, boundaries).tolist()
+    local = (candidates - (candidates // span) * span).tolist()
+    return [[local[cuts[i * day_count + d]:cuts[i * day_count + d + 1]] for d in range(day_count)]
+            for i in range(len(devices))]
+
+def format_slots(starts: List[int], first_day: date, duration: int = SLOT_MINUTES) -> List[Dict]:
+    """
+    Builds the API slot dicts ({"start", "end", "label"}) for start minutes
+    relative to midnight of first_day.
+    """
+    dates: Dict[int, str] = {}
+
+    def day_str(day: int) -> str:
+        text = dates.get(day)
+        if text is None:
+            text = dates[day] = (first_day + timedelta(days=day)).isoformat()
+        return text
+
+    slots = []
+    for start in starts:
+        end = start + duration
+        start_hhmm = _HHMM[start % MINUTES_PER_DAY]
+        end_hhmm = _HHMM[end % MINUTES_PER_DAY]
+        slots.append({
+            "start": f"{day_str(start // MINUTES_PER_DAY)}T{start_hhmm}:00",
+            "end": f"{day_str(end // MINUTES_PER_DAY)}T{end_hhmm}:00",
+            "label": f"{start_hhmm} - {end_hhmm}"
+        })
+    return slots
@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import re
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional
+
+from services import metrics
+
+# Correlation ids, spans and structured logging.
+# Each incoming request gets a request id (taken from X-Request-ID when the
+# caller sent a sane one). It lives in a contextvar, is attached to every log
+# line, and http_client forwards it on outbound calls, so loopback booking API
+# calls log under the same id as the chat turn that made them.
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower() # json | text
+
+_request_id: ContextVar[Optional[str]] = ContextVar('request_id', default=None)
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: ts, level, logger, message, request_id and any
+    fields passed as extra={"fields": {...}}.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = _request_id.get()
+        if request_id:
+            entry["request_id"] = request_id
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+_configured = False
+
+def configure_logging():
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    handler = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    root = logging.getLogger('bookingbot')
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Logger under the 'bookingbot' hierarchy, e.g. get_logger('booking_transport').
+    """
+    configure_logging()
+    return logging.getLogger(f'bookingbot.{name}')
+
+log = get_logger('tracing')
+
+def start_request(incoming_id: Optional[str] = None) -> str:
+    """
+    Sets the request id for the current context and returns it.
+    """
+    request_id = incoming_id if incoming_id and _VALID_REQUEST_ID.match(incoming_id) else uuid.uuid4().hex[:16]
+    _request_id.set(request_id)
+    return request_id
+
+def wsgi_middleware(wsgi_app):
+    """
+    Sets the request id before Flask opens the session, so session I/O is
+    attributed to the right request.
+    """
+    def app(environ, start_response):
+        start_request(environ.get('HTTP_' + REQUEST_ID_HEADER.upper().replace('-', '_')))
+        return wsgi_app(environ, start_response)
+    return app
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+def finish_request(method: str, route: str, status: int, seconds: float):
+    """
+    Records the per-route timer and writes the access log line.
+    """
+    metrics.HTTP_REQUESTS.observe(seconds, method=method, route=route, status=status)
+    log.info("request", extra={"fields": {
+        "method": method, "route": route, "status": status, "duration_ms": round(seconds * 1000, 2)}})
+
+@contextmanager
+def span(name: str, **fields):
+    """
+    Times a block into bookingbot_span_duration_seconds and logs it at debug level.
+    """
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except BaseException:
+        outcome = 'error'
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        metrics.SPANS.observe(seconds, span=name, outcome=outcome)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("span", extra={"fields": dict(fields, span=name, outcome=outcome,
+                                                     duration_ms=round(seconds * 1000, 3))})
+
+def traced(name: str):
+    """
+    Decorator form of span().
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -34,14 +34,21 @@ async function sendMessage() {
 
     // Show Typing
     showTyping(true);
+    chatPending = true;
 
     try {
         const response = await fetch('/api/chat', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ message: text })
+            body: JSON.stringify({ message: text, stream: true })
         });
 
+        const contentType = response.headers.get('Content-Type') || '';
+        if (response.body && contentType.startsWith('text/event-stream')) {
+            await readStream(response);
+            return;
+        }
+
         const data = await response.json();
 
         // Hide Typing
@@ -51,12 +58,99 @@ async function sendMessage() {
         // Simple formatting: Convert newlines to <br> and bold common headers
         let formattedResp = formatResponse(data.response);
         addMessage(formattedResp, 'bot');
+        watchAvailability(data.watch);
 
     } catch (error) {
         showTyping(false);
         addMessage("Sorry, I'm having trouble connecting to the server.", 'bot');
         console.error('Error:', error);
+    } finally {
+        chatPending = false;
+    }
+}
+
+// Renders server-sent agent events (token / status / done) into one bot message
+async function readStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let streamed = '';
+    let div = null;
+
+    const render = (html) => {
+        if (!div) {
+            showTyping(false);
+            div = document.createElement('div');
+            div.classList.add('message', 'bot');
+            messagesArea.appendChild(div);
+        }
+        div.innerHTML = html;
+        scrollToBottom();
+    };
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        let sep;
+        while ((sep = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, sep);
+            buffer = buffer.slice(sep + 2);
+            const dataLine = frame.split('\n').find(line => line.startsWith('data:'));
+            if (!dataLine) continue;
+
+            const event = JSON.parse(dataLine.slice(5));
+            if (event.type === 'token') {
+                streamed += event.text;
+                render(formatResponse(streamed));
+            } else if (event.type === 'status') {
+                render(formatResponse(streamed) + `<div class="status">${escapeHtml(event.text)}</div>`);
+            } else if (event.type === 'done') {
+                render(formatResponse(event.response));
+                watchAvailability(event.watch);
+            }
+        }
     }
+
+    if (!div) {
+        showTyping(false);
+    }
+}
+
+// Follows /api/changes for the devices/days the chat is looking at (cart and
+// last checked), and tells the user when someone else books one of them
+let changeSource = null;
+let watched = [];
+let chatPending = false; // changes made by our own turn (e.g. confirming) aren't news
+
+function watchAvailability(watch) {
+    if (!watch || !window.EventSource) return;
+    const deviceIds = [...new Set(watch.map(w => w.device_id))].sort().join(',');
+    const current = [...new Set(watched.map(w => w.device_id))].sort().join(',');
+    watched = watch;
+    if (deviceIds === current && changeSource) return;
+
+    if (changeSource) changeSource.close();
+    changeSource = null;
+    if (!deviceIds) return;
+
+    changeSource = new EventSource(`/api/changes?device_ids=${deviceIds}`);
+    changeSource.addEventListener('change', (e) => {
+        if (chatPending) return;
+        const event = JSON.parse(e.data);
+        const hits = watched.filter(w => w.device_id === event.device_id && event.dates.includes(w.date));
+        for (const w of hits) {
+            addMessage(`Availability changed: ${escapeHtml(w.name)} on ${escapeHtml(w.date)} was just booked. Ask again to see what is still free.`, 'notice');
+        }
+    });
+}
+
+function escapeHtml(text) {
+    const span = document.createElement('span');
+    span.textContent = text;
+    return span.innerHTML;
 }
 
 function addMessage(text, sender) {
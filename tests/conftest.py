@@ -0,0 +1,12 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Single-process, offline settings; set before any service module is imported
+os.environ.setdefault('BOOKING_STORE', 'memory')
+os.environ.setdefault('SESSION_BACKEND', 'memory')
+os.environ.setdefault('LLM_PROVIDER', 'fake')
+os.environ.setdefault('LLM_CACHE', 'off')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
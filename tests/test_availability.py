@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from data import bookings_store
+from services import availability_view, booking_manager
+
+@pytest.fixture(scope='module')
+def running_booking():
+    """
+    A booking on device 202 that started an hour ago and is still running.
+    """
+    now = datetime.now().replace(second=0, microsecond=0)
+    midnight = datetime.combine(now.date(), datetime.min.time())
+    start = max(midnight, now - timedelta(hours=1))
+    end = min(start + timedelta(hours=4), midnight + timedelta(days=1))
+    bookings_store.add_bookings([{"booking_id": "TEST-RUNNING-202", "device_id": 202,
+                                  "start_time": start.isoformat(), "end_time": end.isoformat()}])
+    return 202, now.date().isoformat(), end.isoformat(timespec='seconds')
+
+def test_earliest_search_skips_running_booking(running_booking):
+    device_id, today, end = running_booking
+    for slot in booking_manager.find_earliest_slots(device_ids=[device_id], limit=3):
+        assert slot['date'] > today or slot['start'] >= end
+
+@pytest.fixture
+def built_view():
+    view = availability_view.AvailabilityView(booking_manager._free_gaps,
+                                              [d['DeviceId'] for d in booking_manager.DEVICES_DATA],
+                                              booking_manager.BOOKING_HORIZON_DAYS + 1)
+    view.build()
+    return view
+
+def from_view_and_fallback(monkeypatch, view, call):
+    monkeypatch.setattr(availability_view, 'VIEW', view)
+    assert availability_view.gaps_for(202, datetime.now().date(), 1) is not None
+    from_view = call()
+    monkeypatch.setattr(availability_view, 'VIEW', None)
+    return from_view, call()
+
+def test_day_view_matches_fallback(running_booking, built_view, monkeypatch):
+    device_id, today, _ = running_booking
+    from_view, fallback = from_view_and_fallback(
+        monkeypatch, built_view, lambda: booking_manager.get_availability(device_id, today))
+    assert from_view == fallback
+
+def test_batch_view_matches_fallback(running_booking, built_view, monkeypatch):
+    _, today, _ = running_booking
+    last = (datetime.now() + timedelta(days=6)).date().isoformat()
+    device_ids = [d['DeviceId'] for d in booking_manager.DEVICES_DATA]
+    from_view, fallback = from_view_and_fallback(
+        monkeypatch, built_view, lambda: booking_manager.get_availability_batch(device_ids, today, last))
+    assert from_view == fallback
+
+def test_earliest_view_matches_fallback(running_booking, built_view, monkeypatch):
+    device_id, _, _ = running_booking
+    from_view, fallback = from_view_and_fallback(
+        monkeypatch, built_view, lambda: booking_manager.find_earliest_slots(device_ids=[device_id, 101], limit=10))
+    assert from_view == fallback
+
+def test_earliest_reports_malformed_window():
+    for bad in ("9am", "25:00", "10:7"):
+        with pytest.raises(ValueError, match="expected HH:MM"):
+            booking_manager.find_earliest_slots(earliest=bad)
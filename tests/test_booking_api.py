@@ -0,0 +1,82 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from app import app
+from services import booking_manager
+
+DAY = (date.today() + timedelta(days=45)).isoformat()
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+def free_items(device_id: int, count: int):
+    slots = booking_manager.get_availability(device_id, DAY)
+    # Non-overlapping slots: every other 4-hour slot start
+    picked = []
+    for slot in slots:
+        if not picked or slot['start'] >= picked[-1]['end']:
+            picked.append(slot)
+    return [{"DeviceId": device_id, "SlotStart": s['start'], "SlotEnd": s['end']} for s in picked[:count]]
+
+def test_book_replays_with_same_key(client):
+    cart = free_items(102, 1)
+    first = client.post('/api/book', json={"cart": cart}, headers={"Idempotency-Key": "test-replay"})
+    assert first.status_code == 200 and first.json['status'] == 'success'
+    again = client.post('/api/book', json={"cart": cart}, headers={"Idempotency-Key": "test-replay"})
+    assert again.status_code == 200
+    assert again.headers.get('Idempotent-Replayed') == 'true'
+    assert again.json['confirmation_number'] == first.json['confirmation_number']
+
+def test_book_rejects_key_reuse_for_another_cart(client):
+    first, second = free_items(201, 2)
+    assert client.post('/api/book', json={"cart": [first]}, headers={"Idempotency-Key": "test-mismatch"}).status_code == 200
+    response = client.post('/api/book', json={"cart": [second]}, headers={"Idempotency-Key": "test-mismatch"})
+    assert response.status_code == 422
+
+def test_bulk_reports_per_item_results(client):
+    free, taken = free_items(301, 2)
+    assert client.post('/api/book', json={"cart": [taken]}).status_code == 200
+    response = client.post('/api/book/bulk', json={"items": [free, taken]})
+    assert response.status_code == 200
+    assert response.json['status'] == 'partial' and response.json['booked_count'] == 1
+    assert [item['ok'] for item in response.json['items']] == [True, False]
+
+def test_all_or_nothing_conflict_books_nothing(client):
+    free, taken = free_items(103, 2)
+    assert client.post('/api/book', json={"cart": [taken]}).status_code == 200
+    response = client.post('/api/book', json={"cart": [free, taken]})
+    assert response.status_code == 409
+    assert any(s['start'] == free['SlotStart'] for s in booking_manager.get_availability(103, DAY))
+
+def test_validate_converts_times_with_an_offset(client):
+    item = free_items(302, 1)[0]
+    local = datetime.fromisoformat(item['SlotStart']).astimezone()
+    aware = {**item, "SlotStart": local.isoformat(), "SlotEnd": (local + timedelta(hours=4)).isoformat()}
+    response = client.post('/api/cart/validate', json={"cart": [aware]})
+    assert response.status_code == 200 and response.json['valid']
+
+def test_sessions_past_midnight_are_invalid(client):
+    item = {"DeviceId": 302, "SlotStart": f"{DAY}T22:00:00",
+            "SlotEnd": (date.fromisoformat(DAY) + timedelta(days=1)).isoformat() + "T02:00:00"}
+    response = client.post('/api/cart/validate', json={"cart": [item]})
+    assert response.json['items'][0]['problems'][0]['reason'] == 'invalid'
+    assert client.post('/api/book', json={"cart": [item]}).status_code == 409
+
+def test_hold_rejects_bad_ttl(client):
+    cart = free_items(303, 1)
+    for ttl in ("abc", -5, 0):
+        assert client.post('/api/cart/hold', json={"cart": cart, "holder": "test-ttl", "ttl": ttl}).status_code == 400
+    response = client.post('/api/cart/hold', json={"cart": cart, "holder": "test-ttl", "ttl": 10 ** 6})
+    assert response.status_code == 200
+    assert datetime.fromisoformat(response.json['expires_at']) <= datetime.now() + timedelta(seconds=booking_manager.CART_HOLD_SECONDS + 1)
+    client.delete('/api/cart/hold?holder=test-ttl')
+
+def test_batch_rejects_bad_duration_and_ids(client):
+    request = {"device_ids": ["101"], "start_date": DAY}
+    response = client.post('/api/availability/batch', json=request)
+    assert response.status_code == 200 and response.json[0]['device_id'] == 101
+    assert client.post('/api/availability/batch', json={**request, "duration": "x"}).status_code == 400
+    assert client.post('/api/availability/batch', json={**request, "device_ids": ["abc"]}).status_code == 400
+    assert client.post('/api/availability/batch', json={**request, "device_ids": "101"}).status_code == 400
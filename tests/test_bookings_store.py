@@ -0,0 +1,97 @@
+import threading
+import time
+from datetime import date, timedelta
+
+import pytest
+
+from data import bookings_store
+
+DAY = (date.today() + timedelta(days=200)).isoformat()
+
+def booking(booking_id: str, start: str, end: str, device_id: int = 101) -> dict:
+    return {"booking_id": booking_id, "device_id": device_id,
+            "start_time": f"{DAY}T{start}", "end_time": f"{DAY}T{end}"}
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return bookings_store.MemoryBookingStore()
+    return bookings_store.SQLiteBookingStore(str(tmp_path / 'bookings.db'))
+
+def respond(added, conflicts):
+    return {"added": [b['booking_id'] for b in added], "conflicts": [c['conflicts_with'] for c in conflicts]}
+
+def test_overlapping_cart_is_rejected_whole(store):
+    store.add_many([booking("A", "08:00", "12:00")])
+    with pytest.raises(bookings_store.BookingConflictError) as error:
+        store.add_many([booking("B", "13:00", "15:00"), booking("C", "11:00", "13:00")])
+    assert [c['reason'] for c in error.value.conflicts] == ["booked"]
+    # Nothing from the failing cart was written
+    assert store.find_conflicts([booking("D", "13:00", "15:00")]) == []
+
+def test_concurrent_double_book_sqlite(tmp_path):
+    path = str(tmp_path / 'bookings.db')
+    bookings_store.SQLiteBookingStore(path)
+    workers = 8
+    barrier = threading.Barrier(workers)
+    won, lost = [], []
+
+    def book(n):
+        # One store per thread, like separate worker processes on the same file
+        store = bookings_store.SQLiteBookingStore(path)
+        barrier.wait()
+        try:
+            store.add_many([booking(f"B{n}", "08:00", "12:00")])
+            won.append(n)
+        except bookings_store.BookingConflictError:
+            lost.append(n)
+
+    threads = [threading.Thread(target=book, args=(n,)) for n in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(won) == 1 and len(lost) == workers - 1
+    check = bookings_store.SQLiteBookingStore(path)
+    assert len(check.find_sessions(101, *_day_bounds())) == 1
+
+def _day_bounds():
+    from datetime import datetime
+    start = datetime.fromisoformat(f"{DAY}T00:00")
+    return start, start + timedelta(days=1), start + timedelta(days=1)
+
+def test_hold_blocks_others_until_expiry(store):
+    store.hold([booking("H", "08:00", "12:00")], "alice", ttl=0.3)
+    with pytest.raises(bookings_store.BookingConflictError) as error:
+        store.add_many([booking("B", "09:00", "10:00")], holder="bob")
+    assert error.value.conflicts[0]['reason'] == "held"
+    # The holder itself may book over its own hold
+    assert store.find_conflicts([booking("A", "08:00", "12:00")], holder="alice") == []
+    time.sleep(0.35)
+    store.add_many([booking("B", "09:00", "10:00")], holder="bob")
+
+def test_booking_releases_own_holds(store):
+    store.hold([booking("H1", "08:00", "10:00"), booking("H2", "14:00", "16:00")], "alice", ttl=60)
+    store.add_many([booking("A", "08:00", "10:00")], holder="alice")
+    # The unbooked hold went with the booking
+    assert store.find_conflicts([booking("B", "14:00", "16:00")], holder="bob") == []
+
+def test_idempotent_replay(store):
+    cart = [booking("A", "08:00", "12:00")]
+    first, replayed = store.commit(cart, None, False, "key-1", "fp", respond)
+    assert (first, replayed) == ({"added": ["A"], "conflicts": []}, False)
+    again, replayed = store.commit([booking("A2", "08:00", "12:00")], None, False, "key-1", "fp", respond)
+    assert replayed and again == first
+    assert len(store.find_sessions(101, *_day_bounds())) == 1
+
+def test_idempotency_key_mismatch(store):
+    store.commit([booking("A", "08:00", "12:00")], None, False, "key-1", "fp", respond)
+    with pytest.raises(bookings_store.IdempotencyKeyError):
+        store.commit([booking("B", "13:00", "15:00")], None, False, "key-1", "other", respond)
+
+def test_partial_commit_books_what_is_free(store):
+    store.add_many([booking("A", "08:00", "12:00")])
+    cart = [booking("B", "10:00", "11:00"), booking("C", "13:00", "15:00"), booking("D", "14:00", "16:00")]
+    response, _ = store.commit(cart, None, True, None, None, respond)
+    # B clashes with the store, D with C accepted before it
+    assert response == {"added": ["C"], "conflicts": ["A", "C"]}
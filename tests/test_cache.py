@@ -0,0 +1,14 @@
+from services.cache import TTLCache
+
+def test_value_computed_across_an_invalidation_is_not_stored():
+    cache = TTLCache(maxsize=8, ttl=60)
+
+    def compute():
+        # A booking's invalidation lands while the lookup runs
+        cache.invalidate_where(lambda key: True)
+        return "stale"
+
+    assert cache.get_or_set("day", compute) == "stale"
+    assert cache.get("day") is None
+    assert cache.get_or_set("day", lambda: "fresh") == "fresh"
+    assert cache.get("day") == "fresh"
@@ -0,0 +1,92 @@
+from datetime import date, timedelta
+
+from data import bookings_store
+from services import change_feed
+
+DAY = (date.today() + timedelta(days=150)).isoformat()
+
+def test_commit_publishes_change_for_subscribed_device():
+    change_feed.start()
+    store = bookings_store.MemoryBookingStore()
+    watching = change_feed.subscribe([302])
+    other = change_feed.subscribe([303])
+    try:
+        store.add_many([{"booking_id": "FEED-1", "device_id": 302,
+                         "start_time": f"{DAY}T08:00", "end_time": f"{DAY}T12:00"}])
+        event = watching.get(timeout=1)
+        assert event['type'] == 'change' and event['dates'] == [DAY] and event['booking_ids'] == ["FEED-1"]
+        assert other.get(timeout=0.1) is None
+    finally:
+        change_feed.unsubscribe(watching)
+        change_feed.unsubscribe(other)
+
+def test_clear_sends_resync_to_live_and_resuming_subscribers():
+    change_feed.start()
+    store = bookings_store.MemoryBookingStore()
+    live = change_feed.subscribe([302])
+    try:
+        store.add_many([{"booking_id": "FEED-2", "device_id": 302,
+                         "start_time": f"{DAY}T13:00", "end_time": f"{DAY}T17:00"}])
+        seen = live.get(timeout=1)
+        store.clear()
+        assert live.get(timeout=1)['type'] == 'resync'
+        assert store.last_change_seq() == 0
+        # A client that disconnected after the change gets the reset on resume
+        resumed = change_feed.subscribe([302], seen['id'])
+        assert resumed.get(timeout=1)['type'] == 'resync'
+        change_feed.unsubscribe(resumed)
+    finally:
+        change_feed.unsubscribe(live)
+
+def test_sqlite_clear_reaches_other_workers(tmp_path):
+    change_feed.start()
+    path = str(tmp_path / 'bookings.db')
+    writer = bookings_store.SQLiteBookingStore(path)
+    reader = bookings_store.SQLiteBookingStore(path)
+    cursor = reader.last_change_seq()
+    writer.clear()
+    missed = reader.changes_since(cursor)
+    assert missed == [{"seq": cursor + 1, "reset": True}]
+    live = change_feed.subscribe([302])
+    try:
+        # What another worker's poller does with them
+        change_feed._on_store_changes(missed)
+        assert live.get(timeout=1)['type'] == 'resync'
+    finally:
+        change_feed.unsubscribe(live)
+
+def test_asgi_stream_waits_on_event_loop():
+    import asyncio
+    import asgi
+
+    async def run():
+        store = bookings_store.MemoryBookingStore()
+        disconnected = asyncio.Event()
+        bodies = []
+
+        async def receive():
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body":
+                bodies.append(message["body"].decode())
+                if len(bodies) == 1:
+                    # The store notifies from this (event loop) thread here;
+                    # the stream must still wake up for it
+                    store.add_many([{"booking_id": "FEED-3", "device_id": 302,
+                                     "start_time": f"{DAY}T18:00", "end_time": f"{DAY}T22:00"}])
+                else:
+                    disconnected.set()
+
+        scope = {"type": "http", "method": "GET", "path": "/api/changes",
+                 "query_string": b"device_ids=302", "headers": []}
+        before = change_feed.stats()['subscriptions']
+        await asyncio.wait_for(asgi.changes(scope, receive, send), 5)
+        assert change_feed.stats()['subscriptions'] == before
+        return bodies
+
+    change_feed.start()
+    bodies = asyncio.run(run())
+    assert bodies[0] == "retry: 3000\n\n"
+    assert '"FEED-3"' in bodies[1]
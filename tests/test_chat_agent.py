@@ -0,0 +1,27 @@
+from datetime import date, timedelta
+
+from services import chat_agent, intent_parser
+
+DAY = (date.today() + timedelta(days=60)).isoformat()
+
+class Session(dict):
+    # The parts of a Flask session execute_tool uses
+    modified = False
+
+def test_booking_a_named_device_ignores_the_last_checked_one():
+    session = Session(llm_context={})
+    chat_agent.execute_tool({"action": "check_availability",
+                             "params": {"device_code": "B737-8-MIA-#1", "date": DAY}}, session)
+    assert session['llm_context']['last_device_id'] == 101
+
+    data = intent_parser.parse(f"book B787-9-MIA-#1 on {DAY} at 18:00", session)
+    assert data['action'] == 'add_to_cart'
+    reply = chat_agent.execute_tool(data, session)
+    assert [item['DeviceId'] for item in session['cart']] == [103], reply
+
+def test_lookups_use_the_device_catalog():
+    assert chat_agent._resolve_campus_id({"campus_name": "Gatwick campus"}) == 2
+    assert chat_agent._resolve_campus_id({"campus_name": "Paris"}) is None
+    assert chat_agent._resolve_device_id("b787-9-mia-#1") == 103
+    # No exact code: the first partial match
+    assert chat_agent._resolve_device_id("B737-8-MIA") == 101
@@ -0,0 +1,15 @@
+from services import intent_parser
+
+def test_duration_is_passed_on():
+    session = {"llm_context": {}}
+    booking = intent_parser.parse("book B737-8-MIA-#1 on 2030-01-10 at 18:00 for 2 hours", session)
+    assert booking == {"action": "add_to_cart", "params": {"start_time": "18:00", "device_code": "B737-8-MIA-#1",
+                                                           "date": "2030-01-10", "duration_hours": 2}}
+    check = intent_parser.parse("availability for B737-8-MIA-#1 on 2030-01-10 for 6 hour sessions", session)
+    assert check['params']['duration_hours'] == 6
+    assert intent_parser.parse("book B737-8-MIA-#1 on 2030-01-10 at 9 for 90 min", session)['params'] == {
+        "start_time": "09:00", "device_code": "B737-8-MIA-#1", "date": "2030-01-10", "duration_hours": 1.5}
+
+def test_unreadable_duration_goes_to_llm():
+    session = {"llm_context": {}}
+    assert intent_parser.parse("book B737-8-MIA-#1 on 2030-01-10 at 18:00 for two hours", session) is None
@@ -1,3 +1,8 @@
+from dotenv import load_dotenv
+
+# Before the service imports: the booking store and transports read their settings on import
+load_dotenv()
+
 from services import booking_service
 from datetime import datetime, timedelta
 